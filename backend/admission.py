@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict
+
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+logger = logging.getLogger(__name__)
+
+# Requests per second admitted per model and the burst allowed above that
+# rate. The rate halves on every throttle and recovers gradually on success,
+# never exceeding the configured value. With the default of 0 there is no
+# fixed limit: calls are only limited after Bedrock throttles them, starting
+# from the rate that was getting through, until the rate has recovered.
+BEDROCK_RATE_LIMIT_RPS = float(os.getenv('BEDROCK_RATE_LIMIT_RPS', '0'))
+BEDROCK_RATE_BURST = int(os.getenv('BEDROCK_RATE_BURST', '10'))
+BEDROCK_MIN_RATE_RPS = float(os.getenv('BEDROCK_MIN_RATE_RPS', '0.5'))
+# Admissions over this many seconds give the observed request rate
+RATE_WINDOW_SECONDS = 10.0
+
+# Callers allowed to wait for admission per model, and the longest wait
+BEDROCK_MAX_QUEUE = int(os.getenv('BEDROCK_MAX_QUEUE', '64'))
+BEDROCK_QUEUE_TIMEOUT_SECONDS = float(os.getenv('BEDROCK_QUEUE_TIMEOUT_SECONDS', '20'))
+
+# Retries of throttled or transiently failing calls, with jittered backoff
+BEDROCK_MAX_RETRIES = int(os.getenv('BEDROCK_MAX_RETRIES', '3'))
+BEDROCK_RETRY_BASE_SECONDS = float(os.getenv('BEDROCK_RETRY_BASE_SECONDS', '0.5'))
+BEDROCK_RETRY_MAX_SECONDS = float(os.getenv('BEDROCK_RETRY_MAX_SECONDS', '8'))
+
+# Consecutive failed requests that open the circuit, and how long it stays open
+BEDROCK_BREAKER_THRESHOLD = int(os.getenv('BEDROCK_BREAKER_THRESHOLD', '5'))
+BEDROCK_BREAKER_COOLDOWN_SECONDS = float(os.getenv('BEDROCK_BREAKER_COOLDOWN_SECONDS', '30'))
+
+THROTTLE_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException"}
+TRANSIENT_ERROR_CODES = {
+    "ServiceUnavailableException", "InternalServerException",
+    "ModelNotReadyException", "ModelTimeoutException"
+}
+
+class AdmissionError(Exception):
+    """A model call was refused before or after retrying"""
+    
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = max(retry_after, 1.0)
+
+class ModelBusyError(AdmissionError):
+    """The model is rate limited; the caller should retry later (HTTP 429)"""
+
+class ModelUnavailableError(AdmissionError):
+    """The model is failing and calls are short-circuited (HTTP 503)"""
+
+def _error_code(error: Exception) -> str:
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code', '')
+    return ''
+
+def is_throttle(error: Exception) -> bool:
+    return _error_code(error) in THROTTLE_ERROR_CODES
+
+def is_transient(error: Exception) -> bool:
+    return (
+        _error_code(error) in TRANSIENT_ERROR_CODES
+        or isinstance(error, (BotoConnectionError, HTTPClientError))
+    )
+
+class TokenBucket:
+    """Reservation-based token bucket with an adjustable rate.
+    
+    A rate of 0 admits everything. Without a configured rate the bucket
+    starts limiting on the first throttle, at half the rate observed then,
+    and stops again once the rate has recovered to that observed rate.
+    """
+    
+    def __init__(self, rate: float, burst: int):
+        self.max_rate = rate
+        self.rate = rate
+        # Rate recovered towards: the configured rate, or the observed rate
+        # when limiting started
+        self.ceiling = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._admissions: Deque[float] = deque()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def _record_admission(self, at: float):
+        self._admissions.append(at)
+        while at - self._admissions[0] > RATE_WINDOW_SECONDS:
+            self._admissions.popleft()
+    
+    def observed_rate(self) -> float:
+        """Admissions per second over the last RATE_WINDOW_SECONDS"""
+        now = time.monotonic()
+        while self._admissions and now - self._admissions[0] > RATE_WINDOW_SECONDS:
+            self._admissions.popleft()
+        if not self._admissions:
+            return 0.0
+        return len(self._admissions) / max(now - self._admissions[0], 1.0)
+    
+    @property
+    def throttled(self) -> bool:
+        """Whether the rate is cut back after throttling and has not recovered yet"""
+        return 0 < self.rate < self.ceiling
+    
+    def reserve(self, max_wait: float) -> float:
+        """Take a token and return how long to wait for it, or -1 if that exceeds max_wait"""
+        if self.rate <= 0:
+            self._record_admission(time.monotonic())
+            return 0.0
+        self._refill()
+        wait = max(0.0, (1 - self.tokens) / self.rate)
+        if wait > max_wait:
+            return -1.0
+        self.tokens -= 1
+        self._record_admission(time.monotonic() + wait)
+        return wait
+    
+    def decrease(self, floor: float):
+        """Multiplicative decrease after a throttle"""
+        self._refill()
+        if self.rate <= 0:
+            self.ceiling = self.max_rate or max(self.observed_rate(), floor)
+            self.rate = self.ceiling
+            self.tokens = min(self.tokens, 1.0)
+        self.rate = max(floor, self.rate / 2)
+    
+    def increase(self):
+        """Additive increase after a success"""
+        if self.rate <= 0 or self.rate >= self.ceiling:
+            return
+        self._refill()
+        self.rate = min(self.ceiling, self.rate + self.ceiling / 20)
+        if not self.max_rate and self.rate >= self.ceiling:
+            # Recovered to where throttling started; stop limiting
+            self.rate = 0.0
+
+class CircuitBreaker:
+    """Opens after consecutive failures; lets one trial call through after the cooldown"""
+    
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.opened = 0
+    
+    def check(self):
+        """Raise ModelUnavailableError unless a call may proceed"""
+        if self.state == "open":
+            remaining = self.open_until - time.monotonic()
+            if remaining > 0:
+                raise ModelUnavailableError("AI model is temporarily unavailable", retry_after=remaining)
+            self.state = "half_open"
+            self.trial_in_flight = False
+        if self.state == "half_open":
+            if self.trial_in_flight:
+                raise ModelUnavailableError("AI model is recovering, please retry shortly", retry_after=1.0)
+            self.trial_in_flight = True
+    
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.trial_in_flight = False
+    
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                self.opened += 1
+                logger.error(f"❌ Circuit opened after {self.failures} failures, cooling down {self.cooldown}s")
+            self.state = "open"
+            self.open_until = time.monotonic() + self.cooldown
+            self.trial_in_flight = False
+    
+    def release_trial(self):
+        """End a half-open trial that neither succeeded nor failed (e.g. a client error)"""
+        self.trial_in_flight = False
+
+class ModelAdmission:
+    """Admission control for calls to one model"""
+    
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.bucket = TokenBucket(BEDROCK_RATE_LIMIT_RPS, BEDROCK_RATE_BURST)
+        self.breaker = CircuitBreaker(BEDROCK_BREAKER_THRESHOLD, BEDROCK_BREAKER_COOLDOWN_SECONDS)
+        self.max_queue = BEDROCK_MAX_QUEUE
+        self.queue_timeout = BEDROCK_QUEUE_TIMEOUT_SECONDS
+        self.waiting = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.retries = 0
+        self.throttles = 0
+        self.failures = 0
+    
+    async def _admit(self):
+        """Wait for a rate-limit token within the bounded queue"""
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise ModelBusyError("Too many requests waiting for the AI model", retry_after=1.0)
+        wait = self.bucket.reserve(self.queue_timeout)
+        if wait < 0:
+            self.rejected += 1
+            raise ModelBusyError("AI model rate limit reached", retry_after=self.queue_timeout)
+        if wait > 0:
+            self.waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self.waiting -= 1
+        self.admitted += 1
+    
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(BEDROCK_RETRY_MAX_SECONDS, BEDROCK_RETRY_BASE_SECONDS * 2 ** attempt))
+    
+    async def call(self, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Run a model call under rate limiting, retries and the circuit breaker"""
+        attempt = 0
+        while True:
+            self.breaker.check()
+            try:
+                await self._admit()
+            except BaseException:
+                # Refused or cancelled (e.g. the client went away) while waiting
+                self.breaker.release_trial()
+                raise
+            
+            self.in_flight += 1
+            try:
+                result = await func()
+            except Exception as e:
+                throttled = is_throttle(e)
+                if not (throttled or is_transient(e)):
+                    # Request errors say nothing about model health
+                    self.breaker.release_trial()
+                    raise
+                if throttled:
+                    self.throttles += 1
+                    self.bucket.decrease(BEDROCK_MIN_RATE_RPS)
+                if attempt < BEDROCK_MAX_RETRIES:
+                    delay = self._backoff(attempt)
+                    attempt += 1
+                    self.retries += 1
+                    self.breaker.release_trial()
+                    logger.warning(f"⚠️ {self.model_id} call failed ({_error_code(e) or type(e).__name__}), retry {attempt} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                self.failures += 1
+                self.breaker.record_failure()
+                if throttled:
+                    raise ModelBusyError("AI model is busy, please retry shortly", retry_after=2.0) from e
+                raise ModelUnavailableError("AI model is temporarily unavailable", retry_after=5.0) from e
+            except BaseException:
+                # Cancelled mid-call: the outcome is unknown, so a half-open
+                # trial is handed to the next caller rather than left pending
+                self.breaker.release_trial()
+                raise
+            finally:
+                self.in_flight -= 1
+            
+            self.breaker.record_success()
+            self.bucket.increase()
+            return result
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "circuit": self.breaker.state,
+            "rate_limited": self.bucket.rate > 0,
+            "throttled": self.bucket.throttled,
+            "rate_rps": round(self.bucket.rate, 3),
+            "observed_rps": round(self.bucket.observed_rate(), 3),
+            "queue_depth": self.waiting,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "throttles": self.throttles,
+            "failures": self.failures,
+            "circuit_opens": self.breaker.opened
+        }
+
+class AdmissionController:
+    """Per-model admission control for Bedrock calls"""
+    
+    def __init__(self):
+        self.models: Dict[str, ModelAdmission] = {}
+    
+    def for_model(self, model_id: str) -> ModelAdmission:
+        admission = self.models.get(model_id)
+        if admission is None:
+            admission = self.models[model_id] = ModelAdmission(model_id)
+        return admission
+    
+    async def call(self, model_id: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Run ``func`` (a fresh call per attempt) under the model's admission control"""
+        return await self.for_model(model_id).call(func)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {model_id: admission.stats() for model_id, admission in self.models.items()}
+
+# Create a singleton instance
+admission_controller = AdmissionController()
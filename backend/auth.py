@@ -1,41 +1,46 @@
-from passlib.context import CryptContext
 from models import User
+from password_hashing import password_hasher, HashingBusyError
+from session_store import create_session_store
 from typing import Optional
+import uuid
 
-# Password hashing only (no JWT)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing only (no JWT); bcrypt runs in password_hashing's worker pool
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+    verified, _ = await password_hasher.verify_and_update(plain_password, hashed_password)
+    return verified
 
-def get_password_hash(password: str) -> str:
+async def get_password_hash(password: str) -> str:
     """Hash a password"""
-    return pwd_context.hash(password)
+    return await password_hasher.hash(password)
 
 async def authenticate_user(email: str, password: str) -> Optional[User]:
     """Authenticate user with email and password"""
     user = await User.get_by_email(email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    if not verified:
         return None
+    if new_hash:
+        # Stored hash used an outdated cost factor; upgrade it transparently
+        await user.update(hashed_password=new_hash)
     return user
 
-# Simple session storage (in production, use Redis or database)
-active_sessions = {}
+# Session storage (memory, postgres or redis, see session_store.py)
+session_store = create_session_store()
 
-def create_session(user: User) -> str:
-    """Create a simple session"""
-    import uuid
+async def create_session(user: User) -> str:
+    """Create a session for a user"""
     session_id = str(uuid.uuid4())
-    active_sessions[session_id] = user.id
+    await session_store.create(session_id, user.id)
     return session_id
 
-def get_user_from_session(session_id: str) -> Optional[str]:
+async def get_user_from_session(session_id: str) -> Optional[str]:
     """Get user ID from session"""
-    return active_sessions.get(session_id)
+    return await session_store.get(session_id)
 
-def delete_session(session_id: str):
+async def delete_session(session_id: str):
     """Delete a session"""
-    active_sessions.pop(session_id, None)
+    await session_store.delete(session_id)
@@ -1,104 +1,290 @@
 import boto3
 import json
 import logging
+import asyncio
+import threading
+import time
 from typing import Optional, List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import os
 
+from admission import admission_controller, AdmissionError
+from model_router import model_router
+from prompt_context import context_assembler
+from response_cache import response_cache
+
 logger = logging.getLogger(__name__)
 
+LEGAL_SYSTEM_PROMPT = """You are an intelligent legal assistant for Indifly Ventures. 
+You provide professional legal guidance, contract review, compliance advice, and general legal information.
+Always be helpful, accurate, and professional. If you're unsure about something, say so.
+Never provide advice that could be construed as creating an attorney-client relationship unless explicitly authorized."""
+
 class BedrockService:
     """AWS Bedrock service for AI interactions"""
     
     def __init__(self):
+        # Upper bound on in-flight model calls per process. boto3 clients are
+        # thread-safe, so a single client is shared by every executor thread;
+        # its HTTP pool is sized to match (plus open streams) so calls never
+        # queue on a socket.
+        self.max_concurrency = int(os.getenv('BEDROCK_MAX_CONCURRENCY', '16'))
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix='bedrock'
+        )
+        # Decoded stream events buffered per response before the reader thread
+        # blocks; a slow SSE consumer therefore throttles the upstream read.
+        self.stream_buffer_size = int(os.getenv('BEDROCK_STREAM_BUFFER', '64'))
+        # Streamed answers hold a reader thread for their whole length, so they
+        # get their own pool and limit; a burst of slow streams cannot starve
+        # invoke_model calls (e.g. chat naming) of threads.
+        self.max_streams = int(os.getenv('BEDROCK_MAX_STREAMS', '64'))
+        self.stream_executor = ThreadPoolExecutor(
+            max_workers=self.max_streams,
+            thread_name_prefix='bedrock-stream'
+        )
+        self.stream_slots = asyncio.Semaphore(self.max_streams)
         self.bedrock_client = boto3.client(
             'bedrock-runtime',
             region_name=os.getenv('BEDROCK_REGION', os.getenv('AWS_REGION', 'us-east-1')),
             aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY')
+            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+            # Optional override, e.g. to point the service at a local stub
+            endpoint_url=os.getenv('BEDROCK_ENDPOINT_URL') or None,
+            config=Config(
+                max_pool_connections=self.max_concurrency + self.max_streams,
+                read_timeout=int(os.getenv('BEDROCK_READ_TIMEOUT', '120')),
+                # Retries are handled by the admission controller, which also
+                # adapts the request rate and trips the circuit breaker
+                retries={'mode': 'standard', 'total_max_attempts': 1}
+            )
         )
         
-        # Model configurations
+        # Model configurations. Chat answers use chat_model unless routing
+        # (BEDROCK_ROUTING) sends a request to the router's light model.
         self.chat_model = os.getenv('BEDROCK_MODEL_ID', 'anthropic.claude-3-sonnet-20240229-v1:0')
         self.naming_model = os.getenv('BEDROCK_NAMING_MODEL', 'anthropic.claude-3-haiku-20240307-v1:0')
+        # 0 makes chat answers deterministic, and therefore cacheable
+        self.chat_temperature = float(os.getenv('BEDROCK_CHAT_TEMPERATURE', '0.7'))
+        # Mark the system prompt and attached document as a cacheable prompt
+        # prefix. Only enable for models that support prompt caching.
+        self.prompt_caching = os.getenv('BEDROCK_PROMPT_CACHING', 'false').lower() == 'true'
         
         logger.info(f"🤖 Bedrock service initialized with model: {self.chat_model} in region: {os.getenv('BEDROCK_REGION', os.getenv('AWS_REGION', 'us-east-1'))}")
     
+    async def _run_in_executor(self, func, *args, **kwargs):
+        """Run a blocking boto3 call on the Bedrock thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+    
+    async def _invoke_model(self, model_id: str, body: Dict[str, Any],
+                            call_type: Optional[str] = None) -> Dict[str, Any]:
+        """Invoke a model without blocking the event loop and return the parsed body.
+        
+        Calls of a cacheable ``call_type`` are served from the response cache
+        when an identical request was answered before. Model calls go through
+        the admission controller, which raises AdmissionError when the model is
+        throttled or unavailable.
+        """
+        cache_key = response_cache.key_for(call_type, model_id, body) if call_type else None
+        if cache_key:
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"⚡ Bedrock cache hit for {call_type} call")
+                return {**cached, "cached": True}
+        
+        def _invoke():
+            response = self.bedrock_client.invoke_model(
+                modelId=model_id,
+                contentType='application/json',
+                accept='application/json',
+                body=json.dumps(body)
+            )
+            return json.loads(response['body'].read())
+        
+        started = time.perf_counter()
+        response_body = await admission_controller.call(model_id, lambda: self._run_in_executor(_invoke))
+        if cache_key and response_body.get('content'):
+            latency_ms = int((time.perf_counter() - started) * 1000)
+            await response_cache.set(cache_key, model_id, response_body, latency_ms)
+        return response_body
+    
+    async def _stream_model(self, model_id: str, body: Dict[str, Any]):
+        """Stream decoded response chunks for a model call.
+        
+        The botocore EventStream is blocking, so it is drained on the stream
+        thread pool into a bounded asyncio queue. At most BEDROCK_MAX_STREAMS
+        streams are open at once; further ones wait for a slot. The reader thread waits while
+        the queue is full, and stops (closing the HTTP stream) as soon as the
+        consuming generator is closed or garbage collected. Opening the stream
+        goes through the admission controller; errors after the first event
+        are not retried, since part of the answer was already delivered.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.stream_buffer_size)
+        stop = threading.Event()
+        end_of_stream = object()
+        
+        def _put(item) -> bool:
+            try:
+                future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            except RuntimeError:
+                # Event loop already closed
+                return False
+            while not stop.is_set():
+                try:
+                    future.result(timeout=0.5)
+                    return True
+                except FutureTimeoutError:
+                    continue
+            future.cancel()
+            return False
+        
+        def _open():
+            return self.bedrock_client.invoke_model_with_response_stream(
+                modelId=model_id,
+                contentType='application/json',
+                accept='application/json',
+                body=json.dumps(body)
+            )
+        
+        async with self.stream_slots:
+            response = await admission_controller.call(model_id, lambda: self._run_in_executor(_open))
+            stream = response.get('body')
+            if not stream:
+                return
+            
+            def _read():
+                try:
+                    for event in stream:
+                        if stop.is_set():
+                            break
+                        chunk = event.get('chunk')
+                        if not chunk:
+                            continue
+                        try:
+                            chunk_data = json.loads(chunk.get('bytes').decode())
+                        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                            logger.warning(f"Failed to parse chunk: {e}")
+                            continue
+                        if not _put(chunk_data):
+                            break
+                except Exception as e:
+                    if not stop.is_set():
+                        _put(e)
+                finally:
+                    _put(end_of_stream)
+            
+            loop.run_in_executor(self.stream_executor, _read)
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is end_of_stream:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                stop.set()
+                try:
+                    stream.close()
+                except Exception as e:
+                    logger.debug(f"Error closing Bedrock stream: {e}")
+    
+    @staticmethod
+    def _parse_usage(usage: Dict[str, Any]) -> Dict[str, int]:
+        """Token usage of a call, counting cached prompt tokens as prompt tokens"""
+        cache_read = usage.get('cache_read_input_tokens', 0) or 0
+        cache_write = usage.get('cache_creation_input_tokens', 0) or 0
+        prompt_tokens = (usage.get('input_tokens', 0) or 0) + cache_read + cache_write
+        completion_tokens = usage.get('output_tokens', 0) or 0
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "cache_read_tokens": cache_read,
+            "cache_write_tokens": cache_write
+        }
+    
     async def generate_chat_response(
         self, 
         user_message: str, 
         context_messages: List[Dict[str, str]] = None,
-        user_id: Optional[str] = None
+        user_id: Optional[str] = None,
+        document_text: Optional[str] = None,
+        document_name: Optional[str] = None,
+        document_stable: bool = True
     ) -> Dict[str, Any]:
-        """Generate AI response for chat messages"""
+        """Generate AI response for chat messages.
+        
+        ``document_stable`` says the document text is the same on every turn
+        (the whole document rather than chunks picked for this question), so
+        it can be part of the cached prompt prefix.
+        """
         try:
             logger.info(f"🎯 Generating AI response for user: {user_id}")
             logger.info(f"📝 User message: {user_message[:100]}...")
             
-            # Build the conversation context
-            system_prompt = """You are an intelligent legal assistant for Indifly Ventures. 
-            You provide professional legal guidance, contract review, compliance advice, and general legal information.
-            Always be helpful, accurate, and professional. If you're unsure about something, say so.
-            Never provide advice that could be construed as creating an attorney-client relationship unless explicitly authorized."""
-            
-            # Build conversation history
-            conversation = []
-            if context_messages:
-                for msg in context_messages[-10:]:  # Last 10 messages for context
-                    conversation.append({
-                        "role": msg.get("role", "user"),
-                        "content": msg.get("content", "")
-                    })
-            
-            # Use the user message directly
-            conversation.append({
-                "role": "user",
-                "content": user_message
-            })
+            # Pick the model, then build the conversation within its token budget
+            routing = model_router.route_request(user_id, user_message, context_messages, document_text)
+            model_id = routing["model"]
+            logger.info(f"🧭 Routed to {model_id}: {routing['reason']}")
+            context = context_assembler.assemble(
+                model_id=model_id,
+                system_prompt=LEGAL_SYSTEM_PROMPT,
+                user_message=user_message,
+                history=context_messages,
+                document_text=document_text,
+                document_name=document_name,
+                cache_prefix=self.prompt_caching,
+                document_stable=document_stable
+            )
+            logger.info(f"🧮 Context tokens: {context['token_counts']}")
             
             # Prepare the request body for Claude
             body = {
                 "anthropic_version": "bedrock-2023-05-31",
                 "max_tokens": 4000,
-                "system": system_prompt,
-                "messages": conversation,
-                "temperature": 0.7,
+                "system": context["system"],
+                "messages": context["messages"],
+                "temperature": self.chat_temperature,
                 "top_p": 0.9
             }
             
             # Make the request to Bedrock
-            logger.info(f"🔄 Making request to Bedrock with model: {self.chat_model}")
-            response = self.bedrock_client.invoke_model(
-                modelId=self.chat_model,
-                contentType='application/json',
-                accept='application/json',
-                body=json.dumps(body)
-            )
-            
-            # Parse the response
-            response_body = json.loads(response['body'].read())
+            logger.info(f"🔄 Making request to Bedrock with model: {model_id}")
+            started = time.perf_counter()
+            response_body = await self._invoke_model(model_id, body, call_type="chat")
+            processing_time = time.perf_counter() - started
+            if not response_body.get('cached'):
+                model_router.record_latency(model_id, processing_time)
             logger.info(f"✅ Received response from Bedrock: {len(str(response_body))} characters")
             
             if response_body.get('content') and len(response_body['content']) > 0:
                 ai_response = response_body['content'][0]['text']
                 
-                # Calculate token usage
-                usage = response_body.get('usage', {})
+                # Calculate token usage; cached answers cost no tokens
+                usage = self._parse_usage({} if response_body.get('cached') else response_body.get('usage', {}))
                 
                 return {
                     "content": ai_response,
-                    "model": self.chat_model,
-                    "tokens_used": usage.get('input_tokens', 0) + usage.get('output_tokens', 0),
-                    "processing_time": 0.0,
-                    "usage": {
-                        "prompt_tokens": usage.get('input_tokens', 0),
-                        "completion_tokens": usage.get('output_tokens', 0),
-                        "total_tokens": usage.get('input_tokens', 0) + usage.get('output_tokens', 0)
-                    }
+                    "model": model_id,
+                    "routing": routing,
+                    "tokens_used": usage["total_tokens"],
+                    "processing_time": processing_time,
+                    "cached": bool(response_body.get('cached')),
+                    "context_tokens": context["token_counts"],
+                    "usage": usage
                 }
             else:
                 raise Exception("No content in response")
-                
+        
+        except AdmissionError:
+            # Surfaced to the client as 429/503 with Retry-After
+            raise
         except ClientError as e:
             logger.error(f"❌ Bedrock API error: {e}")
             error_code = e.response.get('Error', {}).get('Code', 'Unknown')
@@ -165,15 +351,7 @@ class BedrockService:
             }
             
             # Make the request to Bedrock
-            response = self.bedrock_client.invoke_model(
-                modelId=self.naming_model,
-                contentType='application/json',
-                accept='application/json',
-                body=json.dumps(body)
-            )
-            
-            # Parse the response
-            response_body = json.loads(response['body'].read())
+            response_body = await self._invoke_model(self.naming_model, body, call_type="naming")
             
             if response_body.get('content') and len(response_body['content']) > 0:
                 suggested_name = response_body['content'][0]['text'].strip()
@@ -190,7 +368,7 @@ class BedrockService:
             else:
                 # Fallback naming
                 return self._generate_fallback_name(message, file_names)
-                
+        
         except Exception as e:
             logger.error(f"Error generating chat name: {e}")
             # Return fallback name
@@ -228,80 +406,105 @@ class BedrockService:
             "suggested_name": name,
             "reasoning": "Generated from message content"
         }
-
+    
     async def generate_chat_response_stream(
         self, 
         user_message: str, 
         context_messages: List[Dict[str, str]] = None,
-        user_id: Optional[str] = None
+        user_id: Optional[str] = None,
+        document_text: Optional[str] = None,
+        document_name: Optional[str] = None,
+        stream_info: Optional[Dict[str, Any]] = None,
+        document_stable: bool = True
     ):
-        """Generate AI response with streaming for chat messages"""
+        """Generate AI response with streaming for chat messages.
+        
+        ``document_stable`` is as for generate_chat_response. Details about
+        the call (model, routing, context token counts and token usage as
+        reported so far) are written to ``stream_info`` when a dict is passed.
+        """
         try:
             logger.info(f"🎯 Generating streaming AI response for user: {user_id}")
             logger.info(f"📝 User message: {user_message[:100]}...")
             
-            # Build the conversation context
-            system_prompt = """You are an intelligent legal assistant for Indifly Ventures. 
-            You provide professional legal guidance, contract review, compliance advice, and general legal information.
-            Always be helpful, accurate, and professional. If you're unsure about something, say so.
-            Never provide advice that could be construed as creating an attorney-client relationship unless explicitly authorized."""
-            
-            # Build conversation history
-            conversation = []
-            if context_messages:
-                for msg in context_messages[-10:]:  # Last 10 messages for context
-                    conversation.append({
-                        "role": msg.get("role", "user"),
-                        "content": msg.get("content", "")
-                    })
-            
-            # Use the user message directly
-            conversation.append({
-                "role": "user",
-                "content": user_message
-            })
+            # Pick the model, then build the conversation within its token budget
+            routing = model_router.route_request(user_id, user_message, context_messages, document_text)
+            model_id = routing["model"]
+            logger.info(f"🧭 Routed to {model_id}: {routing['reason']}")
+            context = context_assembler.assemble(
+                model_id=model_id,
+                system_prompt=LEGAL_SYSTEM_PROMPT,
+                user_message=user_message,
+                history=context_messages,
+                document_text=document_text,
+                document_name=document_name,
+                cache_prefix=self.prompt_caching,
+                document_stable=document_stable
+            )
+            logger.info(f"🧮 Context tokens: {context['token_counts']}")
+            if stream_info is not None:
+                stream_info["model"] = model_id
+                stream_info["routing"] = routing
+                stream_info["context_tokens"] = context["token_counts"]
             
             # Prepare the request body for Claude with streaming
             body = {
                 "anthropic_version": "bedrock-2023-05-31",
                 "max_tokens": 4000,
-                "system": system_prompt,
-                "messages": conversation,
-                "temperature": 0.7,
+                "system": context["system"],
+                "messages": context["messages"],
+                "temperature": self.chat_temperature,
                 "top_p": 0.9
             }
             
-            # Make the streaming request to Bedrock
-            logger.info(f"🔄 Making streaming request to Bedrock with model: {self.chat_model}")
-            response = self.bedrock_client.invoke_model_with_response_stream(
-                modelId=self.chat_model,
-                contentType='application/json',
-                accept='application/json',
-                body=json.dumps(body)
-            )
+            # Deterministic requests answered before are replayed from the cache
+            cache_key = response_cache.key_for("chat", model_id, body)
+            if cache_key:
+                cached = await response_cache.get(cache_key)
+                if cached is not None and cached.get('content'):
+                    logger.info("⚡ Bedrock cache hit for streamed chat call")
+                    yield cached['content'][0]['text']
+                    return
             
-            # Stream the response
-            stream = response.get('body')
-            if stream:
-                for event in stream:
-                    chunk = event.get('chunk')
-                    if chunk:
-                        try:
-                            chunk_data = json.loads(chunk.get('bytes').decode())
-                            if chunk_data.get('type') == 'content_block_delta':
-                                delta = chunk_data.get('delta', {})
-                                if delta.get('type') == 'text_delta':
-                                    text = delta.get('text', '')
-                                    if text:
-                                        yield text
-                            elif chunk_data.get('type') == 'message_stop':
-                                # End of stream
-                                logger.info("✅ Streaming completed successfully")
-                                return
-                        except (json.JSONDecodeError, UnicodeDecodeError) as e:
-                            logger.warning(f"Failed to parse chunk: {e}")
-                            continue
-                            
+            # Make the streaming request to Bedrock
+            logger.info(f"🔄 Making streaming request to Bedrock with model: {model_id}")
+            started = time.perf_counter()
+            parts = []
+            async for chunk_data in self._stream_model(model_id, body):
+                if chunk_data.get('type') == 'message_start':
+                    # Prompt usage arrives first; output tokens follow in message_delta
+                    if stream_info is not None:
+                        stream_info["usage"] = self._parse_usage(chunk_data.get('message', {}).get('usage', {}))
+                elif chunk_data.get('type') == 'message_delta':
+                    usage = stream_info.get("usage") if stream_info is not None else None
+                    if usage is not None:
+                        usage["completion_tokens"] = chunk_data.get('usage', {}).get('output_tokens', 0) or 0
+                        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                elif chunk_data.get('type') == 'content_block_delta':
+                    delta = chunk_data.get('delta', {})
+                    if delta.get('type') == 'text_delta':
+                        text = delta.get('text', '')
+                        if text:
+                            if cache_key:
+                                parts.append(text)
+                            yield text
+                elif chunk_data.get('type') == 'message_stop':
+                    # End of stream
+                    logger.info("✅ Streaming completed successfully")
+                    elapsed = time.perf_counter() - started
+                    model_router.record_latency(model_id, elapsed)
+                    if cache_key and parts:
+                        latency_ms = int(elapsed * 1000)
+                        await response_cache.set(
+                            cache_key, model_id,
+                            {"content": [{"type": "text", "text": "".join(parts)}]},
+                            latency_ms
+                        )
+                    return
+        
+        except AdmissionError:
+            # Surfaced to the client as an error event with a retry hint
+            raise
         except Exception as e:
             logger.error(f"Error in streaming response: {e}")
             yield f"Error: {str(e)}"
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Side-by-side throughput of the database backends behind the execute_* helpers.
+Runs the same read and write mix through the psycopg2 thread pool and the
+asyncpg pool against DATABASE_URL, at increasing concurrency:
+
+    python benchmarks/bench_database.py --queries 2000 --concurrency 1 10 50
+
+Writes go to a temporary table that is dropped afterwards.
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+import database
+from database import (
+    execute_query, execute_query_one, execute_insert, execute_update,
+    initialize_connection_pool, close_connection_pool, close_async_pool
+)
+
+TABLE = "bench_database_rows"
+
+async def one_operation(index: int):
+    """A mix resembling request traffic: mostly point reads, some writes"""
+    kind = index % 10
+    if kind < 6:
+        await execute_query_one(f"SELECT id, payload FROM {TABLE} WHERE id = %s", (f"row-{index % 500}",))
+    elif kind < 8:
+        await execute_query(f"SELECT id FROM {TABLE} WHERE payload LIKE %s ORDER BY id LIMIT 20", ("payload 1%",))
+    elif kind < 9:
+        await execute_insert(f"INSERT INTO {TABLE} (id, payload) VALUES (%s, %s)", (str(uuid.uuid4()), f"payload {index}"))
+    else:
+        await execute_update(f"UPDATE {TABLE} SET payload = %s WHERE id = %s", (f"payload {index}", f"row-{index % 500}"))
+
+async def run(backend: str, queries: int, concurrency: int) -> dict:
+    database.DATABASE_BACKEND = backend
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+    
+    async def timed(index: int):
+        async with slots:
+            started = time.perf_counter()
+            await one_operation(index)
+            latencies.append(time.perf_counter() - started)
+    
+    # Warm up the pool so connection setup is not measured
+    await asyncio.gather(*(timed(index) for index in range(concurrency)))
+    latencies.clear()
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(index) for index in range(queries)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "backend": backend,
+        "concurrency": concurrency,
+        "queries_per_second": queries / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare the psycopg2 and asyncpg query backends")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    args = parser.parse_args()
+    
+    backends = ["psycopg2"] + (["asyncpg"] if database.asyncpg is not None else [])
+    if len(backends) == 1:
+        print("asyncpg is not installed; only the psycopg2 backend is measured")
+    
+    initialize_connection_pool()
+    database.DATABASE_BACKEND = "psycopg2"
+    await database.execute_update(f"CREATE TABLE IF NOT EXISTS {TABLE} (id VARCHAR(36) PRIMARY KEY, payload TEXT)")
+    for index in range(500):
+        await database.execute_update(
+            f"INSERT INTO {TABLE} (id, payload) VALUES (%s, %s) ON CONFLICT (id) DO NOTHING",
+            (f"row-{index}", f"payload {index}")
+        )
+    
+    try:
+        print(f"{'backend':<10} {'conc':>5} {'queries/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+        for concurrency in args.concurrency:
+            for backend in backends:
+                result = await run(backend, args.queries, concurrency)
+                print(
+                    f"{result['backend']:<10} {result['concurrency']:>5} "
+                    f"{result['queries_per_second']:>10.0f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}"
+                )
+    finally:
+        database.DATABASE_BACKEND = "psycopg2"
+        await database.execute_update(f"DROP TABLE IF EXISTS {TABLE}")
+        await close_async_pool()
+        close_connection_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
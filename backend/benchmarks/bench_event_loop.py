@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Concurrent chat answers against a slow stand-in for Bedrock. N answers are
+generated at once through BedrockService.generate_chat_response, with the
+model call either blocking the event loop (as before) or running on the
+Bedrock thread pool. A ticker on the loop measures how long every other
+request (logins, chat lists, health checks) would have stalled:
+
+    python benchmarks/bench_event_loop.py --latency 2 --concurrency 1 4 16
+
+Off the loop, N answers should take about as long as one, up to
+BEDROCK_MAX_CONCURRENCY.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from bedrock_service import BedrockService
+
+class SlowBedrockClient:
+    """Answers every invoke_model call after a fixed, blocking delay"""
+    
+    def __init__(self, latency: float):
+        self.latency = latency
+    
+    def invoke_model(self, **kwargs):
+        time.sleep(self.latency)
+        body = {
+            "content": [{"type": "text", "text": "Stub answer"}],
+            "usage": {"input_tokens": 100, "output_tokens": 10}
+        }
+        return {"body": io.BytesIO(json.dumps(body).encode())}
+
+async def ticker(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """Longest delay beyond ``interval`` between wake-ups of the event loop"""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+async def run(service: BedrockService, mode: str, concurrency: int) -> dict:
+    if mode == "inline":
+        async def _run_inline(func, *args, **kwargs):
+            return func(*args, **kwargs)
+        service._run_in_executor = _run_inline
+    else:
+        service.__dict__.pop("_run_in_executor", None)
+    
+    stop = asyncio.Event()
+    stall = asyncio.create_task(ticker(stop))
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        service.generate_chat_response(f"Question {index}", user_id=f"bench-{index}")
+        for index in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "stall_ms": await stall * 1000
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure event loop stalls during concurrent Bedrock calls")
+    parser.add_argument("--latency", type=float, default=2.0, help="seconds per model call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+    
+    service = BedrockService()
+    service.bedrock_client = SlowBedrockClient(args.latency)
+    print(f"model latency {args.latency}s, BEDROCK_MAX_CONCURRENCY {service.max_concurrency}")
+    
+    print(f"{'mode':<7} {'conc':>5} {'elapsed s':>10} {'x one call':>11} {'stall ms':>9}")
+    for concurrency in args.concurrency:
+        for mode in ("inline", "pool"):
+            result = await run(service, mode, concurrency)
+            print(
+                f"{result['mode']:<7} {result['concurrency']:>5} {result['elapsed_s']:>10.2f} "
+                f"{result['elapsed_s'] / args.latency:>11.1f} {result['stall_ms']:>9.0f}"
+            )
+    service.executor.shutdown(wait=False)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Extraction throughput over generated PDF and DOCX files, at different numbers
+of extraction worker processes:
+
+    python benchmarks/bench_extraction.py --pages 200 --documents 4 --workers 1 2 4 8
+
+Reports pages per second for PDFs and paragraphs per second for DOCX files.
+Workers beyond the number of cores are not expected to help.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+import docx
+
+from text_extraction import ExtractionEngine
+
+WORDS = (
+    "the agreement party shall indemnify licensee pursuant clause termination "
+    "notice confidential governing law arbitration liability warranty"
+).split()
+
+def sentence(rng: random.Random, words: int = 12) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+def write_pdf(path: str, pages: int, lines_per_page: int = 40, seed: int = 1):
+    """Write a PDF of text pages using the built-in Helvetica font"""
+    rng = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for _ in range(pages):
+        lines = [f"({sentence(rng)}) Tj T*" for _ in range(lines_per_page)]
+        stream = ("BT /F1 10 Tf 14 TL 50 780 Td " + " ".join(lines) + " ET").encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages
+    
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(output)
+
+def write_docx(path: str, paragraphs: int, seed: int = 1):
+    """Write a DOCX of paragraphs with a table every 50 paragraphs"""
+    rng = random.Random(seed)
+    document = docx.Document()
+    for index in range(paragraphs):
+        document.add_paragraph(" ".join(sentence(rng) for _ in range(4)))
+        if index % 50 == 49:
+            table = document.add_table(rows=5, cols=4)
+            for cell in table._cells:
+                cell.text = sentence(rng, 4)
+    document.save(path)
+
+async def run(workers: int, files: list, extract: str) -> float:
+    """Seconds to extract all files concurrently with a fresh engine"""
+    engine = ExtractionEngine(workers=workers, timeout=600)
+    try:
+        # Start the pool so process startup is not measured
+        await getattr(engine, extract)(files[0])
+        started = time.perf_counter()
+        results = await asyncio.gather(*(getattr(engine, extract)(path) for path in files))
+        elapsed = time.perf_counter() - started
+    finally:
+        engine.shutdown()
+    if not all(success for _, success in results):
+        raise SystemExit(f"{extract} failed on a generated file")
+    return elapsed
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure extraction throughput against worker count")
+    parser.add_argument("--pages", type=int, default=200, help="pages per PDF")
+    parser.add_argument("--paragraphs", type=int, default=2000, help="paragraphs per DOCX")
+    parser.add_argument("--documents", type=int, default=4, help="documents extracted at once")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        pdfs, docxs = [], []
+        for index in range(args.documents):
+            pdfs.append(os.path.join(directory, f"document-{index}.pdf"))
+            write_pdf(pdfs[-1], args.pages, seed=index)
+            docxs.append(os.path.join(directory, f"document-{index}.docx"))
+            write_docx(docxs[-1], args.paragraphs, seed=index)
+        
+        print(f"{os.cpu_count()} cores, {args.documents} documents of {args.pages} pages / {args.paragraphs} paragraphs")
+        print(f"{'workers':>7} {'PDF pages/s':>12} {'DOCX paragraphs/s':>18}")
+        for workers in sorted(set(args.workers)):
+            pdf_seconds = await run(workers, pdfs, "extract_pdf")
+            docx_seconds = await run(workers, docxs, "extract_docx")
+            print(
+                f"{workers:>7} {args.documents * args.pages / pdf_seconds:>12.0f} "
+                f"{args.documents * args.paragraphs / docx_seconds:>18.0f}"
+            )
+
+if __name__ == "__main__":
+    asyncio.run(main())
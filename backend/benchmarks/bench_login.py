@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Login latency under a burst of concurrent logins. Each login verifies a bcrypt
+hash, either on the event loop (as before) or through the password hashing
+pool. A ticker on the loop measures how long other requests would stall:
+
+    python benchmarks/bench_login.py --logins 64 --concurrency 1 8 32 --rounds 12
+
+Rejected logins are the ones the pending cap turned away with a 429.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+PASSWORD = "correct horse battery staple"
+
+async def ticker(stop: asyncio.Event, interval: float = 0.005) -> float:
+    """Longest delay beyond ``interval`` between wake-ups of the event loop"""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+async def run(mode: str, hashed: str, logins: int, concurrency: int) -> dict:
+    from password_hashing import PasswordHasher, HashingBusyError, pwd_context
+    
+    hasher = PasswordHasher()
+    latencies = []
+    rejected = 0
+    slots = asyncio.Semaphore(concurrency)
+    
+    async def login():
+        nonlocal rejected
+        async with slots:
+            started = time.perf_counter()
+            try:
+                if mode == "inline":
+                    pwd_context.verify_and_update(PASSWORD, hashed)
+                else:
+                    await hasher.verify_and_update(PASSWORD, hashed)
+            except HashingBusyError:
+                rejected += 1
+                return
+            latencies.append(time.perf_counter() - started)
+    
+    if mode == "pool":
+        # Start the worker processes so their startup is not measured
+        await asyncio.gather(*(hasher.verify_and_update(PASSWORD, hashed) for _ in range(max(hasher.workers, 1))))
+    
+    stop = asyncio.Event()
+    stall = asyncio.create_task(ticker(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    worst_stall = await stall
+    hasher.shutdown()
+    
+    latencies.sort()
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "logins_per_second": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000,
+        "rejected": rejected,
+        "stall_ms": worst_stall * 1000
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure login latency with and without the hashing pool")
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    args = parser.parse_args()
+    
+    # The hashing module reads its configuration at import
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    from password_hashing import pwd_context, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING
+    hashed = pwd_context.hash(PASSWORD)
+    print(f"bcrypt rounds {args.rounds}, {PASSWORD_HASH_WORKERS} workers, {PASSWORD_HASH_MAX_PENDING} pending allowed")
+    
+    print(f"{'mode':<7} {'conc':>5} {'logins/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'rejected':>9} {'stall ms':>9}")
+    for concurrency in args.concurrency:
+        for mode in ("inline", "pool"):
+            result = await run(mode, hashed, args.logins, concurrency)
+            print(
+                f"{result['mode']:<7} {result['concurrency']:>5} {result['logins_per_second']:>9.1f} "
+                f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['rejected']:>9} {result['stall_ms']:>9.1f}"
+            )
+
+if __name__ == "__main__":
+    asyncio.run(main())
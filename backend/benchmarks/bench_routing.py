@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Replays a captured request log through the model router and compares the
+estimated latency and cost with what was actually served:
+
+    python benchmarks/bench_routing.py export > requests.jsonl
+    python benchmarks/bench_routing.py replay requests.jsonl
+
+Routing settings (BEDROCK_ROUTER_*, BEDROCK_USER_MODEL_POLICY, pricing) are
+read from the environment as in the API; replays always route.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from model_router import ModelRouter
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def _fit_latency(records: List[Dict[str, Any]], pricing: Dict[str, Dict[str, float]]) -> Dict[str, tuple]:
+    """Per-model (first token seconds, output tokens per second) from the log, else the pricing table"""
+    models = {record["model"] for record in records} | set(pricing)
+    fitted = {}
+    for model in models:
+        samples = [
+            (record["completion_tokens"], record["latency_seconds"])
+            for record in records
+            if record["model"] == model and record.get("latency_seconds")
+        ]
+        defaults = pricing.get(model, {})
+        base = defaults.get("first_token_seconds", 1.0)
+        speed = defaults.get("output_tokens_per_second", 60)
+        if len(samples) >= 2 and len({tokens for tokens, _ in samples}) > 1:
+            # Least-squares line: latency = base + tokens / speed
+            slope, intercept = statistics.linear_regression(*zip(*samples))
+            if slope > 0:
+                base, speed = max(intercept, 0.0), 1 / slope
+        fitted[model] = (base, speed)
+    return fitted
+
+def replay(records: Iterable[Dict[str, Any]], router: ModelRouter) -> Dict[str, Any]:
+    """Route each captured request and compare estimated latency and cost with the log.
+    
+    Token counts are assumed not to change with the model. A request kept on
+    its recorded model keeps its recorded latency; a rerouted one gets the
+    latency predicted for the new model.
+    """
+    records = [
+        {
+            "user_id": record.get("user_id"),
+            "model": record.get("model") or router.heavy_model,
+            "message_tokens": int(record.get("message_tokens", 0) or 0),
+            "document_tokens": int(record.get("document_tokens", 0) or 0),
+            "history_tokens": int(record.get("history_tokens", 0) or 0),
+            "prompt_tokens": int(record.get("prompt_tokens", 0) or 0),
+            "completion_tokens": int(record.get("completion_tokens", 0) or 0),
+            "latency_seconds": float(record.get("latency_seconds", 0) or 0)
+        }
+        for record in records
+    ]
+    fitted = _fit_latency(records, router.pricing)
+    
+    def predict(model_id: str, completion_tokens: int) -> float:
+        base, speed = fitted.get(model_id, (1.0, 60))
+        return base + completion_tokens / speed
+    
+    before_latency, after_latency = [], []
+    before_cost = after_cost = 0.0
+    for record in records:
+        decision = router.route(
+            user_id=record["user_id"],
+            message_tokens=record["message_tokens"],
+            document_tokens=record["document_tokens"],
+            history_tokens=record["history_tokens"]
+        )
+        usage = {"prompt_tokens": record["prompt_tokens"], "completion_tokens": record["completion_tokens"]}
+        recorded = record["latency_seconds"] or predict(record["model"], record["completion_tokens"])
+        before_latency.append(recorded)
+        after_latency.append(
+            recorded if decision["model"] == record["model"]
+            else predict(decision["model"], record["completion_tokens"])
+        )
+        before_cost += router.estimate_cost(record["model"], usage)
+        after_cost += router.estimate_cost(decision["model"], usage)
+    
+    def summary(latencies: List[float], cost: float) -> Dict[str, float]:
+        return {
+            "latency_p50_seconds": round(_percentile(latencies, 0.5), 3),
+            "latency_p95_seconds": round(_percentile(latencies, 0.95), 3),
+            "latency_mean_seconds": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+            "cost_usd": round(cost, 4)
+        }
+    
+    return {
+        "requests": len(records),
+        "recorded": summary(before_latency, before_cost),
+        "routed": summary(after_latency, after_cost),
+        "routing": router.stats()["routed"],
+        "reasons": router.stats()["reasons"]
+    }
+
+async def export_log(limit: int):
+    """Print recent answered requests from the database as a JSONL request log"""
+    from dotenv import load_dotenv
+    from database import initialize_connection_pool, close_connection_pool, close_async_pool
+    from models import AIUsage
+    
+    load_dotenv()
+    initialize_connection_pool()
+    try:
+        for record in await AIUsage.get_request_log(limit=limit):
+            print(json.dumps(record, default=str))
+    finally:
+        await close_async_pool()
+        close_connection_pool()
+
+def main():
+    parser = argparse.ArgumentParser(description="Model routing tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write a request log from the database")
+    export_parser.add_argument("--limit", type=int, default=10000)
+    replay_parser = subparsers.add_parser("replay", help="Replay a request log through the router")
+    replay_parser.add_argument("log", help="JSONL request log ('-' for stdin)")
+    args = parser.parse_args()
+    
+    if args.command == "export":
+        asyncio.run(export_log(args.limit))
+        return
+    
+    handle = sys.stdin if args.log == "-" else open(args.log)
+    with handle:
+        records = [json.loads(line) for line in handle if line.strip()]
+    # Replays always route, whatever BEDROCK_ROUTING is set to
+    print(json.dumps(replay(records, ModelRouter(enabled=True)), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Bytes, frames and CPU per streamed answer. Answers arrive as token-sized
+deltas at a fixed rate from a stand-in model, and go through the same path as
+a chat stream: coalesce() into pieces, then SSEEncoder frames. Each coalescing
+window is compared with sending every delta as its own frame (window 0):
+
+    python benchmarks/bench_sse.py --answers 20 --tokens 400 --tokens-per-second 200 --windows 0 30 100
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+import sse
+from sse import SSEEncoder, coalesce
+
+# Token-sized pieces of a legal answer, some of them non-ASCII
+TOKENS = [" the", " agreement", " shall", " party", " clause", ",", ".", " §", " 12", "’s", " —", " notice", "\n\n"]
+
+async def model_answer(tokens: int, interval: float, seed: int):
+    """Deltas at a fixed rate, like a model streaming its answer"""
+    rng = random.Random(seed)
+    started = time.monotonic()
+    for index in range(tokens):
+        delay = started + index * interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield rng.choice(TOKENS)
+
+async def stream_answer(tokens: int, interval: float, window_ms: float, seed: int) -> SSEEncoder:
+    encoder = SSEEncoder()
+    answer = model_answer(tokens, interval, seed)
+    pieces = coalesce(answer, coalesce_ms=window_ms) if window_ms > 0 else answer
+    event_id = 0
+    async for text in pieces:
+        event_id += 1
+        encoder.frame(event_id, {"type": "content_delta", "content": text})
+    event_id += 1
+    encoder.frame(event_id, {"type": "stream_complete"})
+    return encoder
+
+async def run(answers: int, tokens: int, tokens_per_second: float, window_ms: float) -> dict:
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    encoders = await asyncio.gather(*(
+        stream_answer(tokens, 1 / tokens_per_second, window_ms, seed) for seed in range(answers)
+    ))
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    return {
+        "window_ms": window_ms,
+        "frames": sum(encoder.frames for encoder in encoders) / answers,
+        "bytes": sum(encoder.bytes for encoder in encoders) / answers,
+        "cpu_ms": cpu * 1000 / answers,
+        "encode_ms": sum(encoder.encode_seconds for encoder in encoders) * 1000 / answers,
+        "elapsed_s": elapsed
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure SSE output per streamed answer")
+    parser.add_argument("--answers", type=int, default=20, help="answers streamed at once")
+    parser.add_argument("--tokens", type=int, default=400, help="deltas per answer")
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 30, 100], help="coalescing windows in ms")
+    args = parser.parse_args()
+    
+    print(f"{args.answers} answers of {args.tokens} deltas at {args.tokens_per_second:.0f}/s, JSON via {'orjson' if sse.orjson else 'json'}")
+    print(f"{'window ms':>9} {'frames':>8} {'bytes':>8} {'CPU ms':>8} {'encode ms':>10} {'elapsed s':>10}")
+    for window_ms in args.windows:
+        result = await run(args.answers, args.tokens, args.tokens_per_second, window_ms)
+        print(
+            f"{result['window_ms']:>9.0f} {result['frames']:>8.0f} {result['bytes']:>8.0f} "
+            f"{result['cpu_ms']:>8.1f} {result['encode_ms']:>10.2f} {result['elapsed_s']:>10.2f}"
+        )
+    print("frames, bytes and CPU are per answer")
+
+if __name__ == "__main__":
+    asyncio.run(main())
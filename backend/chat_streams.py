@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import aclosing
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from models import Message
+from sse import SSE_HEARTBEAT_SECONDS, coalesce
+
+logger = logging.getLogger(__name__)
+
+# Partial answers are written to the message at most this often
+STREAM_CHECKPOINT_SECONDS = float(os.getenv('STREAM_CHECKPOINT_SECONDS', '2'))
+# Finished streams stay replayable for this long, for clients reconnecting late
+STREAM_RETENTION_SECONDS = float(os.getenv('STREAM_RETENTION_SECONDS', '120'))
+# Generation is cancelled when no connection has followed it for this long;
+# the grace period lets a dropped client reconnect and resume
+STREAM_ABANDON_SECONDS = float(os.getenv('STREAM_ABANDON_SECONDS', '10'))
+# A message still marked as streaming without a checkpoint for this long is
+# assumed orphaned (the process generating it died), not generating elsewhere
+STREAM_ORPHAN_SECONDS = float(os.getenv('STREAM_ORPHAN_SECONDS', '300'))
+# Weight of the newest answer in the average completion length, used to
+# estimate the output tokens a cancelled answer did not generate
+COMPLETION_TOKENS_ALPHA = 0.1
+
+class ChatStream:
+    """Event log of one answer being generated.
+    
+    Events get consecutive ids starting at 1, so a client can resume after
+    the last id it received. Generation runs in its own task and does not
+    depend on any connection following it.
+    """
+    
+    def __init__(self, message: Message, user_id: str):
+        self.message = message
+        self.user_id = user_id
+        self.events: List[Dict[str, Any]] = []
+        self.content: List[str] = []
+        self.finished = False
+        self.abandoned = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        # Token usage of the answer, set by the producer
+        self.usage: Dict[str, Any] = {}
+        self._abandon_timer: Optional[asyncio.TimerHandle] = None
+        self._changed = asyncio.Event()
+        self._last_checkpoint = time.monotonic()
+        self._checkpointed_length = 0
+    
+    @property
+    def message_id(self) -> str:
+        return self.message.id
+    
+    def publish(self, data: Dict[str, Any]) -> int:
+        """Append an event and wake followers; returns its id"""
+        if self.finished:
+            return len(self.events)
+        self.events.append(data)
+        if data.get("type") == "content_delta":
+            self.content.append(data.get("content", ""))
+        self._notify()
+        return len(self.events)
+    
+    def finish(self):
+        self.finished = True
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+        self._notify()
+    
+    def watch(self):
+        """Cancel generation if nobody follows the stream within STREAM_ABANDON_SECONDS"""
+        if self.finished or self.subscribers:
+            return
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+        self._abandon_timer = asyncio.get_running_loop().call_later(STREAM_ABANDON_SECONDS, self._abandon)
+    
+    def _abandon(self):
+        self._abandon_timer = None
+        if self.finished or self.subscribers or self.task is None or self.task.done():
+            return
+        logger.info(f"✂️ No client following message {self.message_id}, cancelling generation")
+        self.abandoned = True
+        self.task.cancel()
+    
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+    
+    async def follow(self, after_id: int = 0,
+                     heartbeat_seconds: float = SSE_HEARTBEAT_SECONDS) -> AsyncIterator[Optional[Tuple[int, Dict[str, Any]]]]:
+        """Events after ``after_id`` as (id, event), then the live tail.
+        
+        Yields None when nothing happened for ``heartbeat_seconds``.
+        """
+        position = max(after_id, 0)
+        self.subscribers += 1
+        try:
+            while True:
+                while position < len(self.events):
+                    position += 1
+                    yield position, self.events[position - 1]
+                if self.finished:
+                    return
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            self.subscribers -= 1
+            self.watch()
+    
+    def partial_content(self) -> str:
+        return "".join(self.content)
+    
+    async def publish_answer(self, answer: AsyncIterator[str]):
+        """Publish answer text as coalesced content deltas, checkpointing as it goes.
+        
+        The answer generator, and with it the upstream model stream, is
+        closed as soon as this returns or is cancelled, wherever the
+        cancellation lands.
+        """
+        async with aclosing(answer), aclosing(coalesce(answer)) as pieces:
+            async for text in pieces:
+                self.publish({"type": "content_delta", "content": text})
+                await self.checkpoint()
+    
+    async def checkpoint(self, force: bool = False) -> bool:
+        """Write the answer so far to the message, at most every STREAM_CHECKPOINT_SECONDS"""
+        if not force and time.monotonic() - self._last_checkpoint < STREAM_CHECKPOINT_SECONDS:
+            return False
+        content = self.partial_content()
+        if len(content) == self._checkpointed_length:
+            return False
+        self._last_checkpoint = time.monotonic()
+        try:
+            await self.message.update(
+                content=content,
+                metadata={
+                    **(self.message.metadata or {}),
+                    "stream_status": "streaming",
+                    "checkpointed_at": datetime.utcnow().isoformat()
+                }
+            )
+        except Exception as e:
+            # The next checkpoint or the final update will catch up
+            logger.warning(f"⚠️ Failed to checkpoint message {self.message_id}: {e}")
+            return False
+        self._checkpointed_length = len(content)
+        chat_stream_registry.checkpoints += 1
+        return True
+
+class ChatStreamRegistry:
+    """In-flight answers of this process, by message id"""
+    
+    def __init__(self, retention_seconds: float = STREAM_RETENTION_SECONDS):
+        self.retention_seconds = retention_seconds
+        self.streams: Dict[str, ChatStream] = {}
+        self.started = 0
+        self.resumed = 0
+        self.checkpoints = 0
+        self.cancelled = 0
+        self.tokens_generated_cancelled = 0
+        self.tokens_saved = 0
+        self.average_completion_tokens: Optional[float] = None
+    
+    def start(self, message: Message, user_id: str,
+              produce: Callable[[ChatStream], Awaitable[None]]) -> ChatStream:
+        """Run ``produce`` in a detached task that publishes to a new stream"""
+        stream = ChatStream(message, user_id)
+        self.streams[message.id] = stream
+        stream.task = asyncio.create_task(self._run(stream, produce))
+        stream.watch()
+        self.started += 1
+        return stream
+    
+    async def _run(self, stream: ChatStream, produce: Callable[[ChatStream], Awaitable[None]]):
+        try:
+            await produce(stream)
+            self._record_completed(stream)
+        except asyncio.CancelledError:
+            if not stream.abandoned:
+                raise
+            self._record_cancelled(stream)
+        except Exception as e:
+            logger.error(f"❌ Generation of message {stream.message_id} failed: {e}")
+            stream.publish({"type": "error", "error": str(e)})
+        finally:
+            stream.finish()
+            try:
+                asyncio.get_running_loop().call_later(
+                    self.retention_seconds, self.streams.pop, stream.message_id, None
+                )
+            except RuntimeError:
+                self.streams.pop(stream.message_id, None)
+    
+    def _record_completed(self, stream: ChatStream):
+        tokens = stream.usage.get("completion_tokens", 0)
+        if not tokens:
+            return
+        if self.average_completion_tokens is None:
+            self.average_completion_tokens = float(tokens)
+        else:
+            self.average_completion_tokens += COMPLETION_TOKENS_ALPHA * (tokens - self.average_completion_tokens)
+    
+    def _record_cancelled(self, stream: ChatStream):
+        """Count a cancelled answer and estimate the output tokens it saved"""
+        generated = stream.usage.get("completion_tokens", 0)
+        self.cancelled += 1
+        self.tokens_generated_cancelled += generated
+        if self.average_completion_tokens is not None:
+            self.tokens_saved += max(int(self.average_completion_tokens) - generated, 0)
+    
+    def get(self, message_id: str) -> Optional[ChatStream]:
+        return self.streams.get(message_id)
+    
+    def generating_elsewhere(self, message: Message) -> bool:
+        """Whether another process is still generating a message this one does not stream.
+        
+        Streams are local to the process that started them, so with several
+        workers a resume can reach one that only has the last checkpoint.
+        """
+        if message.id in self.streams:
+            return False
+        metadata = message.metadata or {}
+        if metadata.get("stream_status") != "streaming":
+            return False
+        try:
+            last_activity = datetime.fromisoformat(metadata["checkpointed_at"])
+        except (KeyError, TypeError, ValueError):
+            last_activity = message.created_at
+        if not isinstance(last_activity, datetime):
+            return True
+        if last_activity.tzinfo is not None:
+            last_activity = last_activity.astimezone(timezone.utc).replace(tzinfo=None)
+        return (datetime.utcnow() - last_activity).total_seconds() < STREAM_ORPHAN_SECONDS
+    
+    async def shutdown(self, timeout: float = 30):
+        """Give in-flight answers up to ``timeout`` seconds to finish; their checkpoints keep the rest"""
+        tasks = [stream.task for stream in self.streams.values() if stream.task and not stream.task.done()]
+        if tasks:
+            logger.info(f"⏳ Waiting for {len(tasks)} answers in flight")
+            await asyncio.wait(tasks, timeout=timeout)
+    
+    def stats(self) -> Dict[str, Any]:
+        active = [stream for stream in self.streams.values() if not stream.finished]
+        return {
+            "active": len(active),
+            "retained": len(self.streams) - len(active),
+            "subscribers": sum(stream.subscribers for stream in active),
+            "started": self.started,
+            "resumed": self.resumed,
+            "checkpoints": self.checkpoints,
+            "cancelled": self.cancelled,
+            "tokens_generated_cancelled": self.tokens_generated_cancelled,
+            "tokens_saved_estimate": self.tokens_saved,
+            "average_completion_tokens": round(self.average_completion_tokens or 0)
+        }
+
+# Create a singleton instance
+chat_stream_registry = ChatStreamRegistry()
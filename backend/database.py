@@ -6,9 +6,17 @@ from typing import Optional, Dict, Any, List
 from contextlib import contextmanager
 import logging
 import asyncio
+import json
+import re
+from functools import lru_cache
 from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+try:
+    import asyncpg
+except ImportError:  # Optional: only needed for DATABASE_BACKEND=asyncpg
+    asyncpg = None
+
 # Load environment variables first
 load_dotenv()
 
@@ -21,10 +29,25 @@ if not DATABASE_URL:
 
 logger.info(f"Using database: {DATABASE_URL.split('@')[1].split('/')[0] if '@' in DATABASE_URL else 'unknown'}")
 
+# Query backend for the execute_* helpers: "psycopg2" runs queries on a thread
+# pool, "asyncpg" uses a native async pool. DDL (create_tables) always uses psycopg2.
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "psycopg2").lower()
+if DATABASE_BACKEND not in ("psycopg2", "asyncpg"):
+    raise ValueError(f"Unsupported DATABASE_BACKEND: {DATABASE_BACKEND}")
+
+# asyncpg pool configuration
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
 # Connection pool
 connection_pool: Optional[ThreadedConnectionPool] = None
 executor = ThreadPoolExecutor(max_workers=10)
 
+# Native async connection pool (DATABASE_BACKEND=asyncpg)
+async_pool = None
+_async_pool_lock: Optional[asyncio.Lock] = None
+
 def initialize_connection_pool():
     """Initialize the connection pool"""
     global connection_pool
@@ -80,9 +103,103 @@ def get_db_cursor(connection=None):
             finally:
                 cursor.close()
 
+def _encode_json(value: Any) -> str:
+    """Encode JSON parameters; models already pass pre-serialized strings"""
+    return value if isinstance(value, str) else json.dumps(value)
+
+async def _init_async_connection(conn):
+    """Decode json/jsonb columns to Python objects, matching psycopg2"""
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(
+            type_name,
+            encoder=_encode_json,
+            decoder=json.loads,
+            schema="pg_catalog"
+        )
+
+async def get_async_pool():
+    """Get the asyncpg pool, creating it on first use"""
+    global async_pool, _async_pool_lock
+    if async_pool is not None:
+        return async_pool
+    if asyncpg is None:
+        raise RuntimeError("DATABASE_BACKEND=asyncpg requires the asyncpg package")
+    if _async_pool_lock is None:
+        _async_pool_lock = asyncio.Lock()
+    async with _async_pool_lock:
+        if async_pool is None:
+            try:
+                async_pool = await asyncpg.create_pool(
+                    DATABASE_URL,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    command_timeout=DB_STATEMENT_TIMEOUT_MS / 1000 + 5,
+                    server_settings={"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)},
+                    init=_init_async_connection
+                )
+                logger.info(f"✅ asyncpg connection pool initialized ({DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} connections)")
+            except Exception as e:
+                logger.error(f"❌ Failed to initialize asyncpg pool: {e}")
+                raise
+    return async_pool
+
+# Parts of a psycopg2 query that matter when rewriting it for asyncpg: quoted
+# strings, identifiers and comments (where %s is not a placeholder), the %%
+# escape and %s placeholders
+_QUERY_TOKEN = re.compile(r"""
+    (?<!\w)[Ee]'(?:[^'\\]|\\.|'')*'   # escape string literal
+  | '(?:[^']|'')*'                      # string literal
+  | "(?:[^"]|"")*"                      # quoted identifier
+  | \$([A-Za-z_]\w*|)\$.*?\$\1\$        # dollar-quoted string
+  | --[^\n]*                            # line comment
+  | /\*.*?\*/                           # block comment
+  | %%
+  | %s
+""", re.VERBOSE | re.DOTALL)
+
+@lru_cache(maxsize=512)
+def _to_asyncpg_query(query: str, has_params: bool = True) -> str:
+    """Rewrite psycopg2 %s placeholders to asyncpg $n placeholders.
+    
+    Like psycopg2, queries without parameters are sent as they are. Otherwise
+    %% becomes a literal % everywhere in the query, and %s inside quoted
+    strings and comments is left alone.
+    """
+    if not has_params:
+        return query
+    counter = iter(range(1, len(query) + 1))
+    
+    def _replace(match: re.Match) -> str:
+        token = match.group(0)
+        if token == "%s":
+            return f"${next(counter)}"
+        return token.replace("%%", "%")
+    
+    return _QUERY_TOKEN.sub(_replace, query)
+
+def is_integrity_error(error: Exception) -> bool:
+    """Whether a write failed because of the rows themselves, so retrying cannot succeed"""
+    if isinstance(error, (psycopg2.IntegrityError, psycopg2.DataError)):
+        return True
+    if asyncpg is not None:
+        return isinstance(error, (asyncpg.IntegrityConstraintViolationError, asyncpg.DataError))
+    return False
+
+def _rowcount(status_message: str) -> int:
+    """Parse the affected row count from an asyncpg command status"""
+    try:
+        return int(status_message.rsplit(" ", 1)[-1])
+    except (ValueError, AttributeError):
+        return 0
+
 # Async wrapper functions
 async def execute_query(query: str, params: tuple = None) -> List[Dict[str, Any]]:
     """Execute a SELECT query asynchronously"""
+    if DATABASE_BACKEND == "asyncpg":
+        pool = await get_async_pool()
+        rows = await pool.fetch(_to_asyncpg_query(query, params is not None), *(params or ()))
+        return [dict(row) for row in rows]
+    
     def _execute():
         with get_db_cursor() as cursor:
             cursor.execute(query, params)
@@ -93,6 +210,11 @@ async def execute_query(query: str, params: tuple = None) -> List[Dict[str, Any]
 
 async def execute_query_one(query: str, params: tuple = None) -> Optional[Dict[str, Any]]:
     """Execute a SELECT query and return one result asynchronously"""
+    if DATABASE_BACKEND == "asyncpg":
+        pool = await get_async_pool()
+        row = await pool.fetchrow(_to_asyncpg_query(query, params is not None), *(params or ()))
+        return dict(row) if row else None
+    
     def _execute():
         with get_db_cursor() as cursor:
             cursor.execute(query, params)
@@ -104,6 +226,11 @@ async def execute_query_one(query: str, params: tuple = None) -> Optional[Dict[s
 
 async def execute_insert(query: str, params: tuple = None) -> Optional[Dict[str, Any]]:
     """Execute an INSERT query and return the inserted row"""
+    if DATABASE_BACKEND == "asyncpg":
+        pool = await get_async_pool()
+        row = await pool.fetchrow(_to_asyncpg_query(query + " RETURNING *", params is not None), *(params or ()))
+        return dict(row) if row else None
+    
     def _execute():
         with get_db_cursor() as cursor:
             cursor.execute(query + " RETURNING *", params)
@@ -115,6 +242,10 @@ async def execute_insert(query: str, params: tuple = None) -> Optional[Dict[str,
 
 async def execute_update(query: str, params: tuple = None) -> int:
     """Execute an UPDATE query and return the number of affected rows"""
+    if DATABASE_BACKEND == "asyncpg":
+        pool = await get_async_pool()
+        return _rowcount(await pool.execute(_to_asyncpg_query(query, params is not None), *(params or ())))
+    
     def _execute():
         with get_db_cursor() as cursor:
             cursor.execute(query, params)
@@ -125,6 +256,10 @@ async def execute_update(query: str, params: tuple = None) -> int:
 
 async def execute_delete(query: str, params: tuple = None) -> int:
     """Execute a DELETE query and return the number of affected rows"""
+    if DATABASE_BACKEND == "asyncpg":
+        pool = await get_async_pool()
+        return _rowcount(await pool.execute(_to_asyncpg_query(query, params is not None), *(params or ())))
+    
     def _execute():
         with get_db_cursor() as cursor:
             cursor.execute(query, params)
@@ -133,6 +268,23 @@ async def execute_delete(query: str, params: tuple = None) -> int:
     loop = asyncio.get_event_loop()
     return await loop.run_in_executor(executor, _execute)
 
+async def execute_many(query: str, params_list: List[tuple]) -> None:
+    """Execute a statement for each parameter tuple in batched round trips"""
+    if not params_list:
+        return
+    
+    if DATABASE_BACKEND == "asyncpg":
+        pool = await get_async_pool()
+        await pool.executemany(_to_asyncpg_query(query), params_list)
+        return
+    
+    def _execute():
+        with get_db_cursor() as cursor:
+            psycopg2.extras.execute_batch(cursor, query, params_list, page_size=100)
+    
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(executor, _execute)
+
 def create_tables():
     """Create all tables"""
     queries = [
@@ -190,6 +342,41 @@ def create_tables():
         )
         """,
         
+        # SHA-256 of the file content, for upload deduplication
+        "ALTER TABLE files ADD COLUMN IF NOT EXISTS content_sha256 VARCHAR(64)",
+        
+        # File chunks table (retrieval units of extracted text)
+        """
+        CREATE TABLE IF NOT EXISTS file_chunks (
+            id VARCHAR(36) PRIMARY KEY,
+            file_id VARCHAR(36) REFERENCES files(id) ON DELETE CASCADE,
+            chunk_index INTEGER NOT NULL,
+            page INTEGER,
+            content TEXT NOT NULL,
+            token_count INTEGER NOT NULL DEFAULT 0,
+            search_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', content)) STORED,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (file_id, chunk_index)
+        )
+        """,
+        
+        # Extraction jobs table (text extraction queue for uploaded files)
+        """
+        CREATE TABLE IF NOT EXISTS extraction_jobs (
+            id VARCHAR(36) PRIMARY KEY,
+            file_id VARCHAR(36) UNIQUE REFERENCES files(id) ON DELETE CASCADE,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_after TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            locked_by VARCHAR(100),
+            locked_at TIMESTAMP WITH TIME ZONE,
+            last_error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        
         # Chat sessions table
         """
         CREATE TABLE IF NOT EXISTS chat_sessions (
@@ -220,15 +407,41 @@ def create_tables():
         )
         """,
         
+        # Prompt caching token counts
+        "ALTER TABLE ai_usage ADD COLUMN IF NOT EXISTS cache_read_tokens INTEGER DEFAULT 0",
+        "ALTER TABLE ai_usage ADD COLUMN IF NOT EXISTS cache_write_tokens INTEGER DEFAULT 0",
+        
+        # Bedrock response cache (shared tier)
+        """
+        CREATE TABLE IF NOT EXISTS bedrock_response_cache (
+            key VARCHAR(64) PRIMARY KEY,
+            model_id VARCHAR(200) NOT NULL,
+            response TEXT NOT NULL,
+            latency_ms INTEGER NOT NULL DEFAULT 0,
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        
         # Create indexes
         "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)",
         "CREATE INDEX IF NOT EXISTS idx_chats_user_id ON chats(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_chats_user_updated ON chats(user_id, updated_at DESC, id DESC)",
         "CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id)",
         "CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_chat_created_desc ON messages(chat_id, created_at DESC, id DESC)",
         "CREATE INDEX IF NOT EXISTS idx_files_user_id ON files(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_files_user_created ON files(user_id, created_at DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_files_user_url ON files(user_id, file_url)",
+        "CREATE INDEX IF NOT EXISTS idx_files_user_content_sha256 ON files(user_id, content_sha256) WHERE content_sha256 IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS idx_file_chunks_search ON file_chunks USING GIN(search_vector)",
+        "CREATE INDEX IF NOT EXISTS idx_extraction_jobs_pending ON extraction_jobs(run_after) WHERE status = 'pending'",
+        "CREATE INDEX IF NOT EXISTS idx_extraction_jobs_running ON extraction_jobs(locked_at) WHERE status = 'running'",
         "CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_id ON chat_sessions(user_id)",
         "CREATE INDEX IF NOT EXISTS idx_chat_sessions_token ON chat_sessions(session_token)",
         "CREATE INDEX IF NOT EXISTS idx_ai_usage_user_id ON ai_usage(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ai_usage_user_created ON ai_usage(user_id, created_at DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_bedrock_response_cache_expires ON bedrock_response_cache(expires_at)",
         
         # Create updated_at trigger function
         """
@@ -254,10 +467,27 @@ def create_tables():
         FOR EACH ROW EXECUTE FUNCTION update_updated_at_column()
         """,
         
+        """
+        DROP TRIGGER IF EXISTS update_extraction_jobs_updated_at ON extraction_jobs;
+        CREATE TRIGGER update_extraction_jobs_updated_at BEFORE UPDATE ON extraction_jobs
+        FOR EACH ROW EXECUTE FUNCTION update_updated_at_column()
+        """,
+        
+        # chat_sessions has no updated_at column, so it gets its own trigger function
+        """
+        CREATE OR REPLACE FUNCTION update_last_activity_column()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            NEW.last_activity = CURRENT_TIMESTAMP;
+            RETURN NEW;
+        END;
+        $$ language 'plpgsql'
+        """,
+        
         """
         DROP TRIGGER IF EXISTS update_chat_sessions_last_activity ON chat_sessions;
         CREATE TRIGGER update_chat_sessions_last_activity BEFORE UPDATE ON chat_sessions
-        FOR EACH ROW EXECUTE FUNCTION update_updated_at_column()
+        FOR EACH ROW EXECUTE FUNCTION update_last_activity_column()
         """
     ]
     
@@ -295,3 +525,11 @@ def close_connection_pool():
         connection_pool.closeall()
         connection_pool = None
         logger.info("✅ Database connection pool closed")
+
+async def close_async_pool():
+    """Close the asyncpg pool"""
+    global async_pool
+    if async_pool is not None:
+        await async_pool.close()
+        async_pool = None
+        logger.info("✅ asyncpg connection pool closed")
@@ -0,0 +1,130 @@
+import os
+import re
+from typing import List, Dict, Any, Optional
+
+from prompt_context import estimate_tokens
+
+# Target size of a stored chunk
+CHUNK_TARGET_TOKENS = int(os.getenv('DOCUMENT_CHUNK_TOKENS', '400'))
+
+# Document tokens sent with a question; longer documents are reduced to the
+# most relevant chunks
+DOCUMENT_CONTEXT_TOKENS = int(os.getenv('DOCUMENT_CONTEXT_TOKENS', '12000'))
+DOCUMENT_TOP_K = int(os.getenv('DOCUMENT_TOP_K', '12'))
+
+# Characters kept in the legacy files.extraction_text column. Chunks always
+# cover the whole document; this copy is only a fallback for old readers.
+INLINE_TEXT_LIMIT = int(os.getenv('DOCUMENT_INLINE_TEXT_LIMIT', '100000'))
+
+# Page headers written by ExtractionEngine.extract_pdf
+_PAGE_MARKER = re.compile(r"^--- Page (\d+) ---")
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?;:])\s+")
+_WORD_BREAK = re.compile(r"\s+")
+_QUERY_TERM = re.compile(r"[a-z0-9]{3,}")
+
+def inline_text(text: str) -> str:
+    """Text stored inline on the file row, truncated to INLINE_TEXT_LIMIT"""
+    if len(text) <= INLINE_TEXT_LIMIT:
+        return text
+    return text[:INLINE_TEXT_LIMIT] + "\n\n[Text truncated due to length...]"
+
+def _split_long_text(text: str, target_tokens: int, pattern: re.Pattern) -> List[str]:
+    """Greedily pack the pieces of ``text`` split by ``pattern`` up to target_tokens"""
+    pieces: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    # Token estimates are additive over space-joined parts, so track a running total
+    for part in pattern.split(text):
+        tokens = estimate_tokens(part)
+        if current and current_tokens + tokens > target_tokens:
+            pieces.append(" ".join(current))
+            current = []
+            current_tokens = 0
+        current.append(part)
+        current_tokens += tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+def _split_block(block: str, target_tokens: int) -> List[str]:
+    """Split a paragraph/page that is larger than a chunk at sentence, then word boundaries"""
+    if estimate_tokens(block) <= target_tokens:
+        return [block]
+    pieces = []
+    for sentence_group in _split_long_text(block, target_tokens, _SENTENCE_BREAK):
+        if estimate_tokens(sentence_group) <= target_tokens:
+            pieces.append(sentence_group)
+        else:
+            pieces.extend(_split_long_text(sentence_group, target_tokens, _WORD_BREAK))
+    return pieces
+
+def chunk_document(text: str, target_tokens: int = CHUNK_TARGET_TOKENS) -> List[Dict[str, Any]]:
+    """Split extracted text into ordered, page-aware chunks of about target_tokens"""
+    chunks: List[Dict[str, Any]] = []
+    current: List[str] = []
+    current_tokens = 0
+    page: Optional[int] = None
+    chunk_page: Optional[int] = None
+    
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            content = "\n\n".join(current)
+            chunks.append({
+                "chunk_index": len(chunks),
+                "page": chunk_page,
+                "content": content,
+                "token_count": estimate_tokens(content)
+            })
+        current = []
+        current_tokens = 0
+    
+    for block in text.split("\n\n"):
+        if not block.strip():
+            continue
+        marker = _PAGE_MARKER.match(block)
+        if marker:
+            # Start every page in a fresh chunk so chunks map onto pages
+            flush()
+            page = int(marker.group(1))
+        for piece in _split_block(block, target_tokens):
+            tokens = estimate_tokens(piece)
+            if current and current_tokens + tokens > target_tokens:
+                flush()
+            if not current:
+                chunk_page = page
+            current.append(piece)
+            current_tokens += tokens
+    flush()
+    return chunks
+
+def build_search_query(question: str) -> Optional[str]:
+    """Build an OR-ed to_tsquery expression from the terms of a question"""
+    terms = list(dict.fromkeys(_QUERY_TERM.findall(question.lower())))
+    return " | ".join(terms) if terms else None
+
+def select_chunks(ranked_chunks: List[Dict[str, Any]], token_budget: int) -> List[Dict[str, Any]]:
+    """Take chunks in relevance order while they fit, returned in document order"""
+    selected = []
+    used = 0
+    for chunk in ranked_chunks:
+        if used + chunk["token_count"] > token_budget:
+            continue
+        selected.append(chunk)
+        used += chunk["token_count"]
+    return sorted(selected, key=lambda chunk: chunk["chunk_index"])
+
+def format_chunks(chunks: List[Dict[str, Any]], excerpt: bool) -> str:
+    """Join chunks into document text, marking gaps when only excerpts are sent"""
+    parts = []
+    previous_index = None
+    for chunk in chunks:
+        content = chunk["content"]
+        if excerpt:
+            if previous_index is not None and chunk["chunk_index"] != previous_index + 1:
+                parts.append("[...]")
+            if chunk.get("page") and not _PAGE_MARKER.match(content):
+                content = f"[Page {chunk['page']}] {content}"
+        parts.append(content)
+        previous_index = chunk["chunk_index"]
+    return "\n\n".join(parts)
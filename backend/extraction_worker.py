@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Text extraction worker for IFlyChat.
+Uploads queue an extraction job; workers claim jobs from the extraction_jobs
+table, so throughput scales by running more of them. Workers run inside the
+API process (EXTRACTION_WORKER_TASKS) or standalone:
+
+    python extraction_worker.py
+"""
+
+import asyncio
+import logging
+import os
+import random
+import socket
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+from dotenv import load_dotenv
+
+from database import initialize_connection_pool, close_connection_pool, close_async_pool
+from document_chunks import chunk_document, inline_text
+from models import File as FileModel, FileChunk, ExtractionJob
+from s3_service import s3_service
+from text_extraction import extraction_engine, ExtractionError
+
+logger = logging.getLogger(__name__)
+
+# Worker tasks started inside the API process; 0 leaves extraction to
+# standalone workers (required on Lambda, where background tasks do not run)
+EXTRACTION_WORKER_TASKS = int(os.getenv('EXTRACTION_WORKER_TASKS', '2'))
+EXTRACTION_POLL_SECONDS = float(os.getenv('EXTRACTION_POLL_SECONDS', '2'))
+EXTRACTION_MAX_ATTEMPTS = int(os.getenv('EXTRACTION_MAX_ATTEMPTS', '5'))
+EXTRACTION_RETRY_BASE_SECONDS = float(os.getenv('EXTRACTION_RETRY_BASE_SECONDS', '10'))
+EXTRACTION_RETRY_MAX_SECONDS = float(os.getenv('EXTRACTION_RETRY_MAX_SECONDS', '600'))
+# Running jobs locked for longer than this are assumed orphaned and reclaimed
+EXTRACTION_LOCK_TIMEOUT_SECONDS = int(os.getenv('EXTRACTION_LOCK_TIMEOUT_SECONDS', '900'))
+# Where files are downloaded for extraction (default: the system temp dir)
+EXTRACTION_TMP_DIR = os.getenv('EXTRACTION_TMP_DIR') or None
+
+class PermanentExtractionError(Exception):
+    """Extraction failure that retrying will not fix (e.g. an unreadable file)"""
+
+class ExtractionWorker:
+    """Claims queued extraction jobs and processes them until stopped"""
+    
+    def __init__(self, tasks: int = EXTRACTION_WORKER_TASKS,
+                 poll_seconds: float = EXTRACTION_POLL_SECONDS):
+        self.tasks = tasks
+        self.poll_seconds = poll_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self.processed = 0
+        self.reused = 0
+        self.retried = 0
+        self.interrupted = 0
+        self.dead = 0
+    
+    def start(self, tasks: Optional[int] = None):
+        """Start worker tasks on the running event loop"""
+        count = self.tasks if tasks is None else tasks
+        if count <= 0 or self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run(index)) for index in range(count)]
+        logger.info(f"📥 Started {count} extraction worker tasks ({self.worker_id})")
+    
+    async def stop(self):
+        """Cancel the worker tasks; interrupted jobs are reclaimed after the lock timeout"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def notify(self):
+        """Wake idle local workers after a job was queued"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+    
+    async def _run(self, index: int):
+        worker_id = f"{self.worker_id}/{index}"
+        while True:
+            try:
+                job = await ExtractionJob.claim(worker_id, EXTRACTION_LOCK_TIMEOUT_SECONDS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Failed to claim extraction job: {e}")
+                job = None
+            
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            await self.process(job)
+    
+    def _retry_delay(self, attempts: int) -> float:
+        """Exponential backoff with jitter"""
+        ceiling = min(EXTRACTION_RETRY_MAX_SECONDS, EXTRACTION_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+        return random.uniform(ceiling / 2, ceiling)
+    
+    async def _extract(self, file_record: FileModel):
+        """Download a file to a temporary path and extract its text"""
+        suffix = os.path.splitext(file_record.original_name)[1]
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=EXTRACTION_TMP_DIR)
+        os.close(fd)
+        try:
+            await s3_service.download_to_path(file_record.file_path, path)
+            return await s3_service.extract_text_from_file(
+                file_path=path,
+                file_name=file_record.original_name,
+                content_type=file_record.content_type or "application/octet-stream"
+            )
+        finally:
+            os.unlink(path)
+    
+    async def process(self, job: ExtractionJob):
+        """Extract and chunk the text of a job's file"""
+        try:
+            file_record = await FileModel.get_by_id(job.file_id)
+            if not file_record:
+                raise PermanentExtractionError("File no longer exists")
+            
+            # Identical content the user uploaded may have been extracted since
+            # this job was queued
+            if file_record.content_sha256:
+                source = await FileModel.get_by_sha256(
+                    file_record.user_id, file_record.content_sha256,
+                    processed_only=True, exclude_id=file_record.id
+                )
+                if source:
+                    await file_record.copy_extraction_from(source.id)
+                    await job.complete()
+                    self.reused += 1
+                    logger.info(f"♻️ Reused extraction of identical content for {file_record.original_name}")
+                    return
+            
+            extracted_text, extraction_success = await self._extract(file_record)
+            if not extraction_success:
+                # The file could not be parsed; timeouts and crashes raise ExtractionError instead
+                raise PermanentExtractionError(extracted_text)
+            
+            # Chunks cover the whole document; only the inline copy is truncated
+            chunk_count = await FileChunk.bulk_create(file_record.id, chunk_document(extracted_text))
+            await file_record.update(processed=True, extraction_text=inline_text(extracted_text))
+            await job.complete()
+            self.processed += 1
+            logger.info(f"✅ Extracted {file_record.original_name} into {chunk_count} chunks")
+        
+        except asyncio.CancelledError:
+            raise
+        except PermanentExtractionError as e:
+            self.dead += 1
+            logger.warning(f"⚠️ Extraction of file {job.file_id} failed permanently: {e}")
+            await self._record_failure(job, str(e), None)
+        except ExtractionError as e:
+            # Timeouts and worker crashes can be caused by another file sharing
+            # the pool, so they are retried with backoff like any transient error
+            self.interrupted += 1
+            await self._retry(job, e)
+        except Exception as e:
+            await self._retry(job, e)
+    
+    async def _retry(self, job: ExtractionJob, error: Exception):
+        """Schedule a retry with backoff, or mark the job dead once out of attempts"""
+        delay = self._retry_delay(job.attempts)
+        if job.attempts >= job.max_attempts:
+            self.dead += 1
+            logger.error(f"❌ Extraction of file {job.file_id} failed after {job.attempts} attempts: {error}")
+        else:
+            self.retried += 1
+            logger.warning(f"⚠️ Extraction of file {job.file_id} failed, retrying in {delay:.0f}s: {error}")
+        await self._record_failure(job, str(error), delay)
+    
+    async def _record_failure(self, job: ExtractionJob, error: str, retry_delay: Optional[float]):
+        try:
+            await job.fail(error, retry_delay)
+        except Exception as e:
+            # The lock timeout will hand the job to another worker
+            logger.error(f"❌ Failed to record extraction failure for job {job.id}: {e}")
+    
+    def stats(self):
+        return {
+            "worker_id": self.worker_id,
+            "tasks": len(self._tasks),
+            "processed": self.processed,
+            "reused": self.reused,
+            "retried": self.retried,
+            "interrupted": self.interrupted,
+            "dead": self.dead
+        }
+
+# Create a singleton instance
+extraction_worker = ExtractionWorker()
+
+async def main():
+    """Run extraction workers until interrupted"""
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    
+    initialize_connection_pool()
+    extraction_worker.start(max(EXTRACTION_WORKER_TASKS, 1))
+    try:
+        await asyncio.gather(*extraction_worker._tasks)
+    finally:
+        await extraction_worker.stop()
+        extraction_engine.shutdown()
+        await close_async_pool()
+        close_connection_pool()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n🛑 Extraction worker stopped")
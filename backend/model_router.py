@@ -0,0 +1,191 @@
+"""
+Model routing for IFlyChat chat answers.
+Each request is sent to the heavy model (BEDROCK_MODEL_ID) or the light model
+(BEDROCK_LIGHT_MODEL_ID) based on its size, whether a document is attached,
+the recent latency and throttle state of each model and a per-user policy.
+benchmarks/bench_routing.py replays a captured request log through it.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from admission import admission_controller
+from prompt_context import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+BEDROCK_ROUTING = os.getenv('BEDROCK_ROUTING', 'false').lower() == 'true'
+HEAVY_MODEL_ID = os.getenv('BEDROCK_MODEL_ID', 'anthropic.claude-3-sonnet-20240229-v1:0')
+LIGHT_MODEL_ID = os.getenv('BEDROCK_LIGHT_MODEL_ID', os.getenv('BEDROCK_NAMING_MODEL', 'anthropic.claude-3-haiku-20240307-v1:0'))
+
+# Requests at or under both limits count as short and go to the light model
+ROUTER_SHORT_MESSAGE_TOKENS = int(os.getenv('BEDROCK_ROUTER_SHORT_MESSAGE_TOKENS', '150'))
+ROUTER_SHORT_PROMPT_TOKENS = int(os.getenv('BEDROCK_ROUTER_SHORT_PROMPT_TOKENS', '2000'))
+# Heavy-model latency above which requests without a document move to the light model
+ROUTER_LATENCY_SLO_SECONDS = float(os.getenv('BEDROCK_ROUTER_LATENCY_SLO_SECONDS', '30'))
+# Weight of the newest sample in the per-model latency average
+ROUTER_LATENCY_ALPHA = 0.2
+
+# USD per 1K tokens, and typical speed used when a replay has no measurements
+# for a model. Override or extend with BEDROCK_MODEL_PRICING (JSON).
+DEFAULT_MODEL_PRICING = {
+    "anthropic.claude-3-sonnet-20240229-v1:0": {
+        "input": 0.003, "output": 0.015, "first_token_seconds": 1.2, "output_tokens_per_second": 60
+    },
+    "anthropic.claude-3-5-sonnet-20240620-v1:0": {
+        "input": 0.003, "output": 0.015, "first_token_seconds": 1.0, "output_tokens_per_second": 70
+    },
+    "anthropic.claude-3-haiku-20240307-v1:0": {
+        "input": 0.00025, "output": 0.00125, "first_token_seconds": 0.4, "output_tokens_per_second": 150
+    }
+}
+# Prompt cache reads and writes relative to the input price
+CACHE_READ_PRICE_FACTOR = 0.1
+CACHE_WRITE_PRICE_FACTOR = 1.25
+
+def _load_json_env(name: str) -> Dict[str, Any]:
+    raw = os.getenv(name)
+    if not raw:
+        return {}
+    try:
+        value = json.loads(raw)
+        if not isinstance(value, dict):
+            raise ValueError("expected a JSON object")
+        return value
+    except ValueError as e:
+        logger.warning(f"Ignoring invalid {name}: {e}")
+        return {}
+
+def _load_pricing() -> Dict[str, Dict[str, float]]:
+    pricing = {model: dict(prices) for model, prices in DEFAULT_MODEL_PRICING.items()}
+    for model, prices in _load_json_env('BEDROCK_MODEL_PRICING').items():
+        if isinstance(prices, dict):
+            pricing.setdefault(model, {}).update(prices)
+    return pricing
+
+class ModelRouter:
+    """Chooses the model for each chat request"""
+    
+    def __init__(self, enabled: bool = BEDROCK_ROUTING,
+                 heavy_model: str = HEAVY_MODEL_ID, light_model: str = LIGHT_MODEL_ID):
+        self.enabled = enabled
+        self.heavy_model = heavy_model
+        self.light_model = light_model
+        self.pricing = _load_pricing()
+        # Per-user policy: user id (or "*" for everyone) -> "heavy", "light" or "auto"
+        self.user_policies = {
+            user_id: str(policy).lower()
+            for user_id, policy in _load_json_env('BEDROCK_USER_MODEL_POLICY').items()
+        }
+        self.latency: Dict[str, float] = {}
+        self.routed: Dict[str, int] = {}
+        self.reasons: Dict[str, int] = {}
+    
+    def _policy(self, user_id: Optional[str]) -> str:
+        return self.user_policies.get(user_id or "", self.user_policies.get("*", "auto"))
+    
+    def _degraded(self, model_id: str) -> Optional[str]:
+        """Why a model should be avoided right now, if it should"""
+        admission = admission_controller.models.get(model_id)
+        if admission is None:
+            return None
+        if admission.breaker.state != "closed":
+            return "circuit open"
+        if admission.bucket.throttled:
+            return "throttled"
+        return None
+    
+    def route(self, user_id: Optional[str] = None, message_tokens: int = 0,
+              document_tokens: int = 0, history_tokens: int = 0) -> Dict[str, Any]:
+        """Pick a model from token estimates of the request.
+        
+        Returns the model id, its tier, the reason for the choice and the
+        signals it was based on, for recording with the answer.
+        """
+        prompt_tokens = message_tokens + document_tokens + history_tokens
+        signals = {
+            "message_tokens": message_tokens,
+            "prompt_tokens": prompt_tokens,
+            "has_document": document_tokens > 0,
+            "heavy_latency_seconds": round(self.latency.get(self.heavy_model, 0.0), 3),
+            "policy": self._policy(user_id)
+        }
+        
+        if not self.enabled or self.heavy_model == self.light_model:
+            tier, reason = "heavy", "routing disabled"
+        elif signals["policy"] in ("heavy", "light"):
+            tier, reason = signals["policy"], "user policy"
+        elif document_tokens > 0:
+            tier, reason = "heavy", "document attached"
+        elif message_tokens <= ROUTER_SHORT_MESSAGE_TOKENS and prompt_tokens <= ROUTER_SHORT_PROMPT_TOKENS:
+            tier, reason = "light", "short prompt"
+        elif self.latency.get(self.heavy_model, 0.0) > ROUTER_LATENCY_SLO_SECONDS:
+            tier, reason = "light", "heavy model slow"
+        else:
+            tier, reason = "heavy", "long prompt"
+        
+        # Steer away from a throttled or failing model while the other is healthy
+        if self.enabled and signals["policy"] == "auto" and self.heavy_model != self.light_model:
+            other = "light" if tier == "heavy" else "heavy"
+            problem = self._degraded(self._model(tier))
+            if problem and not self._degraded(self._model(other)):
+                tier, reason = other, f"{self._model(tier)} {problem}"
+        
+        model_id = self._model(tier)
+        self.routed[model_id] = self.routed.get(model_id, 0) + 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        return {"model": model_id, "tier": tier, "reason": reason, "signals": signals}
+    
+    def route_request(self, user_id: Optional[str], user_message: str,
+                      history: Optional[List[Dict[str, str]]] = None,
+                      document_text: Optional[str] = None) -> Dict[str, Any]:
+        """Pick a model for a chat request"""
+        return self.route(
+            user_id=user_id,
+            message_tokens=estimate_tokens(user_message),
+            document_tokens=estimate_tokens(document_text) if document_text else 0,
+            history_tokens=sum(estimate_tokens(msg.get("content", "")) for msg in history or [])
+        )
+    
+    def _model(self, tier: str) -> str:
+        return self.light_model if tier == "light" else self.heavy_model
+    
+    def record_latency(self, model_id: str, seconds: float):
+        """Fold a completed call into the model's latency average"""
+        previous = self.latency.get(model_id)
+        if previous is None:
+            self.latency[model_id] = seconds
+        else:
+            self.latency[model_id] = previous + ROUTER_LATENCY_ALPHA * (seconds - previous)
+    
+    def estimate_cost(self, model_id: str, usage: Dict[str, int]) -> float:
+        """Estimated USD cost of a call from its token usage"""
+        prices = self.pricing.get(model_id)
+        if not prices:
+            return 0.0
+        cache_read = usage.get("cache_read_tokens", 0)
+        cache_write = usage.get("cache_write_tokens", 0)
+        uncached = max(usage.get("prompt_tokens", 0) - cache_read - cache_write, 0)
+        input_price = prices.get("input", 0.0)
+        cost = (
+            uncached * input_price
+            + cache_read * input_price * CACHE_READ_PRICE_FACTOR
+            + cache_write * input_price * CACHE_WRITE_PRICE_FACTOR
+            + usage.get("completion_tokens", 0) * prices.get("output", 0.0)
+        ) / 1000
+        return round(cost, 6)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "heavy_model": self.heavy_model,
+            "light_model": self.light_model,
+            "routed": self.routed,
+            "reasons": self.reasons,
+            "latency_seconds": {model: round(seconds, 3) for model, seconds in self.latency.items()}
+        }
+
+# Create a singleton instance
+model_router = ModelRouter()
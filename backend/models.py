@@ -1,12 +1,37 @@
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
+import base64
+import binascii
+import os
 import uuid
 import json
+from cache import TTLCache
 from database import (
     execute_query, execute_query_one, execute_insert, 
-    execute_update, execute_delete
+    execute_update, execute_delete, execute_many
 )
 
+# Users resolved for authenticated requests. Entries are dropped on update and
+# delete; the TTL bounds staleness for changes made by other processes.
+user_cache = TTLCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('USER_CACHE_TTL_SECONDS', '30'))
+)
+
+def encode_cursor(sort_value: datetime, row_id: str) -> str:
+    """Encode an opaque pagination cursor from a row's sort key"""
+    payload = json.dumps([sort_value.isoformat(), row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a pagination cursor, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(sort_value), str(row_id)
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
 class BaseModel:
     """Base model with common functionality"""
     
@@ -30,6 +55,49 @@ class BaseModel:
     def from_dict(cls, data: Dict[str, Any]):
         """Create model instance from dictionary"""
         return cls(**data)
+    
+    @staticmethod
+    async def _fetch_page(table: str, owner_column: str, owner_id: str, sort_column: str,
+                          limit: int, offset: int = 0, before: Optional[str] = None,
+                          after: Optional[str] = None, descending: bool = True) -> List[Dict[str, Any]]:
+        """Fetch one page of rows ordered by (sort_column, id).
+        
+        ``before``/``after`` are cursors of the first/last row of a page; they
+        select the rows listed before or after it using keyset comparison, so
+        deep pages cost the same as the first one. ``offset`` is only applied
+        when no cursor is given. Rows are returned in listing order.
+        """
+        if before and after:
+            raise ValueError("Use either the before or the after cursor, not both")
+        
+        cursor = before or after
+        params: List[Any] = [owner_id]
+        where = f"{owner_column} = %s"
+        # Walk the index in listing order for "after"/no cursor, and in reverse for "before"
+        reverse = bool(before)
+        scan_descending = descending != reverse
+        if cursor:
+            sort_value, row_id = decode_cursor(cursor)
+            comparison = "<" if scan_descending else ">"
+            where += f" AND ({sort_column}, id) {comparison} (%s, %s)"
+            params.extend([sort_value, row_id])
+        
+        direction = "DESC" if scan_descending else "ASC"
+        query = f"""
+            SELECT * FROM {table}
+            WHERE {where}
+            ORDER BY {sort_column} {direction}, id {direction}
+            LIMIT %s
+        """
+        params.append(limit)
+        if not cursor and offset:
+            query += " OFFSET %s"
+            params.append(offset)
+        
+        rows = await execute_query(query, tuple(params))
+        if reverse:
+            rows.reverse()
+        return rows
 
 class User(BaseModel):
     """User model"""
@@ -64,6 +132,16 @@ class User(BaseModel):
         result = await execute_query_one(query, (user_id,))
         return cls.from_dict(result) if result else None
     
+    @classmethod
+    async def get_cached(cls, user_id: str) -> Optional['User']:
+        """Get user by ID through the in-process user cache"""
+        user = user_cache.get(user_id)
+        if user is None:
+            user = await cls.get_by_id(user_id)
+            if user:
+                user_cache.set(user_id, user)
+        return user
+    
     @classmethod
     async def get_by_email(cls, email: str) -> Optional['User']:
         """Get user by email"""
@@ -90,13 +168,16 @@ class User(BaseModel):
         query = f"UPDATE users SET {', '.join(set_clauses)} WHERE id = %s"
         values.append(self.id)
         
+        user_cache.pop(self.id)
         rows_affected = await execute_update(query, tuple(values))
+        user_cache.pop(self.id)
         return rows_affected > 0
     
     async def delete(self) -> bool:
         """Delete user"""
         query = "DELETE FROM users WHERE id = %s"
         rows_affected = await execute_delete(query, (self.id,))
+        user_cache.pop(self.id)
         return rows_affected > 0
 
 class Chat(BaseModel):
@@ -130,15 +211,13 @@ class Chat(BaseModel):
         return cls.from_dict(result) if result else None
     
     @classmethod
-    async def get_by_user(cls, user_id: str, limit: int = 50, offset: int = 0) -> List['Chat']:
-        """Get chats by user ID"""
-        query = """
-            SELECT * FROM chats 
-            WHERE user_id = %s 
-            ORDER BY updated_at DESC 
-            LIMIT %s OFFSET %s
-        """
-        results = await execute_query(query, (user_id, limit, offset))
+    async def get_by_user(cls, user_id: str, limit: int = 50, offset: int = 0,
+                          before: Optional[str] = None, after: Optional[str] = None) -> List['Chat']:
+        """Get chats by user ID, most recently updated first"""
+        results = await cls._fetch_page(
+            "chats", "user_id", user_id, "updated_at",
+            limit, offset, before, after, descending=True
+        )
         return [cls.from_dict(row) for row in results]
     
     async def update(self, **kwargs) -> bool:
@@ -173,9 +252,10 @@ class Chat(BaseModel):
         rows_affected = await execute_delete(query, (self.id,))
         return rows_affected > 0
     
-    async def get_messages(self, limit: int = 100, offset: int = 0) -> List['Message']:
+    async def get_messages(self, limit: int = 100, offset: int = 0,
+                           before: Optional[str] = None, after: Optional[str] = None) -> List['Message']:
         """Get messages for this chat"""
-        return await Message.get_by_chat(self.id, limit, offset)
+        return await Message.get_by_chat(self.id, limit, offset, before, after)
 
 class Message(BaseModel):
     """Message model"""
@@ -216,37 +296,68 @@ class Message(BaseModel):
         query = "SELECT * FROM messages WHERE id = %s"
         result = await execute_query_one(query, (message_id,))
         if result:
-            # Parse JSON metadata
-            if result.get('metadata'):
-                result['metadata'] = json.loads(result['metadata'])
-            return cls.from_dict(result)
+            # Parse JSON metadata (the driver may already have decoded it)
+            return cls.from_dict(cls._parse_metadata(result))
         return None
     
-    @classmethod
-    async def get_by_chat(cls, chat_id: str, limit: int = 100, offset: int = 0) -> List['Message']:
-        """Get messages by chat ID"""
-        query = """
-            SELECT * FROM messages 
-            WHERE chat_id = %s 
-            ORDER BY created_at ASC 
-            LIMIT %s OFFSET %s
-        """
-        results = await execute_query(query, (chat_id, limit, offset))
-        messages = []
-        for row in results:
-            # Parse JSON metadata safely
-            if row.get('metadata'):
-                if isinstance(row['metadata'], str):
-                    try:
-                        row['metadata'] = json.loads(row['metadata'])
-                    except (json.JSONDecodeError, TypeError):
-                        row['metadata'] = {}
-                elif not isinstance(row['metadata'], dict):
+    @staticmethod
+    def _parse_metadata(row: Dict[str, Any]) -> Dict[str, Any]:
+        """Parse JSON metadata of a message row safely"""
+        if row.get('metadata'):
+            if isinstance(row['metadata'], str):
+                try:
+                    row['metadata'] = json.loads(row['metadata'])
+                except (json.JSONDecodeError, TypeError):
                     row['metadata'] = {}
-            else:
+            elif not isinstance(row['metadata'], dict):
                 row['metadata'] = {}
-            messages.append(cls.from_dict(row))
-        return messages
+        else:
+            row['metadata'] = {}
+        return row
+    
+    @classmethod
+    async def get_by_chat(cls, chat_id: str, limit: int = 100, offset: int = 0,
+                          before: Optional[str] = None, after: Optional[str] = None) -> List['Message']:
+        """Get messages by chat ID, oldest first"""
+        results = await cls._fetch_page(
+            "messages", "chat_id", chat_id, "created_at",
+            limit, offset, before, after, descending=False
+        )
+        return [cls.from_dict(cls._parse_metadata(row)) for row in results]
+    
+    @classmethod
+    async def get_recent(cls, chat_id: str, limit: int = 10,
+                         before: Optional['Message'] = None) -> List['Message']:
+        """Get the newest messages of a chat in chronological order.
+        
+        Reads backwards over the (chat_id, created_at DESC, id DESC) index, so
+        the cost does not depend on the chat length. If ``before`` is given,
+        only messages that precede it are returned.
+        """
+        if before is not None:
+            query = """
+                SELECT * FROM (
+                    SELECT * FROM messages
+                    WHERE chat_id = %s AND (created_at, id) < (%s, %s)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                ) recent
+                ORDER BY created_at ASC, id ASC
+            """
+            params = (chat_id, before.created_at, before.id, limit)
+        else:
+            query = """
+                SELECT * FROM (
+                    SELECT * FROM messages
+                    WHERE chat_id = %s
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                ) recent
+                ORDER BY created_at ASC, id ASC
+            """
+            params = (chat_id, limit)
+        results = await execute_query(query, params)
+        return [cls.from_dict(cls._parse_metadata(row)) for row in results]
     
     async def update(self, **kwargs) -> bool:
         """Update message fields"""
@@ -257,10 +368,11 @@ class Message(BaseModel):
         values = []
         for key, value in kwargs.items():
             if hasattr(self, key):
-                if key == 'metadata':
-                    value = json.dumps(value) if value else None
                 set_clauses.append(f"{key} = %s")
-                values.append(value)
+                if key == 'metadata':
+                    values.append(json.dumps(value) if value else None)
+                else:
+                    values.append(value)
                 setattr(self, key, value)
         
         if not set_clauses:
@@ -288,7 +400,8 @@ class File(BaseModel):
     def __init__(self, id: str = None, user_id: str = None, original_name: str = None,
                  file_path: str = None, file_url: str = None, file_size: int = None,
                  content_type: str = None, processed: bool = False, 
-                 extraction_text: str = None, created_at: datetime = None, **kwargs):
+                 extraction_text: str = None, content_sha256: str = None,
+                 created_at: datetime = None, **kwargs):
         self.id = id or str(uuid.uuid4())
         self.user_id = user_id
         self.original_name = original_name
@@ -298,24 +411,26 @@ class File(BaseModel):
         self.content_type = content_type
         self.processed = processed
         self.extraction_text = extraction_text
+        self.content_sha256 = content_sha256
         self.created_at = created_at
         super().__init__(**kwargs)
     
     @classmethod
     async def create(cls, user_id: str, original_name: str, file_path: str,
                     file_url: str, file_size: int, content_type: str,
-                    processed: bool = False, extraction_text: str = None) -> 'File':
+                    processed: bool = False, extraction_text: str = None,
+                    content_sha256: str = None) -> 'File':
         """Create a new file record"""
         file_id = str(uuid.uuid4())
         query = """
             INSERT INTO files (id, user_id, original_name, file_path, file_url, 
-                             file_size, content_type, processed, extraction_text)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                             file_size, content_type, processed, extraction_text, content_sha256)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
         result = await execute_insert(
             query, 
             (file_id, user_id, original_name, file_path, file_url, 
-             file_size, content_type, processed, extraction_text)
+             file_size, content_type, processed, extraction_text, content_sha256)
         )
         return cls.from_dict(result) if result else None
     
@@ -327,15 +442,85 @@ class File(BaseModel):
         return cls.from_dict(result) if result else None
     
     @classmethod
-    async def get_by_user(cls, user_id: str, limit: int = 50, offset: int = 0) -> List['File']:
-        """Get files by user ID"""
+    async def get_document(cls, user_id: str, file_id: Optional[str] = None,
+                           file_url: Optional[str] = None) -> Optional['File']:
+        """Get one of the user's processed files by ID or URL.
+        
+        Ownership is part of the lookup and the (large) extraction text is not
+        read; use get_extraction_text or FileChunk for the content.
+        """
+        if file_id:
+            query = """
+                SELECT id, original_name, file_url FROM files
+                WHERE id = %s AND user_id = %s AND extraction_text IS NOT NULL
+            """
+            params = (file_id, user_id)
+        elif file_url:
+            query = """
+                SELECT id, original_name, file_url FROM files
+                WHERE user_id = %s AND file_url = %s AND extraction_text IS NOT NULL
+                ORDER BY created_at DESC
+                LIMIT 1
+            """
+            params = (user_id, file_url)
+        else:
+            return None
+        result = await execute_query_one(query, params)
+        return cls.from_dict(result) if result else None
+    
+    @classmethod
+    async def get_by_sha256(cls, user_id: str, content_sha256: str, processed_only: bool = False,
+                            exclude_id: Optional[str] = None) -> Optional['File']:
+        """Get one of the user's files with the same content, preferring processed ones.
+        
+        Only the user's own files qualify; matching other users' uploads would
+        tell the uploader whether someone else already stored a document.
+        """
+        conditions = ["user_id = %s", "content_sha256 = %s"]
+        params: List[Any] = [user_id, content_sha256]
+        if processed_only:
+            conditions.append("processed = TRUE")
+        if exclude_id:
+            conditions.append("id <> %s")
+            params.append(exclude_id)
+        query = f"""
+            SELECT id, file_path, file_url, file_size, content_type, processed FROM files
+            WHERE {' AND '.join(conditions)}
+            ORDER BY processed DESC, created_at
+            LIMIT 1
+        """
+        result = await execute_query_one(query, tuple(params))
+        return cls.from_dict(result) if result else None
+    
+    async def copy_extraction_from(self, source_id: str) -> bool:
+        """Reuse another file's extracted text and chunks instead of re-extracting"""
         query = """
-            SELECT * FROM files 
-            WHERE user_id = %s 
-            ORDER BY created_at DESC 
-            LIMIT %s OFFSET %s
+            UPDATE files
+            SET processed = TRUE,
+                extraction_text = (SELECT extraction_text FROM files WHERE id = %s)
+            WHERE id = %s
         """
-        results = await execute_query(query, (user_id, limit, offset))
+        # Chunks first, so the file never looks processed without them
+        await FileChunk.copy(source_id, self.id)
+        rows_affected = await execute_update(query, (source_id, self.id))
+        self.processed = True
+        return rows_affected > 0
+    
+    @classmethod
+    async def get_extraction_text(cls, file_id: str) -> Optional[str]:
+        """Get the full extracted text of a file"""
+        query = "SELECT extraction_text FROM files WHERE id = %s"
+        result = await execute_query_one(query, (file_id,))
+        return result['extraction_text'] if result else None
+    
+    @classmethod
+    async def get_by_user(cls, user_id: str, limit: int = 50, offset: int = 0,
+                          before: Optional[str] = None, after: Optional[str] = None) -> List['File']:
+        """Get files by user ID, newest first"""
+        results = await cls._fetch_page(
+            "files", "user_id", user_id, "created_at",
+            limit, offset, before, after, descending=True
+        )
         return [cls.from_dict(row) for row in results]
     
     async def update(self, **kwargs) -> bool:
@@ -366,6 +551,200 @@ class File(BaseModel):
         rows_affected = await execute_delete(query, (self.id,))
         return rows_affected > 0
 
+class FileChunk(BaseModel):
+    """Retrieval chunk of a file's extracted text"""
+    
+    def __init__(self, id: str = None, file_id: str = None, chunk_index: int = 0,
+                 page: int = None, content: str = None, token_count: int = 0,
+                 created_at: datetime = None, **kwargs):
+        self.id = id or str(uuid.uuid4())
+        self.file_id = file_id
+        self.chunk_index = chunk_index
+        self.page = page
+        self.content = content
+        self.token_count = token_count
+        self.created_at = created_at
+        super().__init__(**kwargs)
+    
+    @classmethod
+    async def bulk_create(cls, file_id: str, chunks: List[Dict[str, Any]]) -> int:
+        """Store the chunks of a file, replacing any existing ones"""
+        await execute_delete("DELETE FROM file_chunks WHERE file_id = %s", (file_id,))
+        query = """
+            INSERT INTO file_chunks (id, file_id, chunk_index, page, content, token_count)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """
+        await execute_many(query, [
+            (str(uuid.uuid4()), file_id, chunk["chunk_index"], chunk.get("page"),
+             chunk["content"], chunk["token_count"])
+            for chunk in chunks
+        ])
+        return len(chunks)
+    
+    @classmethod
+    async def copy(cls, source_file_id: str, file_id: str) -> int:
+        """Copy the chunks of one file to another inside the database"""
+        await execute_delete("DELETE FROM file_chunks WHERE file_id = %s", (file_id,))
+        query = """
+            INSERT INTO file_chunks (id, file_id, chunk_index, page, content, token_count)
+            SELECT gen_random_uuid()::text, %s, chunk_index, page, content, token_count
+            FROM file_chunks WHERE file_id = %s
+        """
+        return await execute_update(query, (file_id, source_file_id))
+    
+    @classmethod
+    async def get_stats(cls, file_id: str) -> Dict[str, int]:
+        """Number of chunks and total tokens stored for a file"""
+        query = """
+            SELECT COUNT(*) AS chunk_count, COALESCE(SUM(token_count), 0) AS total_tokens
+            FROM file_chunks WHERE file_id = %s
+        """
+        result = await execute_query_one(query, (file_id,))
+        return {
+            "chunk_count": int(result['chunk_count']) if result else 0,
+            "total_tokens": int(result['total_tokens']) if result else 0
+        }
+    
+    @classmethod
+    async def get_by_file(cls, file_id: str) -> List[Dict[str, Any]]:
+        """Get all chunks of a file in document order"""
+        query = """
+            SELECT chunk_index, page, content, token_count FROM file_chunks
+            WHERE file_id = %s
+            ORDER BY chunk_index
+        """
+        return await execute_query(query, (file_id,))
+    
+    @classmethod
+    async def search(cls, file_id: str, tsquery: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        """Get the chunks of a file most relevant to a to_tsquery expression.
+        
+        Falls back to the leading chunks when nothing matches.
+        """
+        results = []
+        if tsquery:
+            query = """
+                SELECT chunk_index, page, content, token_count,
+                       ts_rank_cd(search_vector, to_tsquery('english', %s)) AS rank
+                FROM file_chunks
+                WHERE file_id = %s AND search_vector @@ to_tsquery('english', %s)
+                ORDER BY rank DESC, chunk_index
+                LIMIT %s
+            """
+            results = await execute_query(query, (tsquery, file_id, tsquery, limit))
+        if not results:
+            query = """
+                SELECT chunk_index, page, content, token_count FROM file_chunks
+                WHERE file_id = %s
+                ORDER BY chunk_index
+                LIMIT %s
+            """
+            results = await execute_query(query, (file_id, limit))
+        return results
+
+class ExtractionJob(BaseModel):
+    """Queued text extraction for an uploaded file"""
+    
+    def __init__(self, id: str = None, file_id: str = None, status: str = "pending",
+                 attempts: int = 0, max_attempts: int = 5, run_after: datetime = None,
+                 locked_by: str = None, locked_at: datetime = None, last_error: str = None,
+                 created_at: datetime = None, updated_at: datetime = None, **kwargs):
+        self.id = id or str(uuid.uuid4())
+        self.file_id = file_id
+        self.status = status
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+        self.run_after = run_after
+        self.locked_by = locked_by
+        self.locked_at = locked_at
+        self.last_error = last_error
+        self.created_at = created_at
+        self.updated_at = updated_at
+        super().__init__(**kwargs)
+    
+    @classmethod
+    async def enqueue(cls, file_id: str, max_attempts: int = 5) -> 'ExtractionJob':
+        """Queue extraction of a file, resetting any previous job for it"""
+        query = """
+            INSERT INTO extraction_jobs (id, file_id, max_attempts)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (file_id) DO UPDATE
+            SET status = 'pending', attempts = 0, max_attempts = EXCLUDED.max_attempts,
+                run_after = CURRENT_TIMESTAMP, locked_by = NULL, locked_at = NULL, last_error = NULL
+        """
+        result = await execute_insert(query, (str(uuid.uuid4()), file_id, max_attempts))
+        return cls.from_dict(result) if result else None
+    
+    @classmethod
+    async def claim(cls, worker_id: str, lock_timeout_seconds: int) -> Optional['ExtractionJob']:
+        """Lock the next due job for a worker.
+        
+        SKIP LOCKED lets any number of workers poll concurrently without
+        blocking on or double-claiming each other's rows. Running jobs whose
+        lock is older than lock_timeout_seconds (a crashed worker) are reclaimed.
+        """
+        query = """
+            UPDATE extraction_jobs
+            SET status = 'running', attempts = attempts + 1,
+                locked_by = %s, locked_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM extraction_jobs
+                WHERE (status = 'pending' AND run_after <= CURRENT_TIMESTAMP)
+                   OR (status = 'running' AND locked_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                ORDER BY run_after
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+        """
+        result = await execute_query_one(query, (worker_id, lock_timeout_seconds))
+        return cls.from_dict(result) if result else None
+    
+    @classmethod
+    async def get_by_file(cls, file_id: str) -> Optional['ExtractionJob']:
+        """Get the extraction job of a file"""
+        query = "SELECT * FROM extraction_jobs WHERE file_id = %s"
+        result = await execute_query_one(query, (file_id,))
+        return cls.from_dict(result) if result else None
+    
+    @classmethod
+    async def count_by_status(cls) -> Dict[str, int]:
+        """Number of jobs in each status"""
+        query = "SELECT status, COUNT(*) AS count FROM extraction_jobs GROUP BY status"
+        results = await execute_query(query)
+        return {row['status']: int(row['count']) for row in results}
+    
+    async def complete(self) -> bool:
+        """Mark the job as done"""
+        query = """
+            UPDATE extraction_jobs
+            SET status = 'done', locked_by = NULL, locked_at = NULL, last_error = NULL
+            WHERE id = %s AND locked_by = %s
+        """
+        rows_affected = await execute_update(query, (self.id, self.locked_by))
+        self.status = "done"
+        return rows_affected > 0
+    
+    async def fail(self, error: str, retry_delay_seconds: Optional[float]) -> bool:
+        """Record a failed attempt.
+        
+        The job is retried after retry_delay_seconds, or moved to the 'dead'
+        state when it is out of attempts or retry_delay_seconds is None.
+        """
+        dead = retry_delay_seconds is None or self.attempts >= self.max_attempts
+        self.status = "dead" if dead else "pending"
+        self.last_error = error
+        query = """
+            UPDATE extraction_jobs
+            SET status = %s, last_error = %s, locked_by = NULL, locked_at = NULL,
+                run_after = CURRENT_TIMESTAMP + make_interval(secs => %s)
+            WHERE id = %s AND locked_by = %s
+        """
+        rows_affected = await execute_update(
+            query, (self.status, error, 0 if dead else retry_delay_seconds, self.id, self.locked_by)
+        )
+        return rows_affected > 0
+
 class ChatSession(BaseModel):
     """Chat session model"""
     
@@ -393,12 +772,32 @@ class ChatSession(BaseModel):
         return cls.from_dict(result) if result else None
     
     @classmethod
-    async def get_by_token(cls, session_token: str) -> Optional['ChatSession']:
-        """Get session by token"""
+    async def get_by_token(cls, session_token: str, max_age_seconds: Optional[int] = None) -> Optional['ChatSession']:
+        """Get session by token, optionally ignoring sessions older than max_age_seconds"""
         query = "SELECT * FROM chat_sessions WHERE session_token = %s AND is_active = true"
-        result = await execute_query_one(query, (session_token,))
+        params = [session_token]
+        if max_age_seconds is not None:
+            query += " AND created_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'"
+            params.append(max_age_seconds)
+        result = await execute_query_one(query, tuple(params))
         return cls.from_dict(result) if result else None
     
+    @classmethod
+    async def deactivate_token(cls, session_token: str) -> bool:
+        """Deactivate a session by token"""
+        query = "UPDATE chat_sessions SET is_active = false WHERE session_token = %s"
+        rows_affected = await execute_update(query, (session_token,))
+        return rows_affected > 0
+    
+    @classmethod
+    async def delete_expired(cls, max_age_seconds: int) -> int:
+        """Remove deactivated sessions and sessions older than max_age_seconds"""
+        query = """
+            DELETE FROM chat_sessions
+            WHERE is_active = false OR created_at <= CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+        """
+        return await execute_delete(query, (max_age_seconds,))
+    
     @classmethod
     async def get_active_by_user(cls, user_id: str) -> List['ChatSession']:
         """Get active sessions by user"""
@@ -429,6 +828,7 @@ class AIUsage(BaseModel):
     def __init__(self, id: str = None, user_id: str = None, chat_id: str = None,
                  message_id: str = None, service_type: str = None, model_name: str = None,
                  prompt_tokens: int = 0, completion_tokens: int = 0, total_tokens: int = 0,
+                 cache_read_tokens: int = 0, cache_write_tokens: int = 0,
                  cost_estimate: float = 0.0, created_at: datetime = None, **kwargs):
         self.id = id or str(uuid.uuid4())
         self.user_id = user_id
@@ -439,6 +839,8 @@ class AIUsage(BaseModel):
         self.prompt_tokens = prompt_tokens
         self.completion_tokens = completion_tokens
         self.total_tokens = total_tokens
+        self.cache_read_tokens = cache_read_tokens
+        self.cache_write_tokens = cache_write_tokens
         self.cost_estimate = cost_estimate
         self.created_at = created_at
         super().__init__(**kwargs)
@@ -447,30 +849,115 @@ class AIUsage(BaseModel):
     async def create(cls, user_id: str, service_type: str, model_name: str,
                     prompt_tokens: int = 0, completion_tokens: int = 0,
                     total_tokens: int = 0, cost_estimate: float = 0.0,
-                    chat_id: str = None, message_id: str = None) -> 'AIUsage':
+                    chat_id: str = None, message_id: str = None,
+                    cache_read_tokens: int = 0, cache_write_tokens: int = 0) -> 'AIUsage':
         """Create a new AI usage record"""
         usage_id = str(uuid.uuid4())
         query = """
             INSERT INTO ai_usage (id, user_id, chat_id, message_id, service_type, 
                                 model_name, prompt_tokens, completion_tokens, 
-                                total_tokens, cost_estimate)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                                total_tokens, cache_read_tokens, cache_write_tokens, cost_estimate)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
         result = await execute_insert(
             query, 
             (usage_id, user_id, chat_id, message_id, service_type, model_name,
-             prompt_tokens, completion_tokens, total_tokens, cost_estimate)
+             prompt_tokens, completion_tokens, total_tokens,
+             cache_read_tokens, cache_write_tokens, cost_estimate)
         )
         return cls.from_dict(result) if result else None
     
     @classmethod
-    async def get_by_user(cls, user_id: str, limit: int = 100, offset: int = 0) -> List['AIUsage']:
-        """Get AI usage by user"""
+    async def create_many(cls, records: List[Dict[str, Any]]) -> int:
+        """Insert many usage records in batched round trips"""
         query = """
-            SELECT * FROM ai_usage 
-            WHERE user_id = %s 
-            ORDER BY created_at DESC 
-            LIMIT %s OFFSET %s
+            INSERT INTO ai_usage (id, user_id, chat_id, message_id, service_type, 
+                                model_name, prompt_tokens, completion_tokens, 
+                                total_tokens, cache_read_tokens, cache_write_tokens, cost_estimate)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
-        results = await execute_query(query, (user_id, limit, offset))
+        await execute_many(query, [
+            (record.get("id") or str(uuid.uuid4()), record["user_id"], record.get("chat_id"),
+             record.get("message_id"), record["service_type"], record["model_name"],
+             record.get("prompt_tokens", 0), record.get("completion_tokens", 0),
+             record.get("total_tokens", 0), record.get("cache_read_tokens", 0),
+             record.get("cache_write_tokens", 0), record.get("cost_estimate", 0.0))
+            for record in records
+        ])
+        return len(records)
+    
+    @classmethod
+    async def get_by_user(cls, user_id: str, limit: int = 100, offset: int = 0,
+                          before: Optional[str] = None, after: Optional[str] = None) -> List['AIUsage']:
+        """Get AI usage by user, newest first"""
+        results = await cls._fetch_page(
+            "ai_usage", "user_id", user_id, "created_at",
+            limit, offset, before, after, descending=True
+        )
         return [cls.from_dict(row) for row in results]
+    
+    @classmethod
+    async def get_request_log(cls, limit: int = 10000) -> List[Dict[str, Any]]:
+        """Recent answered chat requests with their token counts and latency, newest first"""
+        query = """
+            SELECT u.user_id, u.model_name AS model, u.prompt_tokens, u.completion_tokens,
+                   COALESCE((m.metadata->'context_tokens'->>'message')::int, 0) AS message_tokens,
+                   COALESCE((m.metadata->'context_tokens'->>'document')::int, 0) AS document_tokens,
+                   COALESCE((m.metadata->'context_tokens'->>'history')::int, 0) AS history_tokens,
+                   COALESCE((m.metadata->>'processing_time')::float, 0) AS latency_seconds,
+                   u.created_at
+            FROM ai_usage u
+            JOIN messages m ON m.id = u.message_id
+            WHERE u.service_type = 'bedrock'
+            ORDER BY u.created_at DESC
+            LIMIT %s
+        """
+        return await execute_query(query, (limit,))
+
+class ResponseCacheEntry(BaseModel):
+    """Shared tier of the Bedrock response cache"""
+    
+    def __init__(self, key: str = None, model_id: str = None, response: Dict[str, Any] = None,
+                 latency_ms: int = 0, expires_at: datetime = None, created_at: datetime = None, **kwargs):
+        self.key = key
+        self.model_id = model_id
+        self.response = response or {}
+        self.latency_ms = latency_ms
+        self.expires_at = expires_at
+        self.created_at = created_at
+        super().__init__(**kwargs)
+    
+    @classmethod
+    async def get(cls, key: str) -> Optional['ResponseCacheEntry']:
+        """Get a live cache entry"""
+        query = """
+            SELECT * FROM bedrock_response_cache
+            WHERE key = %s AND expires_at > CURRENT_TIMESTAMP
+        """
+        result = await execute_query_one(query, (key,))
+        if not result:
+            return None
+        try:
+            result['response'] = json.loads(result['response'])
+        except (json.JSONDecodeError, TypeError):
+            return None
+        return cls.from_dict(result)
+    
+    @classmethod
+    async def set(cls, key: str, model_id: str, response: Dict[str, Any],
+                  latency_ms: int, ttl_seconds: float) -> None:
+        """Store or refresh a cache entry"""
+        query = """
+            INSERT INTO bedrock_response_cache (key, model_id, response, latency_ms, expires_at)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+            ON CONFLICT (key) DO UPDATE
+            SET response = EXCLUDED.response, latency_ms = EXCLUDED.latency_ms,
+                expires_at = EXCLUDED.expires_at
+        """
+        await execute_update(query, (key, model_id, json.dumps(response), latency_ms, float(ttl_seconds)))
+    
+    @classmethod
+    async def delete_expired(cls) -> int:
+        """Remove expired entries"""
+        query = "DELETE FROM bedrock_response_cache WHERE expires_at <= CURRENT_TIMESTAMP"
+        return await execute_delete(query)
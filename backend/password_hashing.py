@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+# bcrypt cost factor. Hashes made with a different cost are upgraded on the
+# next successful login.
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+
+# Worker processes for hashing; 0 runs hashing on threads instead, for
+# environments without process support (e.g. AWS Lambda).
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 1)))
+
+# Hash operations running or queued before new requests are rejected
+PASSWORD_HASH_MAX_PENDING = int(
+    os.getenv('PASSWORD_HASH_MAX_PENDING', str(max(PASSWORD_HASH_WORKERS, 1) * 4))
+)
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+
+class HashingBusyError(Exception):
+    """Raised when too many password hash operations are already pending"""
+
+def _hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, hashed_password)
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop with a cap on pending operations"""
+    
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS,
+                 max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.completed = 0
+        self._executor: Optional[Executor] = None
+    
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.workers > 0:
+                try:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    logger.info(f"🔑 Password hashing process pool started with {self.workers} workers")
+                except (OSError, NotImplementedError) as e:
+                    logger.warning(f"Process pool unavailable for password hashing, using threads: {e}")
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max(self.workers, 1),
+                    thread_name_prefix='password-hash'
+                )
+        return self._executor
+    
+    async def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HashingBusyError("Too many concurrent authentication requests")
+        
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for subsequent requests
+            logger.error("❌ Password hashing pool broke, restarting it")
+            self._executor = None
+            raise
+        finally:
+            self.pending -= 1
+            self.completed += 1
+    
+    async def hash(self, password: str) -> str:
+        """Hash a password"""
+        return await self._run(_hash_password, password)
+    
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password; also returns a new hash if the stored one is outdated"""
+        return await self._run(_verify_and_update, password, hashed_password)
+    
+    def shutdown(self):
+        """Stop the worker pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+    
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+# Create a singleton instance
+password_hasher = PasswordHasher()
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Optional, List, Dict, Any
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Words, numbers and individual punctuation marks. Claude's tokenizer splits
+# long words into ~4 character pieces, which the estimate below mirrors.
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv('BEDROCK_CONTEXT_TOKEN_BUDGET', '24000'))
+
+# Tokens kept free for recent history before the document is allowed to grow
+HISTORY_RESERVE_TOKENS = int(os.getenv('BEDROCK_HISTORY_RESERVE_TOKENS', '2000'))
+
+DOCUMENT_TRUNCATION_NOTICE = "\n\n[Document truncated to fit the context budget...]"
+
+# Marks the end of a prompt prefix the model may cache between calls
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# Shortest prefix worth marking; Anthropic models ignore cache points on
+# prefixes below 1024 tokens (2048 for Haiku)
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv('BEDROCK_PROMPT_CACHE_MIN_TOKENS', '1024'))
+
+# Estimates of long texts (documents, which are estimated again on every
+# turn) are remembered by a digest of the text, so the cache does not keep
+# the documents themselves alive. Hashing is far cheaper than counting.
+_ESTIMATE_CACHE_MIN_CHARS = 4096
+_estimates = TTLCache(maxsize=256, ttl=3600)
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of model tokens in a piece of text"""
+    if not text:
+        return 0
+    if len(text) < _ESTIMATE_CACHE_MIN_CHARS:
+        return sum((len(piece) + 3) // 4 for piece in _TOKEN_PATTERN.findall(text))
+    
+    key = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+    tokens = _estimates.get(key)
+    if tokens is None:
+        tokens = sum((len(piece) + 3) // 4 for piece in _TOKEN_PATTERN.findall(text))
+        _estimates.set(key, tokens)
+    return tokens
+
+def _load_model_budgets() -> Dict[str, int]:
+    """Per-model input token budgets from BEDROCK_MODEL_TOKEN_BUDGETS (JSON)"""
+    raw = os.getenv('BEDROCK_MODEL_TOKEN_BUDGETS')
+    if not raw:
+        return {}
+    try:
+        return {model: int(budget) for model, budget in json.loads(raw).items()}
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.warning(f"Ignoring invalid BEDROCK_MODEL_TOKEN_BUDGETS: {e}")
+        return {}
+
+class ContextAssembler:
+    """Packs system prompt, document text and history into a token budget"""
+    
+    def __init__(self, default_budget: int = DEFAULT_TOKEN_BUDGET,
+                 history_reserve: int = HISTORY_RESERVE_TOKENS):
+        self.default_budget = default_budget
+        self.history_reserve = history_reserve
+        self.model_budgets = _load_model_budgets()
+    
+    def budget_for(self, model_id: str) -> int:
+        """Input token budget for a model"""
+        return self.model_budgets.get(model_id, self.default_budget)
+    
+    def _truncate_document(self, document_text: str, document_tokens: int, allowed_tokens: int) -> str:
+        """Cut the document down to roughly ``allowed_tokens`` tokens"""
+        allowed_tokens -= estimate_tokens(DOCUMENT_TRUNCATION_NOTICE)
+        if allowed_tokens <= 0:
+            return ""
+        # Scale by the measured chars/token ratio, then trim until it fits
+        cut = int(len(document_text) * allowed_tokens / document_tokens)
+        truncated = document_text[:cut]
+        while cut > 0 and estimate_tokens(truncated) > allowed_tokens:
+            cut = int(cut * 0.95)
+            truncated = document_text[:cut]
+        return truncated + DOCUMENT_TRUNCATION_NOTICE if truncated else ""
+    
+    def assemble(
+        self,
+        model_id: str,
+        system_prompt: str,
+        user_message: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        document_text: Optional[str] = None,
+        document_name: Optional[str] = None,
+        cache_prefix: bool = False,
+        document_stable: bool = True
+    ) -> Dict[str, Any]:
+        """Build the system prompt and conversation for a model call within its token budget.
+        
+        Priority order: system prompt and the new user message are always
+        sent, then the attached document (keeping ``history_reserve`` tokens
+        free), then history from the newest turn backwards.
+        
+        With ``cache_prefix`` a ``document_stable`` document (the same text on
+        every turn, not chunks picked per question) moves from the user turn
+        into the system blocks and is cut at a point that does not depend on
+        the turn, so the system prompt and document form a prefix that is
+        byte-identical across turns. Cache points are only set on prefixes of
+        at least PROMPT_CACHE_MIN_TOKENS.
+        """
+        budget = self.budget_for(model_id)
+        history = history or []
+        
+        system_tokens = estimate_tokens(system_prompt)
+        message_tokens = estimate_tokens(user_message)
+        remaining = max(budget - system_tokens - message_tokens, 0)
+        
+        # Attached document
+        document_block = ""
+        document_tokens = 0
+        document_truncated = False
+        document_cached = False
+        if document_text:
+            header = f"\n\nFile content from {document_name or 'attached document'}:\n"
+            header_tokens = estimate_tokens(header)
+            full_tokens = estimate_tokens(document_text)
+            body = None
+            if cache_prefix and document_stable:
+                # Cut independently of this turn's message and history, so the
+                # block is the same on every turn; fall back if the message
+                # then leaves no room
+                allowed = budget - system_tokens - header_tokens - self.history_reserve
+                stable_body = document_text if full_tokens <= allowed else self._truncate_document(document_text, full_tokens, allowed)
+                if stable_body and estimate_tokens(header + stable_body) <= remaining:
+                    body = stable_body
+                    document_truncated = full_tokens > allowed
+                    document_cached = True
+            if body is None:
+                history_tokens_wanted = sum(estimate_tokens(msg.get("content", "")) for msg in history)
+                allowed = remaining - header_tokens - min(self.history_reserve, history_tokens_wanted)
+                if full_tokens <= allowed:
+                    body = document_text
+                else:
+                    body = self._truncate_document(document_text, full_tokens, allowed)
+                    document_truncated = True
+            if body:
+                document_block = header + body
+                document_tokens = estimate_tokens(document_block)
+                remaining -= document_tokens
+            else:
+                document_cached = False
+        
+        # History, newest first, with whatever budget is left
+        selected: List[Dict[str, str]] = []
+        history_tokens = 0
+        for msg in reversed(history):
+            tokens = estimate_tokens(msg.get("content", ""))
+            if history_tokens + tokens > remaining:
+                break
+            selected.append({"role": msg.get("role", "user"), "content": msg.get("content", "")})
+            history_tokens += tokens
+        selected.reverse()
+        
+        # The conversation has to open with a user turn
+        while selected and selected[0]["role"] != "user":
+            history_tokens -= estimate_tokens(selected.pop(0)["content"])
+        
+        cached_prefix_tokens = 0
+        if cache_prefix:
+            system: Any = [{"type": "text", "text": system_prompt}]
+            if system_tokens >= PROMPT_CACHE_MIN_TOKENS:
+                system[0]["cache_control"] = CACHE_CONTROL
+                cached_prefix_tokens = system_tokens
+            if document_cached:
+                system.append({"type": "text", "text": document_block.lstrip("\n")})
+                if system_tokens + document_tokens >= PROMPT_CACHE_MIN_TOKENS:
+                    system[-1]["cache_control"] = CACHE_CONTROL
+                    cached_prefix_tokens = system_tokens + document_tokens
+                messages = selected + [{"role": "user", "content": user_message}]
+            else:
+                # Chunks picked for this question change every turn, so they
+                # stay after the cached prefix
+                messages = selected + [{"role": "user", "content": user_message + document_block}]
+        else:
+            system = system_prompt
+            messages = selected + [{"role": "user", "content": user_message + document_block}]
+        
+        return {
+            "system": system,
+            "messages": messages,
+            "token_counts": {
+                "budget": budget,
+                "system": system_tokens,
+                "message": message_tokens,
+                "document": document_tokens,
+                "history": history_tokens,
+                "history_messages": len(selected),
+                "document_truncated": document_truncated,
+                "cached_prefix": cached_prefix_tokens,
+                "total": system_tokens + message_tokens + document_tokens + history_tokens
+            }
+        }
+
+# Create a singleton instance
+context_assembler = ContextAssembler()
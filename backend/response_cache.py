@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Optional
+
+from cache import TTLCache
+from models import ResponseCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Shared tier behind the in-process LRU: "memory" (none) or "postgres"
+BEDROCK_CACHE_BACKEND = os.getenv('BEDROCK_CACHE_BACKEND', 'memory').lower()
+BEDROCK_CACHE_SIZE = int(os.getenv('BEDROCK_CACHE_SIZE', '2000'))
+BEDROCK_CACHE_TTL_SECONDS = float(os.getenv('BEDROCK_CACHE_TTL_SECONDS', str(60 * 60 * 24)))
+
+# Which calls may be cached. Chat answers are only cached when the request is
+# deterministic (temperature 0); naming is cached regardless of temperature.
+BEDROCK_CACHE_NAMING = os.getenv('BEDROCK_CACHE_NAMING', 'true').lower() == 'true'
+BEDROCK_CACHE_CHAT = os.getenv('BEDROCK_CACHE_CHAT', 'true').lower() == 'true'
+
+# Expired shared-tier rows are purged once every this many writes
+_PURGE_EVERY_WRITES = 500
+
+class ResponseCache:
+    """Two-tier cache of Bedrock responses keyed by model id and request body"""
+    
+    def __init__(self, backend: str = BEDROCK_CACHE_BACKEND,
+                 maxsize: int = BEDROCK_CACHE_SIZE, ttl: float = BEDROCK_CACHE_TTL_SECONDS):
+        if backend not in ("memory", "postgres"):
+            raise ValueError(f"Unsupported BEDROCK_CACHE_BACKEND: {backend}")
+        self.backend = backend
+        self.ttl = ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.policies = {"naming": BEDROCK_CACHE_NAMING, "chat": BEDROCK_CACHE_CHAT}
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.latency_saved_ms = 0
+        self._writes = 0
+    
+    @staticmethod
+    def make_key(model_id: str, body: Dict[str, Any]) -> str:
+        """SHA-256 of the model id and the canonical JSON of the request body"""
+        canonical = json.dumps(
+            {"model": model_id, "body": body},
+            sort_keys=True, separators=(",", ":"), ensure_ascii=False
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    
+    def key_for(self, call_type: str, model_id: str, body: Dict[str, Any]) -> Optional[str]:
+        """Cache key for a call, or None when the policy does not allow caching it"""
+        if not self.policies.get(call_type, False):
+            return None
+        if call_type == "chat" and body.get("temperature") != 0:
+            return None
+        return self.make_key(model_id, body)
+    
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached response body for a key"""
+        entry = self.local.get(key)
+        if entry is None and self.backend == "postgres":
+            try:
+                shared = await ResponseCacheEntry.get(key)
+            except Exception as e:
+                logger.warning(f"Bedrock cache lookup failed: {e}")
+                shared = None
+            if shared is not None:
+                entry = (shared.response, shared.latency_ms)
+                self.local.set(key, entry)
+                self.shared_hits += 1
+        
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        response, latency_ms = entry
+        self.hits += 1
+        self.latency_saved_ms += latency_ms
+        return response
+    
+    async def set(self, key: str, model_id: str, response: Dict[str, Any], latency_ms: int) -> None:
+        """Store a response with the latency of the call that produced it"""
+        self.local.set(key, (response, latency_ms))
+        if self.backend != "postgres":
+            return
+        try:
+            await ResponseCacheEntry.set(key, model_id, response, latency_ms, self.ttl)
+            self._writes += 1
+            if self._writes % _PURGE_EVERY_WRITES == 0:
+                purged = await ResponseCacheEntry.delete_expired()
+                logger.info(f"🧹 Purged {purged} expired Bedrock cache entries")
+        except Exception as e:
+            logger.warning(f"Bedrock cache write failed: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "policies": self.policies,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "latency_saved_seconds": round(self.latency_saved_ms / 1000, 3),
+            "local": self.local.stats()
+        }
+
+# Create a singleton instance
+response_cache = ResponseCache()
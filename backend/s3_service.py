@@ -1,31 +1,84 @@
+import asyncio
 import boto3
+import hashlib
+import io
 import os
 import logging
-from typing import Optional, List, Dict, Any, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Tuple, BinaryIO
+from botocore.config import Config
 from botocore.exceptions import ClientError
-import PyPDF2
-import docx
-import io
 from datetime import datetime
 import mimetypes
 
+from text_extraction import extraction_engine, clean_extracted_text, ExtractionError
+
 logger = logging.getLogger(__name__)
 
+# Multipart part size (S3 requires at least 5 MB for all but the last part)
+S3_UPLOAD_PART_SIZE_MB = max(int(os.getenv('S3_UPLOAD_PART_SIZE_MB', '8')), 5)
+# Parts of one upload sent in parallel
+S3_UPLOAD_CONCURRENCY = int(os.getenv('S3_UPLOAD_CONCURRENCY', '4'))
+
 class S3FileService:
     """AWS S3 service for file storage and processing"""
     
     def __init__(self):
+        self.part_size = S3_UPLOAD_PART_SIZE_MB * 1024 * 1024
+        self.upload_concurrency = max(S3_UPLOAD_CONCURRENCY, 1)
+        # boto3 calls block, so they run on this pool
+        self.executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='s3')
+        # Uploads since start, and those served by an already stored blob
+        self.uploads = 0
+        self.dedup_hits = 0
+        self.bytes_saved = 0
         self.s3_client = boto3.client(
             's3',
             region_name=os.getenv('AWS_REGION', 'us-east-1'),
             aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY')
+            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+            config=Config(max_pool_connections=16)
         )
         
         self.bucket_name = os.getenv('S3_BUCKET_NAME')
         if not self.bucket_name:
             raise ValueError("S3_BUCKET_NAME environment variable is required")
     
+    def _file_key(self, file_name: str, user_id: str,
+                  content_sha256: Optional[str] = None) -> Tuple[str, str]:
+        """Generate a file key and its timestamp.
+        
+        Files with a known content hash are stored content-addressed under
+        the user's prefix, so a user's identical uploads map onto one object.
+        """
+        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+        if content_sha256:
+            return f"users/{user_id}/blobs/{content_sha256[:2]}/{content_sha256}", timestamp
+        unique_filename = f"{timestamp}_{file_name}"
+        return f"users/{user_id}/files/{unique_filename}", timestamp
+    
+    async def hash_fileobj(self, file_obj: BinaryIO) -> Tuple[str, int]:
+        """SHA-256 hex digest and size of a seekable file, read in parts.
+        
+        The file is rewound afterwards so it can be uploaded.
+        """
+        def _hash():
+            digest = hashlib.sha256()
+            size = 0
+            file_obj.seek(0)
+            for block in iter(lambda: file_obj.read(1024 * 1024), b""):
+                digest.update(block)
+                size += len(block)
+            file_obj.seek(0)
+            return digest.hexdigest(), size
+        
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _hash)
+    
+    def file_url(self, file_key: str) -> str:
+        """Public URL of an object"""
+        return f"https://{self.bucket_name}.s3.{os.getenv('AWS_REGION', 'us-east-1')}.amazonaws.com/{file_key}"
+    
     async def upload_file(
         self, 
         file_content: bytes, 
@@ -34,12 +87,25 @@ class S3FileService:
         content_type: Optional[str] = None
     ) -> Dict[str, Any]:
         """Upload file to S3 and return file info"""
+        return await self.upload_fileobj(io.BytesIO(file_content), file_name, user_id, content_type)
+    
+    async def upload_fileobj(
+        self,
+        file_obj: BinaryIO,
+        file_name: str,
+        user_id: str,
+        content_type: Optional[str] = None,
+        content_sha256: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Stream a file object to S3 and return file info.
+        
+        The file is read one part at a time, so memory use is bounded by
+        part_size * (upload_concurrency + 1) regardless of the file size.
+        Files larger than one part use a multipart upload with parts sent in
+        parallel.
+        """
         try:
-            # Generate unique file key
-            timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-            file_extension = os.path.splitext(file_name)[1]
-            unique_filename = f"{timestamp}_{file_name}"
-            file_key = f"users/{user_id}/files/{unique_filename}"
+            file_key, timestamp = self._file_key(file_name, user_id, content_sha256)
             
             # Detect content type if not provided
             if not content_type:
@@ -47,30 +113,37 @@ class S3FileService:
                 if not content_type:
                     content_type = 'application/octet-stream'
             
-            # Upload to S3
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=file_key,
-                Body=file_content,
-                ContentType=content_type,
-                Metadata={
+            upload_args = {
+                'Bucket': self.bucket_name,
+                'Key': file_key,
+                'ContentType': content_type,
+                'Metadata': {
                     'user_id': user_id,
                     'original_name': file_name,
                     'upload_timestamp': timestamp
                 }
-            )
+            }
             
-            # Generate file URL
-            file_url = f"https://{self.bucket_name}.s3.{os.getenv('AWS_REGION', 'us-east-1')}.amazonaws.com/{file_key}"
+            loop = asyncio.get_running_loop()
+            first_part = await loop.run_in_executor(self.executor, file_obj.read, self.part_size)
+            if len(first_part) < self.part_size:
+                # Fits in one part
+                await loop.run_in_executor(
+                    self.executor,
+                    lambda: self.s3_client.put_object(Body=first_part, **upload_args)
+                )
+                file_size = len(first_part)
+            else:
+                file_size = await self._multipart_upload(file_obj, first_part, upload_args)
             
             return {
                 'file_key': file_key,
-                'file_url': file_url,
-                'file_size': len(file_content),
+                'file_url': self.file_url(file_key),
+                'file_size': file_size,
                 'content_type': content_type,
                 'original_name': file_name
             }
-            
+        
         except ClientError as e:
             logger.error(f"S3 upload error: {e}")
             raise Exception(f"Failed to upload file: {e}")
@@ -78,14 +151,108 @@ class S3FileService:
             logger.error(f"File upload error: {e}")
             raise Exception(f"Upload failed: {e}")
     
+    def record_upload(self, file_size: int, deduplicated: bool):
+        """Count an upload for the deduplication stats"""
+        self.uploads += 1
+        if deduplicated:
+            self.dedup_hits += 1
+            self.bytes_saved += file_size
+    
+    def dedup_stats(self) -> Dict[str, Any]:
+        return {
+            "uploads": self.uploads,
+            "dedup_hits": self.dedup_hits,
+            "dedup_ratio": round(self.dedup_hits / self.uploads, 4) if self.uploads else 0.0,
+            "bytes_saved": self.bytes_saved
+        }
+    
+    async def _multipart_upload(self, file_obj: BinaryIO, first_part: bytes,
+                                upload_args: Dict[str, Any]) -> int:
+        """Upload a file in parts, aborting the upload on any failure"""
+        loop = asyncio.get_running_loop()
+        upload = await loop.run_in_executor(
+            self.executor,
+            lambda: self.s3_client.create_multipart_upload(**upload_args)
+        )
+        upload_id = upload['UploadId']
+        bucket, key = upload_args['Bucket'], upload_args['Key']
+        # Parts in flight; reading waits for a slot so unsent parts never pile up
+        slots = asyncio.Semaphore(self.upload_concurrency)
+        
+        async def upload_part(part_number: int, body: bytes) -> Dict[str, Any]:
+            try:
+                response = await loop.run_in_executor(
+                    self.executor,
+                    lambda: self.s3_client.upload_part(
+                        Bucket=bucket, Key=key, UploadId=upload_id,
+                        PartNumber=part_number, Body=body
+                    )
+                )
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+            finally:
+                slots.release()
+        
+        tasks = []
+        file_size = 0
+        try:
+            part = first_part
+            while part:
+                await slots.acquire()
+                for task in tasks:
+                    if task.done() and task.exception():
+                        raise task.exception()
+                file_size += len(part)
+                tasks.append(asyncio.create_task(upload_part(len(tasks) + 1, part)))
+                part = await loop.run_in_executor(self.executor, file_obj.read, self.part_size)
+            
+            parts = await asyncio.gather(*tasks)
+            await loop.run_in_executor(
+                self.executor,
+                lambda: self.s3_client.complete_multipart_upload(
+                    Bucket=bucket, Key=key, UploadId=upload_id,
+                    MultipartUpload={'Parts': parts}
+                )
+            )
+            logger.info(f"📤 Uploaded {key} in {len(parts)} parts ({file_size} bytes)")
+            return file_size
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            try:
+                await loop.run_in_executor(
+                    self.executor,
+                    lambda: self.s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+                )
+            except Exception as e:
+                logger.warning(f"Failed to abort multipart upload {upload_id}: {e}")
+            raise
+    
     async def get_file(self, file_key: str) -> bytes:
         """Download file from S3"""
-        try:
+        def _download():
             response = self.s3_client.get_object(
                 Bucket=self.bucket_name,
                 Key=file_key
             )
             return response['Body'].read()
+        
+        try:
+            # boto3 is blocking; keep the download off the event loop
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, _download)
+        except ClientError as e:
+            logger.error(f"S3 download error: {e}")
+            raise Exception(f"Failed to download file: {e}")
+    
+    async def download_to_path(self, file_key: str, path: str) -> None:
+        """Download a file from S3 to disk without holding it in memory"""
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                self.executor,
+                lambda: self.s3_client.download_file(self.bucket_name, file_key, path)
+            )
         except ClientError as e:
             logger.error(f"S3 download error: {e}")
             raise Exception(f"Failed to download file: {e}")
@@ -104,11 +271,14 @@ class S3FileService:
     
     async def extract_text_from_file(
         self, 
-        file_content: bytes, 
+        file_path: str, 
         file_name: str,
         content_type: str
     ) -> Tuple[str, bool]:
-        """Extract text content from uploaded files"""
+        """Extract text content from an uploaded file stored at file_path.
+        
+        Raises ExtractionError when extraction timed out or its worker crashed.
+        """
         try:
             extracted_text = ""
             success = False
@@ -116,24 +286,25 @@ class S3FileService:
             file_extension = os.path.splitext(file_name)[1].lower()
             
             if file_extension == '.pdf' or content_type == 'application/pdf':
-                extracted_text, success = self._extract_pdf_text(file_content)
-                
+                extracted_text, success = await extraction_engine.extract_pdf(file_path)
+            
             elif file_extension in ['.docx', '.doc'] or content_type in [
                 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
                 'application/msword'
             ]:
-                extracted_text, success = self._extract_docx_text(file_content)
-                
+                extracted_text, success = await extraction_engine.extract_docx(file_path)
+            
             elif file_extension == '.txt' or content_type == 'text/plain':
                 try:
-                    raw_text = file_content.decode('utf-8', errors='ignore')
-                    extracted_text = self._clean_extracted_text(raw_text)
+                    with open(file_path, 'rb') as text_file:
+                        raw_text = text_file.read().decode('utf-8', errors='ignore')
+                    extracted_text = clean_extracted_text(raw_text)
                     success = True
                 except Exception as e:
                     logger.error(f"Text file decoding error: {e}")
                     extracted_text = f"Error reading text file: {str(e)}"
                     success = False
-                
+            
             else:
                 logger.warning(f"Unsupported file type: {file_extension}, {content_type}")
                 extracted_text = f"File type {file_extension} is not supported for text extraction."
@@ -145,133 +316,23 @@ class S3FileService:
                     # Test if the text can be safely encoded/decoded
                     test_encoded = extracted_text.encode('utf-8')
                     test_decoded = test_encoded.decode('utf-8')
-                    
-                    # Limit the text length to prevent database issues
-                    if len(extracted_text) > 100000:  # 100KB limit
-                        extracted_text = extracted_text[:100000] + "\n\n[Text truncated due to length...]"
-                        logger.info(f"Text truncated for {file_name} (original length: {len(extracted_text)})")
-                    
+                    # The full text is returned so it can all be chunked;
+                    # callers limit what they store inline
+                
                 except UnicodeError as e:
                     logger.error(f"Unicode error in extracted text from {file_name}: {e}")
                     extracted_text = "Error: File contains characters that cannot be processed"
                     success = False
             
             return extracted_text, success
-            
+        
+        except ExtractionError:
+            # Timeouts and worker crashes are retryable, not a property of the file
+            raise
         except Exception as e:
             logger.error(f"Text extraction error: {e}")
             return f"Error extracting text from {file_name}: {str(e)}", False
     
-    def _extract_pdf_text(self, file_content: bytes) -> Tuple[str, bool]:
-        """Extract text from PDF file"""
-        try:
-            pdf_file = io.BytesIO(file_content)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            
-            text_content = []
-            for page_num, page in enumerate(pdf_reader.pages):
-                try:
-                    page_text = page.extract_text()
-                    if page_text and page_text.strip():
-                        # Clean the text to handle encoding issues
-                        cleaned_text = self._clean_extracted_text(page_text)
-                        if cleaned_text.strip():
-                            text_content.append(f"--- Page {page_num + 1} ---\n{cleaned_text}")
-                except Exception as e:
-                    logger.warning(f"Error extracting page {page_num + 1}: {e}")
-                    continue
-            
-            if text_content:
-                final_text = "\n\n".join(text_content)
-                return final_text, True
-            else:
-                return "No text content found in PDF", False
-                
-        except Exception as e:
-            logger.error(f"PDF extraction error: {e}")
-            return f"Error reading PDF: {str(e)}", False
-    
-    def _extract_docx_text(self, file_content: bytes) -> Tuple[str, bool]:
-        """Extract text from DOCX file"""
-        try:
-            docx_file = io.BytesIO(file_content)
-            doc = docx.Document(docx_file)
-            
-            text_content = []
-            
-            # Extract paragraphs
-            for paragraph in doc.paragraphs:
-                if paragraph.text and paragraph.text.strip():
-                    cleaned_text = self._clean_extracted_text(paragraph.text)
-                    if cleaned_text.strip():
-                        text_content.append(cleaned_text)
-            
-            # Extract tables
-            for table in doc.tables:
-                for row in table.rows:
-                    row_text = []
-                    for cell in row.cells:
-                        if cell.text and cell.text.strip():
-                            cleaned_text = self._clean_extracted_text(cell.text)
-                            if cleaned_text.strip():
-                                row_text.append(cleaned_text)
-                    if row_text:
-                        text_content.append(" | ".join(row_text))
-            
-            if text_content:
-                final_text = "\n\n".join(text_content)
-                return final_text, True
-            else:
-                return "No text content found in document", False
-                
-        except Exception as e:
-            logger.error(f"DOCX extraction error: {e}")
-            return f"Error reading DOCX: {str(e)}", False
-    
-    def _clean_extracted_text(self, text: str) -> str:
-        """Clean extracted text to handle encoding issues and problematic characters"""
-        try:
-            import re
-            
-            # Remove or replace problematic Unicode characters
-            # Remove surrogate pairs and other problematic characters
-            text = re.sub(r'[\ud800-\udfff]', '', text)  # Remove surrogate pairs
-            text = re.sub(r'[\ufeff\ufffe]', '', text)   # Remove BOM characters
-            text = re.sub(r'[\u0000-\u0008\u000b\u000c\u000e-\u001f]', '', text)  # Remove control characters
-            
-            # Replace common problematic characters with ASCII equivalents
-            replacements = {
-                '\u2018': "'",  # Left single quotation mark
-                '\u2019': "'",  # Right single quotation mark
-                '\u201c': '"',  # Left double quotation mark
-                '\u201d': '"',  # Right double quotation mark
-                '\u2013': '-',  # En dash
-                '\u2014': '-',  # Em dash
-                '\u2026': '...',  # Horizontal ellipsis
-                '\u00a0': ' ',  # Non-breaking space
-            }
-            
-            for old_char, new_char in replacements.items():
-                text = text.replace(old_char, new_char)
-            
-            # Normalize whitespace
-            text = re.sub(r'\s+', ' ', text)  # Replace multiple whitespace with single space
-            text = text.strip()
-            
-            # Ensure the final text is valid UTF-8
-            # This will replace any remaining problematic characters
-            text = text.encode('utf-8', errors='ignore').decode('utf-8')
-            
-            return text
-            
-        except Exception as e:
-            logger.error(f"Text cleaning error: {e}")
-            # If cleaning fails, try basic cleanup
-            try:
-                return text.encode('utf-8', errors='ignore').decode('utf-8').strip()
-            except:
-                return "Error processing text content"
-    
     async def generate_presigned_url(
         self, 
         file_key: str, 
@@ -3,6 +3,11 @@ from typing import Optional, List, Dict, Any
 from datetime import datetime
 from enum import Enum
 
+# Page size caps for list endpoints
+MAX_CHAT_PAGE_SIZE = 100
+MAX_MESSAGE_PAGE_SIZE = 200
+MAX_FILE_PAGE_SIZE = 100
+
 class MessageType(str, Enum):
     USER = "user"
     BOT = "bot"
@@ -78,6 +83,8 @@ class ChatListResponse(BaseModel):
     total: int
     limit: int
     offset: int
+    next_cursor: Optional[str] = None  # Pass as ?after= for the next page
+    prev_cursor: Optional[str] = None  # Pass as ?before= for the previous page
     
     model_config = ConfigDict(from_attributes=True)
 
@@ -102,9 +109,18 @@ class FileResponse(FileUploadResponse):
     
     model_config = ConfigDict(from_attributes=True)
 
+class FileStatusResponse(BaseModel):
+    id: str
+    processed: bool
+    extraction_status: str
+    attempts: int = 0
+    error: Optional[str] = None
+    updated_at: Optional[datetime] = None
+
 # AI Chat Schemas
 class ChatMessageRequest(BaseModel):
     content: str = Field(..., min_length=1)
+    file_id: Optional[str] = None
     file_name: Optional[str] = None
     file_url: Optional[str] = None
     metadata: Optional[Dict[str, Any]] = None
@@ -151,6 +167,8 @@ class AIUsageCreate(BaseModel):
     prompt_tokens: int = 0
     completion_tokens: int = 0
     total_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
     cost_estimate: float = 0.0
 
 class AIUsageResponse(AIUsageCreate):
@@ -178,14 +196,14 @@ class APIResponse(BaseModel):
 
 # Search and Filter Schemas
 class ChatFilter(BaseModel):
-    limit: int = Field(default=20, ge=1, le=100)
+    limit: int = Field(default=20, ge=1, le=MAX_CHAT_PAGE_SIZE)
     offset: int = Field(default=0, ge=0)
     search: Optional[str] = None
     start_date: Optional[datetime] = None
     end_date: Optional[datetime] = None
 
 class MessageFilter(BaseModel):
-    limit: int = Field(default=50, ge=1, le=200)
+    limit: int = Field(default=50, ge=1, le=MAX_MESSAGE_PAGE_SIZE)
     offset: int = Field(default=0, ge=0)
     message_type: Optional[MessageType] = None
     search: Optional[str] = None
@@ -1,27 +1,52 @@
-from fastapi import FastAPI, HTTPException, status, UploadFile, File, Cookie, Response, Depends
+from fastapi import FastAPI, HTTPException, status, UploadFile, File, Cookie, Response, Depends, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 import os
 import logging
+import asyncio
 from typing import List, Optional
 import uuid
 from datetime import datetime
 import json
+import hmac
 from mangum import Mangum
 
 # Local imports
-from database import create_tables, test_connection, initialize_connection_pool
-from models import User, Chat, Message, File as FileModel, AIUsage
+from database import (
+    create_tables, test_connection, initialize_connection_pool,
+    close_connection_pool, close_async_pool
+)
+from models import (
+    User, Chat, Message, File as FileModel, FileChunk, ExtractionJob,
+    encode_cursor, user_cache
+)
 from schemas import (
     UserCreate, UserLogin, UserResponse, LoginResponse,
     ChatCreate, ChatResponse, ChatListResponse, ChatUpdate,
     MessageCreate, MessageResponse, ChatMessageRequest, ChatMessageResponse,
-    FileUploadResponse, HealthCheck, APIResponse
+    FileUploadResponse, FileStatusResponse, HealthCheck, APIResponse,
+    MAX_CHAT_PAGE_SIZE, MAX_MESSAGE_PAGE_SIZE, MAX_FILE_PAGE_SIZE
+)
+from auth import (
+    authenticate_user, get_password_hash, create_session, get_user_from_session,
+    delete_session, session_store, password_hasher, HashingBusyError
 )
-from auth import authenticate_user, get_password_hash, create_session, get_user_from_session, delete_session
 from bedrock_service import bedrock_service
+from admission import admission_controller, AdmissionError, ModelBusyError
+from model_router import model_router
+from sse import SSEEncoder, sse_stats
+from chat_streams import ChatStream, chat_stream_registry, STREAM_CHECKPOINT_SECONDS
+from prompt_context import estimate_tokens
+from usage_recorder import usage_recorder
+from response_cache import response_cache
+from document_chunks import (
+    build_search_query, select_chunks, format_chunks,
+    DOCUMENT_CONTEXT_TOKENS, DOCUMENT_TOP_K
+)
 from s3_service import s3_service
+from text_extraction import extraction_engine
+from extraction_worker import extraction_worker, EXTRACTION_MAX_ATTEMPTS
 
 # Load environment variables
 load_dotenv()
@@ -56,8 +81,177 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor"],
 )
 
+# Shared secret for GET /metrics, sent as "Authorization: Bearer <token>";
+# the endpoint is disabled when it is not set
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Number of earlier messages sent to the model as conversation history
+CONTEXT_HISTORY_MESSAGES = 9
+
+# Polling interval and lifetime of a file status event stream
+FILE_EVENTS_POLL_SECONDS = float(os.getenv('FILE_EVENTS_POLL_SECONDS', '1'))
+FILE_EVENTS_TIMEOUT_SECONDS = float(os.getenv('FILE_EVENTS_TIMEOUT_SECONDS', '300'))
+
+def build_context_messages(messages: List[Message]) -> List[dict]:
+    """Convert stored messages to model conversation turns"""
+    return [
+        {
+            "role": "user" if msg.type == "user" else "assistant",
+            "content": msg.content
+        }
+        for msg in messages
+        if msg.content  # Skip placeholders left by interrupted streams
+    ]
+
+def page_cursors(items: list, sort_attr: str, limit: int) -> tuple:
+    """Cursors for the pages after and before a list of model instances"""
+    if not items:
+        return None, None
+    first, last = items[0], items[-1]
+    next_cursor = encode_cursor(getattr(last, sort_attr), last.id) if len(items) >= limit else None
+    prev_cursor = encode_cursor(getattr(first, sort_attr), first.id)
+    return next_cursor, prev_cursor
+
+def set_cursor_headers(response: Response, next_cursor: Optional[str], prev_cursor: Optional[str]):
+    """Expose pagination cursors on list endpoints that return bare arrays"""
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if prev_cursor:
+        response.headers["X-Prev-Cursor"] = prev_cursor
+
+def invalid_cursor(e: ValueError) -> HTTPException:
+    """400 response for malformed pagination cursors"""
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=str(e)
+    )
+
+def too_many_requests() -> HTTPException:
+    """429 response used when password hashing is saturated"""
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many authentication requests, please retry shortly",
+        headers={"Retry-After": "1"}
+    )
+
+def admission_status(e: AdmissionError) -> int:
+    """429 while the model is rate limited, 503 while its circuit is open"""
+    if isinstance(e, ModelBusyError):
+        return status.HTTP_429_TOO_MANY_REQUESTS
+    return status.HTTP_503_SERVICE_UNAVAILABLE
+
+def model_not_admitted(e: AdmissionError) -> HTTPException:
+    """Response for a model call refused by the admission controller"""
+    return HTTPException(
+        status_code=admission_status(e),
+        detail=str(e),
+        headers={"Retry-After": str(int(e.retry_after + 0.5))}
+    )
+
+async def get_attached_document(user_id: str, message_data: ChatMessageRequest) -> tuple:
+    """Document text to send with a message, its file name and retrieval details.
+    
+    Documents that fit DOCUMENT_CONTEXT_TOKENS are sent whole; longer ones are
+    reduced to the chunks most relevant to the question.
+    """
+    if not (message_data.file_id or message_data.file_url):
+        return None, None, {}
+    
+    try:
+        file_record = await FileModel.get_document(
+            user_id,
+            file_id=message_data.file_id,
+            file_url=message_data.file_url
+        )
+        if not file_record:
+            logger.warning(f"❌ No file with extracted text for id={message_data.file_id} url={message_data.file_url}")
+            return None, None, {}
+        
+        chunk_stats = await FileChunk.get_stats(file_record.id)
+        if not chunk_stats["chunk_count"]:
+            # Uploaded before chunking existed
+            document_text = await FileModel.get_extraction_text(file_record.id)
+            retrieval = {"mode": "full_text"}
+        elif chunk_stats["total_tokens"] <= DOCUMENT_CONTEXT_TOKENS:
+            chunks = await FileChunk.get_by_file(file_record.id)
+            document_text = format_chunks(chunks, excerpt=False)
+            retrieval = {"mode": "all_chunks", "chunks": len(chunks)}
+        else:
+            ranked = await FileChunk.search(
+                file_record.id,
+                build_search_query(message_data.content),
+                DOCUMENT_TOP_K
+            )
+            chunks = select_chunks(ranked, DOCUMENT_CONTEXT_TOKENS)
+            document_text = format_chunks(chunks, excerpt=True)
+            retrieval = {
+                "mode": "top_chunks",
+                "chunks": len(chunks),
+                "total_chunks": chunk_stats["chunk_count"],
+                "pages": sorted({chunk["page"] for chunk in chunks if chunk.get("page")})
+            }
+    except Exception as e:
+        logger.warning(f"Could not get file content: {e}")
+        return None, None, {}
+    
+    logger.info(f"✅ Found file content for {file_record.original_name}: {len(document_text or '')} characters ({retrieval['mode']})")
+    return document_text, file_record.original_name, retrieval
+
+# Detached tasks (e.g. chat naming) that outlive the request that started them;
+# referenced here so they are not garbage collected before finishing
+background_tasks = set()
+
+def spawn_background(coro) -> asyncio.Task:
+    """Run a coroutine as a detached task"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def event_stream_response(stream: ChatStream, after_id: int = 0) -> StreamingResponse:
+    """SSE response following a chat stream from the event after ``after_id``"""
+    async def frames():
+        sse = SSEEncoder()
+        try:
+            async for item in stream.follow(after_id, sse.heartbeat_seconds):
+                yield sse.heartbeat() if item is None else sse.frame(*item)
+        finally:
+            sse.close()
+    
+    return StreamingResponse(
+        frames(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            # Stop reverse proxies (e.g. nginx) from buffering the stream
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+async def name_chat(chat: Chat, message_data: ChatMessageRequest, document_text: Optional[str]) -> Optional[str]:
+    """Generate and store a title for a new chat; returns None on failure"""
+    try:
+        logger.info(f"🏷️ Generating chat name for first message...")
+        name_response = await bedrock_service.generate_chat_name(
+            message=message_data.content,
+            file_content=document_text,
+            file_names=[message_data.file_name] if message_data.file_name else None
+        )
+        
+        if name_response.get("suggested_name"):
+            chat_name = name_response["suggested_name"]
+            # Update chat title
+            await chat.update_title(chat_name)
+            logger.info(f"✅ Generated chat name: {chat_name}")
+            return chat_name
+    except Exception as e:
+        logger.warning(f"Failed to generate chat name: {e}")
+    return None
+
 # Simple session-based auth dependency
 async def get_current_user(session_id: Optional[str] = Cookie(None)) -> User:
     """Get current user from session cookie"""
@@ -67,14 +261,14 @@ async def get_current_user(session_id: Optional[str] = Cookie(None)) -> User:
             detail="No session found"
         )
     
-    user_id = get_user_from_session(session_id)
+    user_id = await get_user_from_session(session_id)
     if not user_id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid session"
         )
     
-    user = await User.get_by_id(user_id)
+    user = await User.get_cached(user_id)
     if not user or not user.is_active:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -83,6 +277,21 @@ async def get_current_user(session_id: Optional[str] = Cookie(None)) -> User:
     
     return user
 
+async def require_metrics_token(authorization: Optional[str] = Header(None)):
+    """Allow only callers presenting METRICS_TOKEN"""
+    if not METRICS_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Not Found"
+        )
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
@@ -98,11 +307,27 @@ async def startup_event():
         
         create_tables()
         logger.info("✅ Database initialized successfully")
+        
+        extraction_worker.start()
         logger.info("✅ IFlyChat backend startup complete")
     except Exception as e:
         logger.error(f"❌ Startup failed: {e}")
         raise
 
+# Shutdown event
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers and release database pools on shutdown"""
+    await chat_stream_registry.shutdown()
+    if background_tasks:
+        await asyncio.wait(list(background_tasks), timeout=5)
+    await usage_recorder.stop()
+    await extraction_worker.stop()
+    await close_async_pool()
+    close_connection_pool()
+    password_hasher.shutdown()
+    extraction_engine.shutdown()
+
 # Health check
 @app.get("/health", response_model=HealthCheck)
 async def health_check():
@@ -115,6 +340,28 @@ async def health_check():
         timestamp=datetime.utcnow()
     )
 
+# Metrics endpoint
+@app.get("/metrics", response_model=APIResponse, dependencies=[Depends(require_metrics_token)])
+async def metrics():
+    """In-process cache and service counters; requires METRICS_TOKEN"""
+    return APIResponse(
+        success=True,
+        message="Service metrics",
+        data={
+            "user_cache": user_cache.stats(),
+            "sessions": session_store.stats(),
+            "password_hashing": password_hasher.stats(),
+            "extraction_worker": extraction_worker.stats(),
+            "extraction_engine": extraction_engine.stats(),
+            "upload_dedup": s3_service.dedup_stats(),
+            "bedrock_cache": response_cache.stats(),
+            "bedrock_admission": admission_controller.stats(),
+            "model_routing": model_router.stats(),
+            "chat_streams": {**chat_stream_registry.stats(), "sse": sse_stats.stats()},
+            "ai_usage": usage_recorder.stats()
+        }
+    )
+
 # Root endpoint
 @app.get("/", response_model=APIResponse)
 async def root():
@@ -137,7 +384,10 @@ async def register_user(user_data: UserCreate):
             detail="Email already registered"
         )
     
-    hashed_password = get_password_hash(user_data.password)
+    try:
+        hashed_password = await get_password_hash(user_data.password)
+    except HashingBusyError:
+        raise too_many_requests()
     new_user = await User.create(
         name=user_data.name,
         email=user_data.email,
@@ -159,7 +409,10 @@ async def register_user(user_data: UserCreate):
 @app.post("/auth/login", response_model=LoginResponse)
 async def login_user(user_credentials: UserLogin, response: Response):
     """Authenticate user and create session"""
-    user = await authenticate_user(user_credentials.email, user_credentials.password)
+    try:
+        user = await authenticate_user(user_credentials.email, user_credentials.password)
+    except HashingBusyError:
+        raise too_many_requests()
     
     if not user:
         raise HTTPException(
@@ -168,7 +421,7 @@ async def login_user(user_credentials: UserLogin, response: Response):
         )
     
     # Create session
-    session_id = create_session(user)
+    session_id = await create_session(user)
     
     # Set session cookie
     response.set_cookie(
@@ -190,7 +443,7 @@ async def login_user(user_credentials: UserLogin, response: Response):
 async def logout_user(response: Response, session_id: Optional[str] = Cookie(None)):
     """Logout user and clear session"""
     if session_id:
-        delete_session(session_id)
+        await delete_session(session_id)
     
     response.delete_cookie("session_id")
     
@@ -210,20 +463,27 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 @app.get("/chats", response_model=ChatListResponse)
 async def get_user_chats(
     current_user: User = Depends(get_current_user),
-    limit: int = 50,
-    offset: int = 0
+    limit: int = Query(50, ge=1, le=MAX_CHAT_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    before: Optional[str] = None,
+    after: Optional[str] = None
 ):
-    """Get user's chats with pagination"""
+    """Get user's chats with cursor pagination (offset is kept for old clients)"""
     try:
-        chats = await Chat.get_by_user(current_user.id, limit, offset)
+        chats = await Chat.get_by_user(current_user.id, limit, offset, before, after)
         chat_responses = [ChatResponse.model_validate(chat.to_dict()) for chat in chats]
+        next_cursor, prev_cursor = page_cursors(chats, "updated_at", limit)
         
         return ChatListResponse(
             chats=chat_responses,
             total=len(chat_responses),
             limit=limit,
-            offset=offset
+            offset=offset,
+            next_cursor=next_cursor,
+            prev_cursor=prev_cursor
         )
+    except ValueError as e:
+        raise invalid_cursor(e)
     except Exception as e:
         logger.error(f"Error fetching chats: {e}")
         raise HTTPException(
@@ -305,11 +565,14 @@ async def delete_chat(
 @app.get("/chats/{chat_id}/messages", response_model=List[MessageResponse])
 async def get_chat_messages(
     chat_id: str,
+    response: Response,
     current_user: User = Depends(get_current_user),
-    limit: int = 100,
-    offset: int = 0
+    limit: int = Query(100, ge=1, le=MAX_MESSAGE_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    before: Optional[str] = None,
+    after: Optional[str] = None
 ):
-    """Get messages for a chat"""
+    """Get messages for a chat, oldest first; page cursors are returned in headers"""
     chat = await Chat.get_by_id(chat_id)
     
     if not chat or chat.user_id != current_user.id:
@@ -318,7 +581,12 @@ async def get_chat_messages(
             detail="Chat not found"
         )
     
-    messages = await Message.get_by_chat(chat_id, limit, offset)
+    try:
+        messages = await Message.get_by_chat(chat_id, limit, offset, before, after)
+    except ValueError as e:
+        raise invalid_cursor(e)
+    
+    set_cursor_headers(response, *page_cursors(messages, "created_at", limit))
     return [MessageResponse.model_validate(msg.to_dict()) for msg in messages]
 
 @app.post("/chats/{chat_id}/messages", response_model=ChatMessageResponse)
@@ -353,40 +621,25 @@ async def send_message(
                 detail="Failed to create user message"
             )
         
-        # Get context for AI - exclude the current user message to avoid duplication
-        recent_messages = await Message.get_by_chat(chat_id, limit=10)
-        context_messages = []
-        for msg in recent_messages[-9:]:  # Last 9 messages (excluding the one we just created)
-            context_messages.append({
-                "role": "user" if msg.type == "user" else "assistant",
-                "content": msg.content
-            })
+        # Get context for AI - only the turns that precede the new user message
+        recent_messages = await Message.get_recent(chat_id, limit=CONTEXT_HISTORY_MESSAGES, before=user_message)
+        context_messages = build_context_messages(recent_messages)
         
         # Add file content if available
-        file_content = ""
-        if message_data.file_name and message_data.file_url:
-            logger.info(f"🔍 Looking for file content: {message_data.file_name} at {message_data.file_url}")
-            try:
-                files = await FileModel.get_by_user(current_user.id, limit=100)
-                logger.info(f"📁 Found {len(files)} files for user")
-                for file_record in files:
-                    logger.info(f"📄 Checking file: {file_record.original_name} - URL: {file_record.file_url} - Has text: {bool(file_record.extraction_text)}")
-                    if file_record.file_url == message_data.file_url and file_record.extraction_text:
-                        file_content = f"\n\nFile content from {file_record.original_name}:\n{file_record.extraction_text}"
-                        logger.info(f"✅ Found matching file content: {len(file_content)} characters")
-                        break
-                else:
-                    logger.warning(f"❌ No matching file found with extracted text for URL: {message_data.file_url}")
-            except Exception as e:
-                logger.warning(f"Could not get file content: {e}")
+        document_text, document_name, document_retrieval = await get_attached_document(current_user.id, message_data)
+        
+        # Name a new chat concurrently with the answer instead of after it
+        naming_task = spawn_background(name_chat(chat, message_data, document_text)) if not recent_messages else None
         
         # Generate AI response
-        full_user_content = message_data.content + file_content
-        logger.info(f"📝 Sending to AI - User content length: {len(message_data.content)}, File content length: {len(file_content)}, Total: {len(full_user_content)}")
+        logger.info(f"📝 Sending to AI - User content length: {len(message_data.content)}, File content length: {len(document_text or '')}")
         ai_response = await bedrock_service.generate_chat_response(
-            user_message=full_user_content,
+            user_message=message_data.content,
             context_messages=context_messages,
-            user_id=current_user.id
+            user_id=current_user.id,
+            document_text=document_text,
+            document_name=document_name,
+            document_stable=document_retrieval.get("mode") != "top_chunks"
         )
         
         # Create AI message
@@ -397,15 +650,18 @@ async def send_message(
             metadata={
                 "model": ai_response.get("model", "unknown"),
                 "tokens_used": ai_response.get("tokens_used", 0),
-                "processing_time": ai_response.get("processing_time", 0)
+                "processing_time": ai_response.get("processing_time", 0),
+                "context_tokens": ai_response.get("context_tokens", {}),
+                "routing": ai_response.get("routing", {}),
+                "document_retrieval": document_retrieval
             }
         )
         
-        # Record AI usage
+        # Record AI usage (buffered and written in batches)
         try:
             if ai_message and ai_response.get("usage"):
                 usage = ai_response["usage"]
-                await AIUsage.create(
+                await usage_recorder.record(
                     user_id=current_user.id,
                     chat_id=chat_id,
                     message_id=ai_message.id,
@@ -414,30 +670,16 @@ async def send_message(
                     prompt_tokens=usage.get("prompt_tokens", 0),
                     completion_tokens=usage.get("completion_tokens", 0),
                     total_tokens=usage.get("total_tokens", 0),
-                    cost_estimate=0.0  # Calculate based on model pricing if needed
+                    cache_read_tokens=usage.get("cache_read_tokens", 0),
+                    cache_write_tokens=usage.get("cache_write_tokens", 0),
+                    cost_estimate=model_router.estimate_cost(ai_response.get("model", "unknown"), usage)
                 )
         except Exception as e:
             logger.warning(f"Failed to record AI usage: {e}")
         
-        # Auto-generate chat name if this is the first user message
-        chat_name = None
-        try:
-            message_count = len(recent_messages)
-            if message_count <= 1:  # First message (user message just created)
-                logger.info(f"🏷️ Generating chat name for first message...")
-                name_response = await bedrock_service.generate_chat_name(
-                    message=message_data.content,
-                    file_content=file_content if file_content else None,
-                    file_names=[message_data.file_name] if message_data.file_name else None
-                )
-                
-                if name_response.get("suggested_name"):
-                    chat_name = name_response["suggested_name"]
-                    # Update chat title
-                    await chat.update_title(chat_name)
-                    logger.info(f"✅ Generated chat name: {chat_name}")
-        except Exception as e:
-            logger.warning(f"Failed to generate chat name: {e}")
+        # Return the chat name if it is already known; otherwise naming finishes
+        # in the background and shows up on the next chat list refresh
+        chat_name = naming_task.result() if naming_task and naming_task.done() else None
         
         return ChatMessageResponse(
             user_message=MessageResponse.model_validate(user_message.to_dict()),
@@ -445,7 +687,10 @@ async def send_message(
             chat_name=chat_name,
             processing_time=ai_response.get("processing_time", 0)
         )
-        
+    
+    except AdmissionError as e:
+        logger.warning(f"⚠️ AI model call not admitted: {e}")
+        raise model_not_admitted(e)
     except Exception as e:
         logger.error(f"Error processing message: {e}")
         raise HTTPException(
@@ -485,93 +730,129 @@ async def send_message_stream(
                 detail="Failed to create user message"
             )
         
-        # Get context for AI
-        recent_messages = await Message.get_by_chat(chat_id, limit=10)
-        context_messages = []
-        for msg in recent_messages[-9:]:  # Last 9 messages (excluding the one we just created)
-            context_messages.append({
-                "role": "user" if msg.type == "user" else "assistant",
-                "content": msg.content
-            })
+        # Get context for AI - only the turns that precede the new user message
+        recent_messages = await Message.get_recent(chat_id, limit=CONTEXT_HISTORY_MESSAGES, before=user_message)
+        context_messages = build_context_messages(recent_messages)
         
         # Add file content if available
-        file_content = ""
-        if message_data.file_name and message_data.file_url:
-            try:
-                files = await FileModel.get_by_user(current_user.id, limit=100)
-                for file_record in files:
-                    if file_record.file_url == message_data.file_url and file_record.extraction_text:
-                        file_content = f"\n\nFile content from {file_record.original_name}:\n{file_record.extraction_text}"
-                        break
-            except Exception as e:
-                logger.warning(f"Could not get file content: {e}")
+        document_text, document_name, document_retrieval = await get_attached_document(current_user.id, message_data)
+        
+        # Create AI message placeholder, filled in by checkpoints as the answer streams
+        ai_message = await Message.create(
+            chat_id=chat_id,
+            type="bot",
+            content="",
+            metadata={"stream_status": "streaming"}
+        )
         
-        full_user_content = message_data.content + file_content
+        if not ai_message:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to create AI message"
+            )
         
-        async def generate_response():
-            try:
-                # Send initial user message data
-                yield f"data: {json.dumps({'type': 'user_message', 'message': user_message.to_dict()})}\n\n"
-                
-                # Create AI message placeholder
-                ai_message = await Message.create(
+        async def produce(stream: ChatStream):
+            # Name a new chat concurrently with the answer; the chat_name event
+            # is sent as soon as it is ready, and never delays stream_complete.
+            # A name that arrives later reaches the client through a chat list refresh.
+            def publish_chat_name(task: asyncio.Task):
+                chat_name = None if task.cancelled() else task.result()
+                if chat_name:
+                    stream.publish({'type': 'chat_name', 'name': chat_name})
+            
+            if not recent_messages:
+                spawn_background(name_chat(chat, message_data, document_text)).add_done_callback(publish_chat_name)
+            
+            stream.publish({'type': 'user_message', 'message': user_message.to_dict()})
+            stream.publish({'type': 'ai_message_start', 'message_id': ai_message.id})
+            
+            stream_info = {}
+            answer = bedrock_service.generate_chat_response_stream(
+                user_message=message_data.content,
+                context_messages=context_messages,
+                user_id=current_user.id,
+                document_text=document_text,
+                document_name=document_name,
+                stream_info=stream_info,
+                document_stable=document_retrieval.get("mode") != "top_chunks"
+            )
+            
+            async def record_usage():
+                # Cached replays report no usage and cost nothing
+                usage = stream.usage
+                if not usage:
+                    return
+                model_name = stream_info.get("model", "unknown")
+                await usage_recorder.record(
+                    user_id=current_user.id,
                     chat_id=chat_id,
-                    type="bot",
-                    content="",  # Will be updated as we stream
-                    metadata={}
+                    message_id=ai_message.id,
+                    service_type="bedrock",
+                    model_name=model_name,
+                    prompt_tokens=usage.get("prompt_tokens", 0),
+                    completion_tokens=usage.get("completion_tokens", 0),
+                    total_tokens=usage.get("total_tokens", 0),
+                    cache_read_tokens=usage.get("cache_read_tokens", 0),
+                    cache_write_tokens=usage.get("cache_write_tokens", 0),
+                    cost_estimate=model_router.estimate_cost(model_name, usage)
                 )
-                
-                if ai_message:
-                    yield f"data: {json.dumps({'type': 'ai_message_start', 'message_id': ai_message.id})}\n\n"
-                
-                # Stream AI response
-                full_response = ""
-                async for chunk in bedrock_service.generate_chat_response_stream(
-                    user_message=full_user_content,
-                    context_messages=context_messages,
-                    user_id=current_user.id
-                ):
-                    full_response += chunk
-                    yield f"data: {json.dumps({'type': 'content_delta', 'content': chunk})}\n\n"
-                
-                # Update the AI message with full content
-                if ai_message and full_response:
-                    await ai_message.update_content(full_response)
-                    yield f"data: {json.dumps({'type': 'ai_message_complete', 'message': ai_message.to_dict()})}\n\n"
-                
-                # Auto-generate chat name if this is the first user message
-                message_count = len(recent_messages)
-                if message_count <= 1:
-                    try:
-                        name_response = await bedrock_service.generate_chat_name(
-                            message=message_data.content,
-                            file_content=file_content if file_content else None,
-                            file_names=[message_data.file_name] if message_data.file_name else None
-                        )
-                        
-                        if name_response.get("suggested_name"):
-                            chat_name = name_response["suggested_name"]
-                            await chat.update_title(chat_name)
-                            yield f"data: {json.dumps({'type': 'chat_name', 'name': chat_name})}\n\n"
-                    except Exception as e:
-                        logger.warning(f"Failed to generate chat name: {e}")
-                
-                yield f"data: {json.dumps({'type': 'stream_complete'})}\n\n"
-                
+            
+            def final_metadata(stream_status: str) -> dict:
+                return {
+                    "model": stream_info.get("model", "unknown"),
+                    "context_tokens": stream_info.get("context_tokens", {}),
+                    "routing": stream_info.get("routing", {}),
+                    "document_retrieval": document_retrieval,
+                    "usage": stream.usage,
+                    "stream_status": stream_status
+                }
+            
+            try:
+                # Deltas are coalesced into fewer, larger events
+                await stream.publish_answer(answer)
+            except asyncio.CancelledError:
+                # Nobody is following the answer any more. Closing the answer
+                # generator has already closed the Bedrock stream; keep the
+                # partial answer with the tokens it used.
+                partial = stream.partial_content()
+                usage = dict(stream_info.get("usage") or {})
+                if partial and not usage.get("completion_tokens"):
+                    # Output tokens are only reported when the answer ends
+                    usage["completion_tokens"] = estimate_tokens(partial)
+                    usage["total_tokens"] = usage.get("prompt_tokens", 0) + usage["completion_tokens"]
+                    usage["completion_tokens_estimated"] = True
+                stream.usage = usage
+                stream.publish({'type': 'error', 'error': 'Answer generation was cancelled', 'cancelled': True})
+                await ai_message.update(content=partial, metadata=final_metadata("cancelled"))
+                await record_usage()
+                raise
             except Exception as e:
-                logger.error(f"Error in streaming response: {e}")
-                yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
-        
-        return StreamingResponse(
-            generate_response(),
-            media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Content-Type": "text/event-stream",
-            }
-        )
+                # Keep whatever was generated before the failure
+                stream.usage = stream_info.get("usage") or {}
+                await ai_message.update(content=stream.partial_content(), metadata=final_metadata("error"))
+                await record_usage()
+                if not isinstance(e, AdmissionError):
+                    raise
+                logger.warning(f"⚠️ AI model call not admitted: {e}")
+                stream.publish({'type': 'error', 'error': str(e), 'status': admission_status(e), 'retry_after': e.retry_after})
+                return
+            
+            # Update the AI message with full content
+            stream.usage = stream_info.get("usage") or {}
+            full_response = stream.partial_content()
+            await ai_message.update(content=full_response, metadata=final_metadata("complete"))
+            await record_usage()
+            if full_response:
+                stream.publish({'type': 'ai_message_complete', 'message': ai_message.to_dict()})
+            stream.publish({'type': 'stream_complete'})
         
+        # Generation is detached from this connection; a dropped client can
+        # resume from the last event id it received
+        stream = chat_stream_registry.start(ai_message, current_user.id, produce)
+        return event_stream_response(stream)
+    
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing streaming message: {e}")
         raise HTTPException(
@@ -579,13 +860,71 @@ async def send_message_stream(
             detail=f"Failed to process message: {str(e)}"
         )
 
+@app.get("/chats/{chat_id}/messages/{message_id}/stream")
+async def resume_message_stream(
+    chat_id: str,
+    message_id: str,
+    last_event_id: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    """Resume a streamed answer after the event id in the Last-Event-ID header.
+    
+    Answers still generating (or recently finished) in this process replay
+    the missed events and continue with the live tail. An answer another
+    worker is still generating gets 409 with Retry-After, so the client does
+    not take its last checkpoint as final. Otherwise the last checkpoint of
+    the message is sent as a snapshot.
+    """
+    chat = await Chat.get_by_id(chat_id)
+    if not chat or chat.user_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chat not found"
+        )
+    
+    stream = chat_stream_registry.get(message_id)
+    if stream and stream.message.chat_id == chat_id:
+        try:
+            after_id = int(last_event_id or 0)
+        except ValueError:
+            after_id = 0
+        chat_stream_registry.resumed += 1
+        return event_stream_response(stream, after_id)
+    
+    message = await Message.get_by_id(message_id)
+    if not message or message.chat_id != chat_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Message not found"
+        )
+    if chat_stream_registry.generating_elsewhere(message):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The answer is still being generated, please retry shortly",
+            headers={"Retry-After": str(max(int(STREAM_CHECKPOINT_SECONDS), 1))}
+        )
+    
+    async def snapshot():
+        sse = SSEEncoder()
+        try:
+            yield sse.frame(None, {'type': 'ai_message_snapshot', 'message': message.to_dict()})
+            yield sse.frame(None, {'type': 'stream_complete'})
+        finally:
+            sse.close()
+    
+    return StreamingResponse(snapshot(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 # File upload
 @app.post("/files/upload", response_model=FileUploadResponse)
 async def upload_file(
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user)
 ):
-    """Upload a file to S3, extract text, and create database record"""
+    """Upload a file to S3 and queue its text extraction.
+    
+    Returns with processed=false; poll GET /files/{id} or subscribe to
+    GET /files/{id}/events for the processed transition.
+    """
     try:
         allowed_types = ['.pdf', '.doc', '.docx', '.txt']
         file_extension = os.path.splitext(file.filename)[1].lower()
@@ -596,22 +935,32 @@ async def upload_file(
                 detail=f"File type {file_extension} not supported. Allowed types: {', '.join(allowed_types)}"
             )
         
-        file_content = await file.read()
+        # Hash the content first; a blob the user already uploaded is neither
+        # uploaded nor extracted again. The request body is already spooled to
+        # a temporary file (on disk above 1 MB), so neither pass reads it whole.
+        content_sha256, file_size = await s3_service.hash_fileobj(file.file)
+        existing = await FileModel.get_by_sha256(current_user.id, content_sha256)
         
-        # Upload to S3
-        s3_result = await s3_service.upload_file(
-            file_content=file_content,
-            file_name=file.filename,
-            user_id=current_user.id,
-            content_type=file.content_type
-        )
+        if existing:
+            logger.info(f"♻️ Reusing stored blob for {file.filename} ({file_size} bytes)")
+            s3_result = {
+                'file_key': existing.file_path,
+                'file_url': existing.file_url,
+                'file_size': file_size,
+                'content_type': file.content_type or existing.content_type,
+                'original_name': file.filename
+            }
+        else:
+            # Stream the upload to S3 in parts
+            s3_result = await s3_service.upload_fileobj(
+                file_obj=file.file,
+                file_name=file.filename,
+                user_id=current_user.id,
+                content_type=file.content_type,
+                content_sha256=content_sha256
+            )
         
-        # Extract text content
-        extracted_text, extraction_success = await s3_service.extract_text_from_file(
-            file_content=file_content,
-            file_name=file.filename,
-            content_type=file.content_type or "application/octet-stream"
-        )
+        s3_service.record_upload(file_size, deduplicated=existing is not None)
         
         # Create database record
         file_record = await FileModel.create(
@@ -621,8 +970,8 @@ async def upload_file(
             file_url=s3_result['file_url'],
             file_size=s3_result['file_size'],
             content_type=s3_result['content_type'],
-            processed=extraction_success,
-            extraction_text=extracted_text if extraction_success else None
+            processed=False,
+            content_sha256=content_sha256
         )
         
         if not file_record:
@@ -631,8 +980,15 @@ async def upload_file(
                 detail="Failed to create file record"
             )
         
-        return FileUploadResponse.model_validate(file_record.to_dict())
+        if existing and existing.processed:
+            await file_record.copy_extraction_from(existing.id)
+        else:
+            # Text extraction and chunking run on the extraction workers
+            await ExtractionJob.enqueue(file_record.id, max_attempts=EXTRACTION_MAX_ATTEMPTS)
+            extraction_worker.notify()
         
+        return FileUploadResponse.model_validate(file_record.to_dict())
+    
     except Exception as e:
         logger.error(f"File upload error: {e}")
         raise HTTPException(
@@ -642,14 +998,20 @@ async def upload_file(
 
 @app.get("/files", response_model=List[FileUploadResponse])
 async def get_user_files(
+    response: Response,
     current_user: User = Depends(get_current_user),
-    limit: int = 50,
-    offset: int = 0
+    limit: int = Query(50, ge=1, le=MAX_FILE_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    before: Optional[str] = None,
+    after: Optional[str] = None
 ):
-    """Get user's files"""
+    """Get user's files, newest first; page cursors are returned in headers"""
     try:
-        files = await FileModel.get_by_user(current_user.id, limit, offset)
+        files = await FileModel.get_by_user(current_user.id, limit, offset, before, after)
+        set_cursor_headers(response, *page_cursors(files, "created_at", limit))
         return [FileUploadResponse.model_validate(file.to_dict()) for file in files]
+    except ValueError as e:
+        raise invalid_cursor(e)
     except Exception as e:
         logger.error(f"Error fetching files: {e}")
         raise HTTPException(
@@ -657,6 +1019,79 @@ async def get_user_files(
             detail="Failed to fetch files"
         )
 
+async def get_file_status(user_id: str, file_id: str) -> FileStatusResponse:
+    """Processing state of one of the user's files"""
+    file_record = await FileModel.get_by_id(file_id)
+    if not file_record or file_record.user_id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+    
+    job = await ExtractionJob.get_by_file(file_id)
+    if job:
+        extraction_status = job.status
+    else:
+        # Uploaded before the extraction queue existed
+        extraction_status = "done" if file_record.processed else "dead"
+    
+    return FileStatusResponse(
+        id=file_record.id,
+        processed=file_record.processed,
+        extraction_status=extraction_status,
+        attempts=job.attempts if job else 0,
+        error=job.last_error if job else None,
+        updated_at=job.updated_at if job else None
+    )
+
+@app.get("/files/{file_id}", response_model=FileStatusResponse)
+async def get_file(
+    file_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Get a file's extraction status"""
+    return await get_file_status(current_user.id, file_id)
+
+@app.get("/files/{file_id}/events")
+async def stream_file_status(
+    file_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Stream a file's extraction status until it is processed or dead"""
+    initial_status = await get_file_status(current_user.id, file_id)
+    
+    async def generate_events():
+        file_status = initial_status
+        last_sent = None
+        deadline = asyncio.get_running_loop().time() + FILE_EVENTS_TIMEOUT_SECONDS
+        try:
+            while True:
+                payload = file_status.model_dump_json()
+                if payload != last_sent:
+                    yield f"event: status\ndata: {payload}\n\n"
+                    last_sent = payload
+                if file_status.extraction_status in ("done", "dead"):
+                    break
+                if asyncio.get_running_loop().time() >= deadline:
+                    yield "event: timeout\ndata: {}\n\n"
+                    break
+                await asyncio.sleep(FILE_EVENTS_POLL_SECONDS)
+                file_status = await get_file_status(current_user.id, file_id)
+        except HTTPException:
+            yield "event: error\ndata: {\"detail\": \"File not found\"}\n\n"
+        except Exception as e:
+            logger.error(f"Error streaming file status: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+    
+    return StreamingResponse(
+        generate_events(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        }
+    )
+
 handler = Mangum(app)
 
 # Main entry point
@@ -0,0 +1,163 @@
+import os
+import logging
+from typing import Optional, Dict, Any
+
+from cache import TTLCache
+from models import ChatSession
+
+logger = logging.getLogger(__name__)
+
+# Session lifetime, matching the session cookie max_age (7 days)
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', str(60 * 60 * 24 * 7)))
+
+# In-process cache sizing. For shared backends the cache TTL bounds how long a
+# session deleted by another worker can still be accepted by this one.
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '10000'))
+SESSION_CACHE_TTL_SECONDS = int(os.getenv('SESSION_CACHE_TTL_SECONDS', '60'))
+
+# Expired and logged-out session rows are purged once every this many logins
+_PURGE_EVERY_CREATES = 500
+
+class SessionStore:
+    """Session backend interface mapping session ids to user ids"""
+    
+    name = "base"
+    
+    async def create(self, session_id: str, user_id: str) -> None:
+        raise NotImplementedError
+    
+    async def get(self, session_id: str) -> Optional[str]:
+        raise NotImplementedError
+    
+    async def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+class MemorySessionStore(SessionStore):
+    """Per-process LRU store with TTL; sessions are lost on restart"""
+    
+    name = "memory"
+    
+    def __init__(self, maxsize: int = SESSION_CACHE_SIZE, ttl: int = SESSION_TTL_SECONDS):
+        self.sessions = TTLCache(maxsize=maxsize, ttl=ttl)
+    
+    async def create(self, session_id: str, user_id: str) -> None:
+        self.sessions.set(session_id, user_id)
+    
+    async def get(self, session_id: str) -> Optional[str]:
+        return self.sessions.get(session_id)
+    
+    async def delete(self, session_id: str) -> None:
+        self.sessions.pop(session_id)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "cache": self.sessions.stats()}
+
+class PostgresSessionStore(SessionStore):
+    """Sessions persisted in the chat_sessions table with a local read-through cache"""
+    
+    name = "postgres"
+    
+    def __init__(self, ttl: int = SESSION_TTL_SECONDS):
+        self.ttl = ttl
+        self.cache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL_SECONDS)
+        self.purged = 0
+        self._creates = 0
+    
+    async def create(self, session_id: str, user_id: str) -> None:
+        await ChatSession.create(user_id=user_id, chat_id=None, session_token=session_id)
+        self.cache.set(session_id, user_id)
+        self._creates += 1
+        if self._creates % _PURGE_EVERY_CREATES == 0:
+            await self.purge_expired()
+    
+    async def purge_expired(self) -> int:
+        """Delete expired and logged-out session rows"""
+        try:
+            purged = await ChatSession.delete_expired(self.ttl)
+        except Exception as e:
+            # Rows past the TTL are ignored on lookup, so this can wait for the next purge
+            logger.warning(f"⚠️ Session purge failed: {e}")
+            return 0
+        self.purged += purged
+        logger.info(f"🧹 Purged {purged} expired sessions")
+        return purged
+    
+    async def get(self, session_id: str) -> Optional[str]:
+        user_id = self.cache.get(session_id)
+        if user_id:
+            return user_id
+        
+        session = await ChatSession.get_by_token(session_id, max_age_seconds=self.ttl)
+        if not session:
+            return None
+        self.cache.set(session_id, session.user_id)
+        return session.user_id
+    
+    async def delete(self, session_id: str) -> None:
+        self.cache.pop(session_id)
+        await ChatSession.deactivate_token(session_id)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "purged": self.purged, "cache": self.cache.stats()}
+
+class RedisSessionStore(SessionStore):
+    """Sessions stored in any Redis-protocol server with a local read-through cache.
+    
+    Keys carry the session TTL, so the server expires them. ``client`` may be
+    any object with async get/set/delete, e.g. a local stand-in.
+    """
+    
+    name = "redis"
+    key_prefix = "iflychat:session:"
+    
+    def __init__(self, url: Optional[str] = None, ttl: int = SESSION_TTL_SECONDS, client: Any = None):
+        if client is None:
+            try:
+                import redis.asyncio as redis_asyncio
+            except ImportError as e:
+                raise RuntimeError("SESSION_BACKEND=redis requires the redis package") from e
+            client = redis_asyncio.from_url(url, decode_responses=True)
+        
+        self.client = client
+        self.ttl = ttl
+        self.cache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL_SECONDS)
+    
+    async def create(self, session_id: str, user_id: str) -> None:
+        await self.client.set(self.key_prefix + session_id, user_id, ex=self.ttl)
+        self.cache.set(session_id, user_id)
+    
+    async def get(self, session_id: str) -> Optional[str]:
+        user_id = self.cache.get(session_id)
+        if user_id:
+            return user_id
+        
+        user_id = await self.client.get(self.key_prefix + session_id)
+        if user_id:
+            self.cache.set(session_id, user_id)
+        return user_id
+    
+    async def delete(self, session_id: str) -> None:
+        self.cache.pop(session_id)
+        await self.client.delete(self.key_prefix + session_id)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "cache": self.cache.stats()}
+
+def create_session_store(backend: Optional[str] = None) -> SessionStore:
+    """Build the session store selected by SESSION_BACKEND (memory, postgres or redis)"""
+    backend = (backend or os.getenv('SESSION_BACKEND', 'memory')).lower()
+    
+    if backend == "memory":
+        store = MemorySessionStore()
+    elif backend == "postgres":
+        store = PostgresSessionStore()
+    elif backend == "redis":
+        store = RedisSessionStore(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+    else:
+        raise ValueError(f"Unsupported SESSION_BACKEND: {backend}")
+    
+    logger.info(f"🔐 Using {store.name} session store")
+    return store
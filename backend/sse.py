@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # Optional: falls back to the standard library encoder
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Content deltas are buffered until this much time has passed since the first
+# buffered delta, or this many bytes are waiting, then sent as one frame
+SSE_COALESCE_MS = float(os.getenv('SSE_COALESCE_MS', '30'))
+SSE_COALESCE_BYTES = int(os.getenv('SSE_COALESCE_BYTES', '512'))
+# A comment frame is sent after this long without output, so proxies and
+# clients do not drop an idle connection (e.g. while the model is queued)
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+
+HEARTBEAT_FRAME = ": ping\n\n"
+
+def dumps(data: Any) -> str:
+    """Compact JSON, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+class SSEStats:
+    """Counters across all encoded streams; deltas count text pieces before coalescing"""
+    
+    def __init__(self):
+        self.streams = 0
+        self.frames = 0
+        self.bytes = 0
+        self.deltas = 0
+        self.heartbeats = 0
+        self.encode_seconds = 0.0
+    
+    def record(self, encoder: 'SSEEncoder'):
+        """Add the counters of a closed connection"""
+        self.streams += 1
+        self.frames += encoder.frames
+        self.bytes += encoder.bytes
+        self.heartbeats += encoder.heartbeats
+        self.encode_seconds += encoder.encode_seconds
+    
+    def stats(self) -> Dict[str, Any]:
+        streams = max(self.streams, 1)
+        return {
+            "json": "orjson" if orjson is not None else "json",
+            "streams": self.streams,
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "deltas": self.deltas,
+            "heartbeats": self.heartbeats,
+            "deltas_per_frame": round(self.deltas / max(self.frames, 1), 2),
+            "frames_per_stream": round(self.frames / streams, 1),
+            "bytes_per_stream": round(self.bytes / streams),
+            "encode_ms_per_stream": round(self.encode_seconds * 1000 / streams, 3)
+        }
+
+# Create a singleton instance
+sse_stats = SSEStats()
+
+async def coalesce(chunks: AsyncIterator[str], coalesce_ms: float = SSE_COALESCE_MS,
+                   coalesce_bytes: int = SSE_COALESCE_BYTES) -> AsyncIterator[str]:
+    """Join text deltas into larger pieces by time window and size.
+    
+    A task reads the source into a buffer, and the consumer only wakes when
+    a piece is due, not on every delta. Buffered text is released when its
+    window closes even if the next delta has not arrived yet, and waiting
+    never interrupts a slow model call. Reading pauses while a full piece
+    waits for the consumer, so a slow consumer still slows the source. An
+    error from the source is raised once the text before it is released.
+    """
+    loop = asyncio.get_running_loop()
+    window = coalesce_ms / 1000
+    iterator = chunks.__aiter__()
+    buffered: List[str] = []
+    buffered_bytes = 0
+    buffered_since = 0.0
+    finished = False
+    error: Optional[BaseException] = None
+    wakeup: Optional[asyncio.Future] = None
+    drained: Optional[asyncio.Future] = None
+    
+    def wake():
+        if wakeup is not None and not wakeup.done():
+            wakeup.set_result(None)
+    
+    async def pump():
+        nonlocal buffered_bytes, buffered_since, finished, error, drained
+        try:
+            async for text in iterator:
+                if not text:
+                    continue
+                sse_stats.deltas += 1
+                if not buffered:
+                    buffered_since = loop.time()
+                    # The consumer arms the flush timer for the new window
+                    wake()
+                buffered.append(text)
+                buffered_bytes += len(text.encode())
+                if buffered_bytes >= coalesce_bytes:
+                    drained = loop.create_future()
+                    wake()
+                    await drained
+        except Exception as e:
+            error = e
+        finally:
+            finished = True
+            wake()
+    
+    reader = asyncio.ensure_future(pump())
+    try:
+        while True:
+            if buffered and (finished or buffered_bytes >= coalesce_bytes
+                             or loop.time() - buffered_since >= window):
+                text = "".join(buffered)
+                buffered.clear()
+                buffered_bytes = 0
+                if drained is not None and not drained.done():
+                    drained.set_result(None)
+                yield text
+                continue
+            if finished:
+                break
+            wakeup = loop.create_future()
+            timer = loop.call_at(buffered_since + window, wake) if buffered else None
+            try:
+                await wakeup
+            finally:
+                wakeup = None
+                if timer is not None:
+                    timer.cancel()
+        if error is not None:
+            raise error
+    finally:
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+        aclose = getattr(iterator, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+
+class SSEEncoder:
+    """Encodes events for one connection as text/event-stream frames"""
+    
+    def __init__(self, heartbeat_seconds: float = SSE_HEARTBEAT_SECONDS):
+        self.heartbeat_seconds = heartbeat_seconds
+        self.frames = 0
+        self.bytes = 0
+        self.heartbeats = 0
+        self.encode_seconds = 0.0
+    
+    def frame(self, event_id: Optional[int], data: Dict[str, Any]) -> str:
+        """Data frame, with an id a client can resume after when one is given"""
+        started = time.perf_counter()
+        if event_id is None:
+            frame = f"data: {dumps(data)}\n\n"
+        else:
+            frame = f"id: {event_id}\ndata: {dumps(data)}\n\n"
+        self.encode_seconds += time.perf_counter() - started
+        self.frames += 1
+        self.bytes += len(frame.encode())
+        return frame
+    
+    def heartbeat(self) -> str:
+        self.heartbeats += 1
+        self.bytes += len(HEARTBEAT_FRAME)
+        return HEARTBEAT_FRAME
+    
+    def close(self):
+        """Add this stream's counters to the shared stats"""
+        sse_stats.record(self)
+        logger.debug(
+            f"SSE stream: {self.frames} frames, {self.bytes} bytes, "
+            f"{self.encode_seconds * 1000:.2f} ms encoding"
+        )
@@ -0,0 +1,165 @@
+"""Admission control against a fault-injecting stub model"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("botocore")
+
+from botocore.exceptions import ClientError
+
+import admission
+from admission import (
+    CircuitBreaker, ModelAdmission, ModelBusyError, ModelUnavailableError, TokenBucket
+)
+
+def client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "InvokeModel")
+
+class FaultyModel:
+    """Stub model call that fails with the queued errors, then succeeds"""
+    
+    def __init__(self, *faults):
+        self.faults = list(faults)
+        self.calls = 0
+    
+    async def __call__(self):
+        self.calls += 1
+        if self.faults:
+            fault = self.faults.pop(0)
+            if fault is not None:
+                raise fault
+        return {"content": [{"type": "text", "text": "ok"}]}
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(admission, "BEDROCK_RETRY_BASE_SECONDS", 0.001)
+    monkeypatch.setattr(admission, "BEDROCK_RETRY_MAX_SECONDS", 0.005)
+
+def make_admission(threshold: int = 2, cooldown: float = 0.05) -> ModelAdmission:
+    model = ModelAdmission("stub-model")
+    model.breaker = CircuitBreaker(threshold, cooldown)
+    return model
+
+def test_no_rate_limit_until_throttled():
+    model = make_admission()
+    assert not model.bucket.rate
+    
+    async def burst():
+        await asyncio.gather(*(model.call(FaultyModel()) for _ in range(50)))
+    
+    asyncio.run(burst())
+    assert model.admitted == 50
+    assert model.stats()["rate_limited"] is False
+
+def test_throttles_are_retried_and_start_rate_limiting():
+    model = make_admission()
+    stub = FaultyModel(client_error("ThrottlingException"), client_error("ThrottlingException"))
+    
+    result = asyncio.run(model.call(stub))
+    
+    assert result["content"][0]["text"] == "ok"
+    assert stub.calls == 3
+    assert model.retries == 2
+    assert model.throttles == 2
+    assert model.stats()["rate_limited"] is True
+    assert model.breaker.state == "closed"
+
+def test_rate_limit_lifts_once_recovered():
+    bucket = TokenBucket(0, burst=10)
+    for _ in range(20):
+        bucket.reserve(max_wait=1)
+    bucket.decrease(floor=0.5)
+    assert bucket.rate > 0
+    for _ in range(100):
+        bucket.increase()
+    assert bucket.rate == 0
+
+def test_configured_rate_is_a_ceiling():
+    bucket = TokenBucket(4, burst=10)
+    bucket.decrease(floor=0.5)
+    assert bucket.rate == 2
+    for _ in range(100):
+        bucket.increase()
+    assert bucket.rate == 4
+
+def test_persistent_failures_open_the_circuit_and_fail_fast():
+    model = make_admission(threshold=2)
+    unavailable = [client_error("ServiceUnavailableException")] * 20
+    stub = FaultyModel(*unavailable)
+    
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(ModelUnavailableError):
+                await model.call(stub)
+        calls = stub.calls
+        # Open: refused without reaching the model
+        with pytest.raises(ModelUnavailableError):
+            await model.call(stub)
+        assert stub.calls == calls
+    
+    asyncio.run(scenario())
+    assert model.breaker.state == "open"
+    assert model.breaker.opened == 1
+    assert model.failures == 2
+
+def test_half_open_trial_closes_the_circuit():
+    model = make_admission(threshold=1, cooldown=0.02)
+    stub = FaultyModel(*[client_error("ServiceUnavailableException")] * (admission.BEDROCK_MAX_RETRIES + 1))
+    
+    async def scenario():
+        with pytest.raises(ModelUnavailableError):
+            await model.call(stub)
+        assert model.breaker.state == "open"
+        await asyncio.sleep(0.03)
+        return await model.call(stub)
+    
+    assert asyncio.run(scenario())["content"][0]["text"] == "ok"
+    assert model.breaker.state == "closed"
+
+def test_request_errors_are_not_retried_or_counted_against_the_model():
+    model = make_admission(threshold=1)
+    stub = FaultyModel(client_error("ValidationException"))
+    
+    with pytest.raises(ClientError):
+        asyncio.run(model.call(stub))
+    assert stub.calls == 1
+    assert model.retries == 0
+    assert model.breaker.state == "closed"
+
+def test_wait_queue_is_bounded():
+    model = make_admission()
+    model.bucket = TokenBucket(1, burst=1)
+    model.max_queue = 2
+    
+    async def scenario():
+        calls = [asyncio.create_task(model.call(FaultyModel())) for _ in range(4)]
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        return [type(result) for result in results]
+    
+    outcomes = asyncio.run(scenario())
+    assert outcomes.count(dict) == 3
+    assert outcomes.count(ModelBusyError) == 1
+    assert model.rejected == 1
+
+def test_cancelled_half_open_trial_lets_the_next_call_through():
+    model = make_admission(threshold=1, cooldown=0.02)
+    failing = FaultyModel(*[client_error("ServiceUnavailableException")] * (admission.BEDROCK_MAX_RETRIES + 1))
+    
+    async def hang():
+        await asyncio.sleep(10)
+    
+    async def scenario():
+        with pytest.raises(ModelUnavailableError):
+            await model.call(failing)
+        await asyncio.sleep(0.03)
+        # The trial call is cancelled mid-flight, e.g. by a client disconnecting
+        trial = asyncio.create_task(model.call(hang))
+        await asyncio.sleep(0.01)
+        assert model.breaker.trial_in_flight
+        trial.cancel()
+        await asyncio.gather(trial, return_exceptions=True)
+        return await model.call(FaultyModel())
+    
+    assert asyncio.run(scenario())["content"][0]["text"] == "ok"
+    assert model.breaker.state == "closed"
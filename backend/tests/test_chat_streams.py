@@ -0,0 +1,120 @@
+"""Cancelling abandoned answers and resuming them, against local stubs"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("psycopg2")
+
+import chat_streams
+from chat_streams import ChatStreamRegistry
+from models import Message
+
+class StubMessage:
+    """Message whose checkpoint writes are slow, so cancellation can land on them"""
+    
+    def __init__(self, write_seconds: float = 0.0):
+        self.id = "message-1"
+        self.metadata = {}
+        self.write_seconds = write_seconds
+        self.updates = 0
+    
+    async def update(self, **kwargs):
+        self.updates += 1
+        await asyncio.sleep(self.write_seconds)
+
+class SlowModel:
+    """Stub upstream that yields a word every ``delay`` seconds until closed"""
+    
+    def __init__(self, delay: float = 0.02):
+        self.delay = delay
+        self.words = 0
+        self.closed_at = None
+        self.closed_on_exit = False
+    
+    async def stream(self):
+        try:
+            while True:
+                await asyncio.sleep(self.delay)
+                self.words += 1
+                yield "word "
+        finally:
+            self.closed_at = time.monotonic()
+
+async def abandon_mid_stream(message: StubMessage, model: SlowModel):
+    registry = ChatStreamRegistry(retention_seconds=0)
+    
+    async def produce(stream):
+        try:
+            await stream.publish_answer(model.stream())
+        finally:
+            # Closed by the time cancellation leaves publish_answer, not later by the GC
+            model.closed_on_exit = model.closed_at is not None
+    
+    stream = registry.start(message, "user-1", produce)
+    
+    # Follow a few events, then drop the connection
+    events = stream.follow()
+    async for item in events:
+        if item and item[0] >= 3:
+            break
+    await events.aclose()
+    abandoned_at = time.monotonic()
+    
+    await asyncio.wait_for(asyncio.gather(stream.task, return_exceptions=True), timeout=2)
+    return registry, stream, abandoned_at
+
+@pytest.fixture(autouse=True)
+def fast_streams(monkeypatch):
+    monkeypatch.setattr(chat_streams, "STREAM_ABANDON_SECONDS", 0.1)
+    monkeypatch.setattr(chat_streams, "STREAM_CHECKPOINT_SECONDS", 0.0)
+
+def test_abandoned_answer_closes_the_upstream_stream():
+    model = SlowModel()
+    registry, stream, abandoned_at = asyncio.run(abandon_mid_stream(StubMessage(), model))
+    
+    assert stream.abandoned and stream.finished
+    assert registry.cancelled == 1
+    assert model.closed_on_exit
+    assert model.closed_at - abandoned_at < 0.5
+
+def test_cancel_during_checkpoint_closes_the_upstream_stream():
+    # Checkpoint writes take most of the time, so the cancel lands on one
+    # of them rather than inside the model stream
+    message = StubMessage(write_seconds=0.05)
+    model = SlowModel(delay=0.001)
+    registry, stream, abandoned_at = asyncio.run(abandon_mid_stream(message, model))
+    
+    assert message.updates > 0
+    assert registry.cancelled == 1
+    assert model.closed_on_exit
+    assert model.closed_at - abandoned_at < 0.5
+    words = model.words
+    
+    # Nothing keeps reading the upstream after cancellation
+    asyncio.run(asyncio.sleep(0.05))
+    assert model.words == words
+
+def persisted_message(metadata, created_seconds_ago=0.0):
+    created_at = datetime.now(timezone.utc) - timedelta(seconds=created_seconds_ago)
+    return Message(id="message-2", chat_id="chat-1", type="bot", content="partial",
+                   metadata=metadata, created_at=created_at)
+
+def test_answer_streaming_in_another_process_is_not_final():
+    registry = ChatStreamRegistry()
+    recent = (datetime.utcnow() - timedelta(seconds=5)).isoformat()
+    
+    assert registry.generating_elsewhere(persisted_message({"stream_status": "streaming"}))
+    assert registry.generating_elsewhere(persisted_message({"stream_status": "streaming", "checkpointed_at": recent}))
+    assert not registry.generating_elsewhere(persisted_message({"stream_status": "complete"}))
+
+def test_orphaned_answer_is_served_as_a_snapshot():
+    registry = ChatStreamRegistry()
+    stale = (datetime.utcnow() - timedelta(seconds=chat_streams.STREAM_ORPHAN_SECONDS + 1)).isoformat()
+    
+    assert not registry.generating_elsewhere(persisted_message({"stream_status": "streaming", "checkpointed_at": stale}))
+    assert not registry.generating_elsewhere(
+        persisted_message({"stream_status": "streaming"}, created_seconds_ago=chat_streams.STREAM_ORPHAN_SECONDS + 1)
+    )
@@ -0,0 +1,29 @@
+"""Query rewriting for the asyncpg backend"""
+
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from database import _to_asyncpg_query
+
+def test_placeholders_are_numbered_in_order():
+    query = "SELECT * FROM chats WHERE user_id = %s AND updated_at < %s LIMIT %s"
+    assert _to_asyncpg_query(query) == "SELECT * FROM chats WHERE user_id = $1 AND updated_at < $2 LIMIT $3"
+
+def test_percent_escape_becomes_a_literal_percent():
+    query = "SELECT * FROM files WHERE original_name LIKE 'contract%%' AND user_id = %s"
+    assert _to_asyncpg_query(query) == "SELECT * FROM files WHERE original_name LIKE 'contract%' AND user_id = $1"
+
+def test_quoted_strings_and_comments_are_not_rewritten():
+    query = (
+        "SELECT '%s', 'it''s %s', E'\\'%s', \"odd%s\", $$ %s $$ FROM t "
+        "WHERE a = %s -- %s\n AND b = %s /* %s */"
+    )
+    assert _to_asyncpg_query(query) == (
+        "SELECT '%s', 'it''s %s', E'\\'%s', \"odd%s\", $$ %s $$ FROM t "
+        "WHERE a = $1 -- %s\n AND b = $2 /* %s */"
+    )
+
+def test_queries_without_parameters_are_sent_as_is():
+    query = "SELECT * FROM files WHERE original_name LIKE 'a%%'"
+    assert _to_asyncpg_query(query, has_params=False) == query
@@ -0,0 +1,57 @@
+"""Routing away from a throttled or failing model"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("botocore")
+
+from botocore.exceptions import ClientError
+
+import admission
+import model_router
+from admission import AdmissionController
+from model_router import ModelRouter
+
+@pytest.fixture
+def controller(monkeypatch):
+    controller = AdmissionController()
+    monkeypatch.setattr(model_router, "admission_controller", controller)
+    monkeypatch.setattr(admission, "BEDROCK_RETRY_BASE_SECONDS", 0.001)
+    return controller
+
+def throttle(controller: AdmissionController, model_id: str):
+    """Have one call to the model throttled once, then succeed"""
+    responses = [ClientError({"Error": {"Code": "ThrottlingException"}}, "InvokeModel"), None]
+    
+    async def call():
+        response = responses.pop(0)
+        if response is not None:
+            raise response
+        return {}
+    
+    asyncio.run(controller.call(model_id, call))
+
+def long_prompt(router: ModelRouter):
+    return router.route(user_id="user-1", message_tokens=500, history_tokens=3000)
+
+def test_throttled_heavy_model_sends_requests_to_the_light_one(controller):
+    router = ModelRouter(enabled=True, heavy_model="heavy", light_model="light")
+    assert long_prompt(router)["model"] == "heavy"
+    
+    throttle(controller, "heavy")
+    assert admission.BEDROCK_RATE_LIMIT_RPS == 0
+    decision = long_prompt(router)
+    assert decision["model"] == "light"
+    assert decision["reason"] == "heavy throttled"
+
+def test_both_models_throttled_keeps_the_usual_choice(controller):
+    router = ModelRouter(enabled=True, heavy_model="heavy", light_model="light")
+    throttle(controller, "heavy")
+    throttle(controller, "light")
+    assert long_prompt(router)["model"] == "heavy"
+
+def test_open_circuit_sends_requests_to_the_other_model(controller):
+    router = ModelRouter(enabled=True, heavy_model="heavy", light_model="light")
+    controller.for_model("heavy").breaker.state = "open"
+    assert long_prompt(router)["reason"] == "heavy circuit open"
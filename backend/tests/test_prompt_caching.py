@@ -0,0 +1,75 @@
+"""Prompt caching against a local Bedrock stub that echoes each request"""
+
+import asyncio
+import io
+import json
+
+import pytest
+
+pytest.importorskip("boto3")
+pytest.importorskip("psycopg2")
+
+from bedrock_service import BedrockService
+from prompt_context import context_assembler
+
+DOCUMENT = " ".join(f"Clause {n}: the supplier shall deliver the goods in full." for n in range(600))
+
+class EchoBedrockClient:
+    """Stand-in for bedrock-runtime that answers with the request body it received"""
+    
+    def __init__(self):
+        self.requests = []
+    
+    def invoke_model(self, modelId, body, **kwargs):
+        self.requests.append(body)
+        response = {
+            "content": [{"type": "text", "text": body}],
+            "usage": {"input_tokens": 10, "output_tokens": 10}
+        }
+        return {"body": io.BytesIO(json.dumps(response).encode())}
+
+def cached_prefix(raw_body: str) -> str:
+    """Bytes of the request up to the last cache point (everything before the messages)"""
+    return raw_body[:raw_body.index(', "messages": ')]
+
+def run_turns(document_stable: bool, turns: int = 3):
+    service = BedrockService()
+    service.prompt_caching = True
+    service.bedrock_client = EchoBedrockClient()
+    history = []
+    for turn in range(turns):
+        question = f"Question {turn}: " + "what does clause %d require? " % turn * (turn + 1)
+        asyncio.run(service.generate_chat_response(
+            user_message=question,
+            context_messages=list(history),
+            document_text=DOCUMENT,
+            document_name="contract.pdf",
+            document_stable=document_stable
+        ))
+        history += [{"role": "user", "content": question}, {"role": "assistant", "content": "Answer " * 50}]
+    return service.bedrock_client.requests
+
+def test_prefix_is_byte_identical_across_turns():
+    requests = run_turns(document_stable=True)
+    prefixes = {cached_prefix(raw) for raw in requests}
+    assert len(prefixes) == 1
+    system = json.loads(requests[0])["system"]
+    assert "cache_control" in system[-1]
+    assert system[-1]["text"].startswith("File content from contract.pdf")
+    # The turns themselves differ after the prefix
+    assert len({raw[len(cached_prefix(raw)):] for raw in requests}) == len(requests)
+
+def test_truncated_document_keeps_a_stable_prefix(monkeypatch):
+    monkeypatch.setattr(context_assembler, "default_budget", 6000)
+    requests = run_turns(document_stable=True)
+    assert len({cached_prefix(raw) for raw in requests}) == 1
+    assert "[Document truncated" in json.loads(requests[0])["system"][-1]["text"]
+
+def test_per_question_chunks_stay_out_of_the_cached_prefix():
+    requests = run_turns(document_stable=False)
+    for raw in requests:
+        body = json.loads(raw)
+        assert len(body["system"]) == 1
+        # The system prompt alone is below the minimum cacheable size
+        assert "cache_control" not in body["system"][0]
+        assert "File content from contract.pdf" in body["messages"][-1]["content"]
@@ -0,0 +1,125 @@
+"""Session stores against local stand-ins for Redis and the sessions table"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("psycopg2")
+
+import session_store
+from session_store import MemorySessionStore, PostgresSessionStore, RedisSessionStore
+
+class FakeRedis:
+    """In-memory stand-in for the redis.asyncio client commands the store uses"""
+    
+    def __init__(self):
+        self.data = {}
+        self.now = 0.0
+        self.commands = []
+    
+    async def set(self, key, value, ex=None):
+        self.commands.append("SET")
+        self.data[key] = (value, None if ex is None else self.now + ex)
+        return True
+    
+    async def get(self, key):
+        self.commands.append("GET")
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= self.now:
+            del self.data[key]
+            return None
+        return value
+    
+    async def delete(self, key):
+        self.commands.append("DEL")
+        return int(self.data.pop(key, None) is not None)
+
+def test_redis_session_round_trip_is_served_from_the_local_cache():
+    redis = FakeRedis()
+    store = RedisSessionStore(client=redis, ttl=60)
+    
+    async def scenario():
+        await store.create("session-1", "user-1")
+        return await store.get("session-1"), await store.get("missing")
+    
+    assert asyncio.run(scenario()) == ("user-1", None)
+    assert redis.data["iflychat:session:session-1"] == ("user-1", 60)
+    # The hit needed no round trip; only the miss went to Redis
+    assert redis.commands == ["SET", "GET"]
+
+def test_redis_sessions_are_shared_between_workers():
+    redis = FakeRedis()
+    first, second = RedisSessionStore(client=redis), RedisSessionStore(client=redis)
+    
+    async def scenario():
+        await first.create("session-1", "user-1")
+        seen = await second.get("session-1")
+        await second.delete("session-1")
+        return seen, await second.get("session-1")
+    
+    assert asyncio.run(scenario()) == ("user-1", None)
+    assert not redis.data
+
+def test_redis_sessions_expire_with_the_key():
+    redis = FakeRedis()
+    store = RedisSessionStore(client=redis, ttl=60)
+    
+    async def scenario():
+        await store.create("session-1", "user-1")
+        store.cache.clear()
+        redis.now = 61
+        return await store.get("session-1")
+    
+    assert asyncio.run(scenario()) is None
+
+def test_memory_sessions_are_evicted_least_recently_used_first():
+    store = MemorySessionStore(maxsize=2, ttl=60)
+    
+    async def scenario():
+        await store.create("a", "user-a")
+        await store.create("b", "user-b")
+        await store.get("a")
+        await store.create("c", "user-c")
+        return [await store.get(key) for key in ("a", "b", "c")]
+    
+    assert asyncio.run(scenario()) == ["user-a", None, "user-c"]
+
+def test_postgres_store_purges_expired_rows_periodically(monkeypatch):
+    rows = {}
+    purges = []
+    
+    async def create(user_id, chat_id, session_token):
+        rows[session_token] = user_id
+    
+    async def delete_expired(max_age_seconds):
+        purges.append(max_age_seconds)
+        return 3
+    
+    monkeypatch.setattr(session_store.ChatSession, "create", create)
+    monkeypatch.setattr(session_store.ChatSession, "delete_expired", delete_expired)
+    monkeypatch.setattr(session_store, "_PURGE_EVERY_CREATES", 2)
+    store = PostgresSessionStore(ttl=60)
+    
+    async def scenario():
+        for index in range(5):
+            await store.create(f"session-{index}", "user-1")
+    
+    asyncio.run(scenario())
+    assert purges == [60, 60]
+    assert store.stats()["purged"] == 6
+
+def test_failed_purge_does_not_fail_the_login(monkeypatch):
+    async def create(user_id, chat_id, session_token):
+        pass
+    
+    async def delete_expired(max_age_seconds):
+        raise RuntimeError("database unavailable")
+    
+    monkeypatch.setattr(session_store.ChatSession, "create", create)
+    monkeypatch.setattr(session_store.ChatSession, "delete_expired", delete_expired)
+    monkeypatch.setattr(session_store, "_PURGE_EVERY_CREATES", 1)
+    store = PostgresSessionStore(ttl=60)
+    
+    asyncio.run(store.create("session-1", "user-1"))
+    assert store.stats()["purged"] == 0
+    assert asyncio.run(store.get("session-1")) == "user-1"
@@ -0,0 +1,68 @@
+"""Coalescing of streamed text deltas"""
+
+import asyncio
+import time
+
+from sse import coalesce
+
+async def deltas(*pieces, stall_after: int = -1, stall_seconds: float = 0.0):
+    for index, piece in enumerate(pieces):
+        if index == stall_after:
+            await asyncio.sleep(stall_seconds)
+        yield piece
+
+async def collect(pieces):
+    return [piece async for piece in pieces]
+
+def test_size_limit_counts_utf8_bytes():
+    # Each "é" is two bytes, so four characters fill two 4-byte pieces
+    pieces = asyncio.run(collect(coalesce(deltas("é", "é", "é", "é"), coalesce_ms=1000, coalesce_bytes=4)))
+    assert pieces == ["éé", "éé"]
+
+def test_buffered_text_is_released_while_the_source_stalls():
+    async def scenario():
+        started = time.monotonic()
+        released = []
+        source = deltas("a", "b", "c", stall_after=2, stall_seconds=0.2)
+        async for piece in coalesce(source, coalesce_ms=20, coalesce_bytes=1000):
+            released.append((piece, time.monotonic() - started))
+        return released
+    
+    (first, first_at), (second, _) = asyncio.run(scenario())
+    assert (first, second) == ("ab", "c")
+    assert first_at < 0.15
+
+def test_source_errors_are_raised_after_the_text_before_them():
+    async def failing():
+        yield "x"
+        yield "y"
+        raise ValueError("model stream failed")
+    
+    async def scenario():
+        released = []
+        try:
+            async for piece in coalesce(failing(), coalesce_ms=1000):
+                released.append(piece)
+        except ValueError as e:
+            return released, str(e)
+    
+    assert asyncio.run(scenario()) == (["xy"], "model stream failed")
+
+def test_reading_pauses_while_a_full_piece_waits():
+    reads = 0
+    
+    async def source():
+        nonlocal reads
+        for _ in range(100):
+            reads += 1
+            yield "abcd"
+    
+    async def scenario():
+        pieces = coalesce(source(), coalesce_ms=1000, coalesce_bytes=8)
+        first = await pieces.__anext__()
+        await asyncio.sleep(0.05)
+        await pieces.aclose()
+        return first
+    
+    assert asyncio.run(scenario()) == "abcdabcd"
+    assert reads <= 4
@@ -0,0 +1,310 @@
+import asyncio
+import io
+import logging
+import math
+import mmap
+import os
+import re
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import List, Optional, Set, Tuple
+
+import PyPDF2
+import docx
+
+logger = logging.getLogger(__name__)
+
+# Worker processes for extraction; 0 extracts on a thread instead, for
+# environments without process support (e.g. AWS Lambda).
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', str(os.cpu_count() or 1)))
+EXTRACTION_TIMEOUT_SECONDS = float(os.getenv('EXTRACTION_TIMEOUT_SECONDS', '120'))
+# Address space limit per worker process, 0 disables it
+EXTRACTION_MEMORY_LIMIT_MB = int(os.getenv('EXTRACTION_MEMORY_LIMIT_MB', '1024'))
+# Smallest page range handed to one worker
+EXTRACTION_MIN_PAGES_PER_TASK = int(os.getenv('EXTRACTION_MIN_PAGES_PER_TASK', '8'))
+# Times a task is resubmitted after another document's timeout terminated its pool
+EXTRACTION_RESUBMIT_LIMIT = int(os.getenv('EXTRACTION_RESUBMIT_LIMIT', '3'))
+
+# Control characters removed during cleaning. ASCII text can contain nothing
+# else that needs cleaning, and str.translate has a fast path for ASCII input.
+_CONTROL_TABLE = str.maketrans(dict.fromkeys([*range(0x00, 0x09), 0x0b, 0x0c, *range(0x0e, 0x20)]))
+# In other text, surrogates, BOMs and control characters are removed with one
+# regex and typographic punctuation is replaced with ASCII. Both are C-level
+# scans; translate with a table this size goes through a dict per character.
+_REMOVE_PATTERN = re.compile('[\ud800-\udfff\ufeff\ufffe\u0000-\u0008\u000b\u000c\u000e-\u001f]+')
+_REPLACEMENTS = [
+    ('\u2018', "'"),  # Left single quotation mark
+    ('\u2019', "'"),  # Right single quotation mark
+    ('\u201c', '"'),  # Left double quotation mark
+    ('\u201d', '"'),  # Right double quotation mark
+    ('\u2013', '-'),  # En dash
+    ('\u2014', '-'),  # Em dash
+    ('\u2026', '...'),  # Horizontal ellipsis
+    ('\u00a0', ' '),  # Non-breaking space
+]
+
+# Joins fragments cleaned in one pass. It is neither whitespace nor touched by
+# cleaning, so fragment boundaries survive.
+_FRAGMENT_SEPARATOR = '\ue000'
+
+def _normalize_characters(text: str) -> str:
+    """Remove and replace problematic characters, leaving whitespace alone"""
+    if text.isascii():
+        return text.translate(_CONTROL_TABLE)
+    text = _REMOVE_PATTERN.sub('', text)
+    for old_char, new_char in _REPLACEMENTS:
+        if old_char in text:
+            text = text.replace(old_char, new_char)
+    return text
+
+def clean_extracted_text(text: str) -> str:
+    """Clean extracted text to handle encoding issues and problematic characters"""
+    # str.split() splits on the same characters as the regex \s and drops
+    # leading/trailing whitespace, so this collapses and strips in one step.
+    # With surrogates removed the text always encodes as UTF-8, so no
+    # encode/decode round trip is needed.
+    return " ".join(_normalize_characters(text).split())
+
+def clean_fragments(fragments: List[str]) -> List[str]:
+    """Clean many fragments (pages, paragraphs, cells) in a single pass.
+    
+    Output matches calling clean_extracted_text on each fragment.
+    """
+    if not fragments:
+        return []
+    if any(_FRAGMENT_SEPARATOR in fragment for fragment in fragments):
+        return [clean_extracted_text(fragment) for fragment in fragments]
+    cleaned = _normalize_characters(_FRAGMENT_SEPARATOR.join(fragments))
+    return [" ".join(fragment.split()) for fragment in cleaned.split(_FRAGMENT_SEPARATOR)]
+
+# Worker functions. They run in the extraction processes, so they must stay
+# module-level and only take picklable arguments. Documents are passed as file
+# paths rather than bytes so a large file is not pickled to every worker.
+
+def _limit_worker_memory(limit_mb: int):
+    """Process pool initializer capping the worker's address space"""
+    if limit_mb <= 0:
+        return
+    try:
+        import resource
+        limit = limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:
+        logger.warning(f"Could not limit extraction worker memory: {e}")
+
+@contextmanager
+def _mapped_file(path: str):
+    """Memory-map a file read-only; pages are loaded on demand by the OS"""
+    if os.path.getsize(path) == 0:
+        yield io.BytesIO()
+        return
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+def count_pdf_pages(path: str) -> int:
+    """Number of pages in a PDF"""
+    with _mapped_file(path) as pdf_file:
+        return len(PyPDF2.PdfReader(pdf_file).pages)
+
+def extract_pdf_pages(path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Cleaned text of pages [start, end) as (page number, text) pairs"""
+    raw_pages = []
+    with _mapped_file(path) as pdf_file:
+        pdf_reader = PyPDF2.PdfReader(pdf_file)
+        for page_num in range(start, end):
+            try:
+                page_text = pdf_reader.pages[page_num].extract_text()
+                if page_text and page_text.strip():
+                    raw_pages.append((page_num + 1, page_text))
+            except Exception as e:
+                logger.warning(f"Error extracting page {page_num + 1}: {e}")
+                continue
+    
+    # Clean the text to handle encoding issues, all pages in one pass
+    cleaned_pages = clean_fragments([page_text for _, page_text in raw_pages])
+    return [
+        (page_num, cleaned_text)
+        for (page_num, _), cleaned_text in zip(raw_pages, cleaned_pages)
+        if cleaned_text
+    ]
+
+def extract_docx_text(path: str) -> Tuple[str, bool]:
+    """Extract text from DOCX file"""
+    # zipfile reads members from the path on demand
+    doc = docx.Document(path)
+    
+    # Collect paragraphs and table cells first so they are cleaned in one pass
+    paragraphs = [paragraph.text for paragraph in doc.paragraphs if paragraph.text and paragraph.text.strip()]
+    rows = [
+        [cell.text for cell in row.cells if cell.text and cell.text.strip()]
+        for table in doc.tables
+        for row in table.rows
+    ]
+    cleaned = iter(clean_fragments(paragraphs + [cell for row in rows for cell in row]))
+    
+    text_content = []
+    
+    # Extract paragraphs
+    for _ in paragraphs:
+        cleaned_text = next(cleaned)
+        if cleaned_text:
+            text_content.append(cleaned_text)
+    
+    # Extract tables
+    for row in rows:
+        row_text = [cleaned_text for cleaned_text in (next(cleaned) for _ in row) if cleaned_text]
+        if row_text:
+            text_content.append(" | ".join(row_text))
+    
+    if text_content:
+        return "\n\n".join(text_content), True
+    return "No text content found in document", False
+
+class ExtractionError(Exception):
+    """Extraction failed for a reason other than the file's content; retrying may succeed"""
+
+class ExtractionTimeout(ExtractionError):
+    """A document took longer than the extraction timeout"""
+
+class ExtractionCrashed(ExtractionError):
+    """A worker process died while extracting"""
+
+class ExtractionEngine:
+    """Runs CPU-bound document extraction in a process pool.
+    
+    Large PDFs are split into page ranges extracted in parallel. Each document
+    has a timeout. A document that times out has its pool terminated, and work
+    other documents had in flight on that pool is resubmitted to the new one.
+    """
+    
+    def __init__(self, workers: int = EXTRACTION_WORKERS,
+                 timeout: float = EXTRACTION_TIMEOUT_SECONDS,
+                 memory_limit_mb: int = EXTRACTION_MEMORY_LIMIT_MB,
+                 min_pages_per_task: int = EXTRACTION_MIN_PAGES_PER_TASK):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.min_pages_per_task = max(min_pages_per_task, 1)
+        self._executor: Optional[Executor] = None
+        # Pools terminated because a document timed out, not because a worker crashed
+        self._killed: "weakref.WeakSet[Executor]" = weakref.WeakSet()
+        self.timeouts = 0
+        self.crashes = 0
+        self.resubmitted = 0
+    
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.workers > 0:
+                try:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        initializer=_limit_worker_memory,
+                        initargs=(self.memory_limit_mb,)
+                    )
+                    logger.info(f"📄 Extraction process pool started with {self.workers} workers")
+                except (OSError, NotImplementedError) as e:
+                    logger.warning(f"Process pool unavailable for extraction, using a thread: {e}")
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='extraction')
+        return self._executor
+    
+    def _restart_pool(self, executor: Executor):
+        """Drop a pool if it is still the current one, terminating its workers"""
+        if executor is not self._executor:
+            return
+        self._executor = None
+        for process in list((getattr(executor, '_processes', None) or {}).values()):
+            process.terminate()
+        # Pending work is failed with BrokenProcessPool rather than cancelled,
+        # so the documents it belongs to can tell it apart and resubmit it
+        executor.shutdown(wait=False)
+    
+    async def _run(self, used: Set[Executor], func, *args):
+        """Run one task on the pool, resubmitting it if another document's timeout killed the pool"""
+        loop = asyncio.get_running_loop()
+        for _ in range(EXTRACTION_RESUBMIT_LIMIT + 1):
+            executor = self._get_executor()
+            used.add(executor)
+            try:
+                return await loop.run_in_executor(executor, func, *args)
+            except BrokenProcessPool:
+                if executor not in self._killed:
+                    # Any document in flight may have crashed it, so all of them fail retryably
+                    if executor is self._executor:
+                        self.crashes += 1
+                        self._restart_pool(executor)
+                    raise ExtractionCrashed("extraction worker crashed")
+                self.resubmitted += 1
+        raise ExtractionCrashed("extraction interrupted by repeated pool restarts")
+    
+    async def _with_timeout(self, extract, label: str):
+        """Run extract(used) under the document timeout, killing the pool if it hangs"""
+        used: Set[Executor] = set()
+        try:
+            return await asyncio.wait_for(extract(used), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.error(f"❌ {label} extraction timed out after {self.timeout}s")
+            executor = self._executor
+            if executor is not None and executor in used:
+                self._killed.add(executor)
+                self._restart_pool(executor)
+            raise ExtractionTimeout(f"extraction timed out after {self.timeout:.0f} seconds")
+    
+    async def extract_pdf(self, path: str) -> Tuple[str, bool]:
+        """Extract text from a PDF file on disk"""
+        try:
+            async def _extract(used: Set[Executor]):
+                page_count = await self._run(used, count_pdf_pages, path)
+                pages_per_task = max(self.min_pages_per_task, math.ceil(page_count / max(self.workers, 1)))
+                ranges = [
+                    (start, min(start + pages_per_task, page_count))
+                    for start in range(0, page_count, pages_per_task)
+                ]
+                results = await asyncio.gather(*[
+                    self._run(used, extract_pdf_pages, path, start, end)
+                    for start, end in ranges
+                ])
+                return [page for pages in results for page in pages]
+            
+            pages = await self._with_timeout(_extract, "PDF")
+            if pages:
+                text_content = [f"--- Page {page_num} ---\n{text}" for page_num, text in pages]
+                return "\n\n".join(text_content), True
+            return "No text content found in PDF", False
+        
+        except ExtractionError:
+            raise
+        except Exception as e:
+            logger.error(f"PDF extraction error: {e}")
+            return f"Error reading PDF: {str(e)}", False
+    
+    async def extract_docx(self, path: str) -> Tuple[str, bool]:
+        """Extract text from a DOCX file on disk"""
+        try:
+            return await self._with_timeout(lambda used: self._run(used, extract_docx_text, path), "DOCX")
+        except ExtractionError:
+            raise
+        except Exception as e:
+            logger.error(f"DOCX extraction error: {e}")
+            return f"Error reading DOCX: {str(e)}", False
+    
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "timeouts": self.timeouts,
+            "crashes": self.crashes,
+            "resubmitted": self.resubmitted
+        }
+    
+    def shutdown(self):
+        """Stop the worker pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+# Create a singleton instance
+extraction_engine = ExtractionEngine()
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import is_integrity_error
+from models import AIUsage
+
+logger = logging.getLogger(__name__)
+
+# Usage rows are buffered in memory and inserted in batches, once this many
+# are waiting or this many seconds after the previous flush
+USAGE_BATCH_SIZE = int(os.getenv('USAGE_BATCH_SIZE', '100'))
+USAGE_FLUSH_SECONDS = float(os.getenv('USAGE_FLUSH_SECONDS', '2'))
+# Rows kept while the database is unreachable; the oldest are dropped beyond this
+USAGE_MAX_BUFFER = int(os.getenv('USAGE_MAX_BUFFER', '10000'))
+# Off by default on AWS Lambda, where a frozen process would hold the buffer
+USAGE_WRITE_BEHIND = os.getenv(
+    'USAGE_WRITE_BEHIND', 'false' if os.getenv('AWS_LAMBDA_FUNCTION_NAME') else 'true'
+).lower() == 'true'
+
+class UsageRecorder:
+    """Write-behind buffer for ai_usage rows"""
+    
+    def __init__(self, write_behind: bool = USAGE_WRITE_BEHIND, batch_size: int = USAGE_BATCH_SIZE,
+                 flush_seconds: float = USAGE_FLUSH_SECONDS, max_buffer: int = USAGE_MAX_BUFFER):
+        self.write_behind = write_behind
+        self.batch_size = max(batch_size, 1)
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max(max_buffer, self.batch_size)
+        self._buffer: List[Dict[str, Any]] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self.rejected = 0
+    
+    async def record(self, user_id: str, service_type: str, model_name: str,
+                     prompt_tokens: int = 0, completion_tokens: int = 0,
+                     total_tokens: int = 0, cost_estimate: float = 0.0,
+                     chat_id: str = None, message_id: str = None,
+                     cache_read_tokens: int = 0, cache_write_tokens: int = 0):
+        """Queue a usage row; written immediately when write-behind is off"""
+        record = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "service_type": service_type,
+            "model_name": model_name,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": total_tokens,
+            "cache_read_tokens": cache_read_tokens,
+            "cache_write_tokens": cache_write_tokens,
+            "cost_estimate": cost_estimate
+        }
+        self._buffer.append(record)
+        if not self.write_behind or self._stopping:
+            await self.flush()
+            return
+        
+        self._ensure_flusher()
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+    
+    def _ensure_flusher(self):
+        # Started on first use, so it also runs where startup hooks do not
+        if self._flusher is None or self._flusher.done():
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.create_task(self._run())
+    
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+    
+    async def flush(self) -> int:
+        """Insert all buffered rows; rows that fail transiently stay buffered for the next flush"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        written = 0
+        async with self._lock:
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                try:
+                    await AIUsage.create_many(batch)
+                except Exception as e:
+                    self.failures += 1
+                    if not is_integrity_error(e):
+                        logger.warning(f"⚠️ Failed to write {len(batch)} AI usage rows, will retry: {e}")
+                        self._trim()
+                        break
+                    # One bad row (e.g. its chat was deleted mid-stream) fails the
+                    # whole batch; write the rows one at a time to isolate it
+                    handled, row_written = await self._write_rows(batch)
+                    del self._buffer[:handled]
+                    written += row_written
+                    if handled < len(batch):
+                        self._trim()
+                        break
+                    continue
+                del self._buffer[:len(batch)]
+                written += len(batch)
+                self.written += len(batch)
+                self.batches += 1
+        return written
+    
+    async def _write_rows(self, batch: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """Insert rows one by one, dropping rejected rows; returns (handled, written)"""
+        written = 0
+        for handled, row in enumerate(batch):
+            try:
+                await AIUsage.create_many([row])
+            except Exception as e:
+                if not is_integrity_error(e):
+                    logger.warning(f"⚠️ Failed to write AI usage row, will retry: {e}")
+                    return handled, written
+                self.rejected += 1
+                logger.error(f"❌ Dropped AI usage row {row['id']} rejected by the database: {e}")
+                continue
+            written += 1
+            self.written += 1
+            self.batches += 1
+        return len(batch), written
+    
+    def _trim(self):
+        """Drop the oldest rows once the buffer is over its cap"""
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self.dropped += overflow
+            logger.error(f"❌ Dropped {overflow} AI usage rows, buffer full")
+    
+    async def stop(self):
+        """Stop the flusher and write what is left"""
+        # The flusher finishes its current batch rather than being cancelled
+        # mid-insert, which could write the batch twice
+        self._stopping = True
+        flusher, self._flusher = self._flusher, None
+        if flusher is not None:
+            self._wakeup.set()
+            await asyncio.gather(flusher, return_exceptions=True)
+        await self.flush()
+        if self._buffer:
+            logger.error(f"❌ {len(self._buffer)} AI usage rows could not be written on shutdown")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "write_behind": self.write_behind,
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "batches": self.batches,
+            "rows_per_batch": round(self.written / self.batches, 1) if self.batches else 0.0,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "rejected": self.rejected
+        }
+
+# Create a singleton instance
+usage_recorder = UsageRecorder()
@@ -6,6 +6,10 @@ import Chat from './components/Chat';
 import apiService, { authHelpers } from './services/api';
 import './App.css';
 
+// New chats are named in the background; if the name isn't ready with the
+// answer, the chat list is refreshed after this delay to pick it up
+const CHAT_NAME_REFRESH_DELAY_MS = 3000;
+
 const STORAGE_KEYS = {
   USER: 'indifly_user',
   CHATS: 'indifly_chats',
@@ -228,6 +232,8 @@ const ChatApp = () => {
       file_name: files.length > 0 ? files[0].name : undefined
     };
 
+    const isFirstMessage = (currentChat.messages || []).length === 0;
+
     // Add user message to chat immediately
     const chatWithUserMessage = {
       ...currentChat,
@@ -241,6 +247,7 @@ const ChatApp = () => {
       for (const file of files) {
         try {
           const uploadResult = await apiService.uploadFile(file);
+          await apiService.waitForFileProcessed(uploadResult.id);
           uploadedFiles.push(uploadResult);
         } catch (error) {
           console.error('Error uploading file:', error);
@@ -250,6 +257,7 @@ const ChatApp = () => {
       // Send message with file references
       const messageData = {
         content: message.content,
+        file_id: uploadedFiles.length > 0 ? uploadedFiles[0].id : null,
         file_name: uploadedFiles.length > 0 ? uploadedFiles[0].original_name : null,
         file_url: uploadedFiles.length > 0 ? uploadedFiles[0].file_url : null,
         metadata: uploadedFiles.length > 0 ? { files: uploadedFiles } : {}
@@ -257,6 +265,10 @@ const ChatApp = () => {
 
       const response = await apiService.sendMessage(currentChat.id, messageData);
       
+      if (isFirstMessage && !response.chat_name) {
+        setTimeout(loadChats, CHAT_NAME_REFRESH_DELAY_MS);
+      }
+
       // Update active chat with AI response (user message already added)
       if (response.ai_response) {
         const updatedChat = {
@@ -325,6 +337,8 @@ const ChatApp = () => {
       file_name: files.length > 0 ? files[0].name : undefined
     };
 
+    const isFirstMessage = (currentChat.messages || []).length === 0;
+
     // Add user message to chat immediately
     let chatWithUserMessage = {
       ...currentChat,
@@ -338,6 +352,7 @@ const ChatApp = () => {
       for (const file of files) {
         try {
           const uploadResult = await apiService.uploadFile(file);
+          await apiService.waitForFileProcessed(uploadResult.id);
           uploadedFiles.push(uploadResult);
         } catch (error) {
           console.error('Error uploading file:', error);
@@ -347,6 +362,7 @@ const ChatApp = () => {
       // Send message with file references
       const messageData = {
         content: message.content,
+        file_id: uploadedFiles.length > 0 ? uploadedFiles[0].id : null,
         file_name: uploadedFiles.length > 0 ? uploadedFiles[0].original_name : null,
         file_url: uploadedFiles.length > 0 ? uploadedFiles[0].file_url : null,
         metadata: uploadedFiles.length > 0 ? { files: uploadedFiles } : {}
@@ -354,6 +370,7 @@ const ChatApp = () => {
 
       let streamingMessage = null;
       let streamingContent = '';
+      let chatNameReceived = false;
 
       await apiService.sendMessageStream(currentChat.id, messageData, (data) => {
         switch (data.type) {
@@ -395,6 +412,22 @@ const ChatApp = () => {
             }
             break;
             
+          case 'ai_message_snapshot':
+            // Resumed after the server lost the live stream: show the last
+            // saved content of the answer
+            if (streamingMessage) {
+              streamingContent = data.message.content || '';
+              setActiveChat(prev => ({
+                ...prev,
+                messages: prev.messages.map(msg => 
+                  msg.id === streamingMessage.id 
+                    ? { ...msg, content: streamingContent, isStreaming: false }
+                    : msg
+                )
+              }));
+            }
+            break;
+            
           case 'ai_message_complete':
             // Mark message as complete
             if (streamingMessage) {
@@ -411,6 +444,7 @@ const ChatApp = () => {
             
           case 'chat_name':
             // Update chat name
+            chatNameReceived = true;
             setActiveChat(prev => ({
               ...prev,
               title: data.name
@@ -441,6 +475,9 @@ const ChatApp = () => {
             
           case 'stream_complete':
             // Stream finished
+            if (isFirstMessage && !chatNameReceived) {
+              setTimeout(loadChats, CHAT_NAME_REFRESH_DELAY_MS);
+            }
             break;
         }
       });
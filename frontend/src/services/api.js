@@ -1,6 +1,10 @@
 // API service for IFlyChat backend integration
 const API_BASE_URL = process.env.REACT_APP_API_URL;
 
+// Reconnects to an interrupted answer stream before giving up
+const STREAM_RESUME_ATTEMPTS = 5;
+const STREAM_RESUME_DELAY_MS = 1000;
+
 class ApiService {
   constructor() {
     this.baseURL = API_BASE_URL;
@@ -91,6 +95,43 @@ class ApiService {
     });
   }
 
+  // Read an event stream response, calling onEvent with each event's id and data
+  async readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+
+      // A frame can be split across reads; only complete frames (ending in
+      // a blank line) are parsed, the rest waits for the next read
+      buffer += decoder.decode(value, { stream: true });
+      const frames = buffer.split('\n\n');
+      buffer = frames.pop();
+
+      for (const frame of frames) {
+        // Comment lines (heartbeats) carry no data
+        let id = null;
+        const dataLines = [];
+        for (const line of frame.split('\n')) {
+          if (line.startsWith('id:')) {
+            id = line.slice(3).trim();
+          } else if (line.startsWith('data:')) {
+            dataLines.push(line.slice(line.startsWith('data: ') ? 6 : 5));
+          }
+        }
+        if (dataLines.length === 0) continue;
+        try {
+          onEvent(id, JSON.parse(dataLines.join('\n')));
+        } catch (e) {
+          console.warn('Failed to parse SSE data:', frame);
+        }
+      }
+    }
+  }
+
   async sendMessageStream(chatId, messageData, onData) {
     const url = `${this.baseURL}/chats/${chatId}/messages/stream`;
     const config = {
@@ -102,38 +143,48 @@ class ApiService {
       body: JSON.stringify(messageData),
     };
 
-    try {
-      const response = await fetch(url, config);
-      
-      if (!response.ok) {
-        const errorData = await response.json().catch(() => ({}));
-        throw new Error(errorData.detail || `HTTP ${response.status}: ${response.statusText}`);
-      }
-
-      const reader = response.body.getReader();
-      const decoder = new TextDecoder();
+    // The answer keeps generating on the server if the connection drops, so
+    // reconnect to it from the last event received instead of resending
+    let messageId = null;
+    let lastEventId = null;
+    let finished = false;
+    const onEvent = (id, data) => {
+      if (id !== null) lastEventId = id;
+      if (data.type === 'ai_message_start') messageId = data.message_id;
+      if (data.type === 'stream_complete' || data.type === 'error') finished = true;
+      onData(data);
+    };
 
-      while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
+    let attempt = 0;
+    while (true) {
+      try {
+        let response;
+        if (messageId === null) {
+          response = await fetch(url, config);
+        } else {
+          response = await fetch(`${this.baseURL}/chats/${chatId}/messages/${messageId}/stream`, {
+            credentials: 'include',
+            headers: lastEventId !== null ? { 'Last-Event-ID': lastEventId } : {},
+          });
+        }
 
-        const chunk = decoder.decode(value);
-        const lines = chunk.split('\n');
+        if (!response.ok) {
+          const errorData = await response.json().catch(() => ({}));
+          throw new Error(errorData.detail || `HTTP ${response.status}: ${response.statusText}`);
+        }
 
-        for (const line of lines) {
-          if (line.startsWith('data: ')) {
-            try {
-              const data = JSON.parse(line.slice(6));
-              onData(data);
-            } catch (e) {
-              console.warn('Failed to parse SSE data:', line);
-            }
-          }
+        await this.readEventStream(response, onEvent);
+        if (finished || messageId === null) return;
+        throw new Error('Stream ended before the answer was complete');
+      } catch (error) {
+        attempt += 1;
+        if (messageId === null || finished || attempt > STREAM_RESUME_ATTEMPTS) {
+          console.error(`Streaming API request failed: /chats/${chatId}/messages/stream`, error);
+          throw error;
         }
+        console.warn(`Stream interrupted, resuming (attempt ${attempt})`, error);
+        await new Promise(resolve => setTimeout(resolve, STREAM_RESUME_DELAY_MS * attempt));
       }
-    } catch (error) {
-      console.error(`Streaming API request failed: /chats/${chatId}/messages/stream`, error);
-      throw error;
     }
   }
 
@@ -155,6 +206,23 @@ class ApiService {
     });
   }
 
+  async getFileStatus(fileId) {
+    return this.request(`/files/${fileId}`);
+  }
+
+  // Uploads return before text extraction finishes; poll until the file is processed
+  async waitForFileProcessed(fileId, { intervalMs = 1000, timeoutMs = 120000 } = {}) {
+    const deadline = Date.now() + timeoutMs;
+    while (Date.now() < deadline) {
+      const fileStatus = await this.getFileStatus(fileId);
+      if (fileStatus.processed || fileStatus.extraction_status === 'dead') {
+        return fileStatus;
+      }
+      await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    }
+    throw new Error('Timed out waiting for file processing');
+  }
+
   async getUserFiles(limit = 50, offset = 0) {
     return this.request(`/files?limit=${limit}&offset=${offset}`);
   }